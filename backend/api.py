@@ -1,30 +1,164 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import base64
+import io
 import os
+import math
+import atexit
 from datetime import datetime, timedelta
 import json
-from database import DatabaseManager
+from database import print_import_progress
+from storage import OPERATIONS, capacity_status, create_database
+from http_cache import conditional
+import catalog_changes
+import metrics
+from catalog_cache import RouteCatalogCache
+from location_buffer import LocationWriteBuffer
+from live_updates import LiveUpdateHub
+from catalog_import import CatalogImporter, read_routes
+import gtfs
+import polyline
+from json_provider import FastJSONProvider
+from compression import register_compression
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Initialize database manager
-db = DatabaseManager()
+# Request timing is registered first so its after_request hook runs last and covers compression
+metrics.register_metrics(app)
+
+# orjson-backed serialization and gzip/brotli negotiation for every response
+app.json = FastJSONProvider(app)
+register_compression(app)
+
+# Storage backend chosen by STORAGE_BACKEND (MySQL by default); connections are pooled
+# and shared by all request threads
+db = metrics.instrument_storage(create_database(), OPERATIONS)
+
+# Route reads are served from an in-memory snapshot of the catalog
+catalog = RouteCatalogCache(db)
+
+# Upper bound for GET /api/routes?ids=...
+MAX_BATCH_ROUTE_IDS = 200
+
+# Upper bound for /api/search/routes?max_transfers=...
+MAX_TRANSFERS = 3
+
+# Values accepted by ?geometry= on route endpoints
+GEOMETRY_OPTIONS = ('full', 'simplified', 'none')
+
+# Upper bound for GET /api/routes?limit=...
+MAX_ROUTE_PAGE_SIZE = 500
+
+# Route columns ?fields= can select; id is always returned
+ROUTE_FIELDS = ('id', 'name', 'origin', 'destination', 'fare', 'duration', 'frequency', 'type',
+                'created_at', 'updated_at')
+
+# Child data ?include= can add; coordinates are served as the encoded polyline
+ROUTE_INCLUDES = ('stops', 'coordinates')
+
+# Upper bound for /api/stops/nearby?radius=... in km
+MAX_NEARBY_RADIUS_KM = 25
 
-@app.before_request
 def initialize_database():
-    """Initialize database connection and create tables"""
+    """Create the connection pool and bring the schema up to date, once per process"""
     if db.connect():
-        db.create_tables()
-        print("Database initialized successfully")
-    else:
-        print("Failed to initialize database")
+        db.ensure_schema()
+        return True
+    print("Failed to initialize database")
+    return False
+
+initialize_database()
+
+@app.before_request
+def ensure_database():
+    """Retry initialization if the database was unreachable at startup"""
+    if not db.pool:
+        initialize_database()
+
+@app.before_request
+def tag_client():
+    """Send this client's reads to the primary for a few seconds after it writes"""
+    # Only an explicit id: clients behind one proxy or NAT share an address
+    db.set_client(request.headers.get('X-Client-Id'))
+
+# GPS pings from the batch endpoint are written behind the request
+location_buffer = LocationWriteBuffer(db)
+location_buffer.start()
+
+# Position updates pushed to /api/buses/stream subscribers
+live_updates = LiveUpdateHub(db)
+live_updates.start()
+
+# Upper bound for POST /api/buses/locations:batch
+MAX_LOCATION_BATCH = 1000
+
+def coordinate(value, limit):
+    """value as a float within -limit..limit degrees, or None if it is not one"""
+    if isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if -limit <= value <= limit else None
+
+def shutdown():
+    """Flush queued pings and close pooled connections when the worker process exits"""
+    live_updates.stop()
+    location_buffer.stop()
+    db.disconnect()
 
-@app.teardown_appcontext
-def close_database(error):
-    """Close database connection"""
-    if hasattr(db, 'connection') and db.connection:
-        db.disconnect()
+atexit.register(shutdown)
+
+# Gauges and counters sampled from the live objects when /api/metrics is scraped
+POOL_STATES = ('size', 'open', 'idle', 'in_use')
+
+def pool_connections():
+    stats = db.pool.stats() if db.pool else {}
+    return {(db.backend, state): stats.get(state, 0) for state in POOL_STATES}
+
+def replica_samples(field):
+    replicas = db.replicas.stats()['replicas'] if db.replicas else []
+    return {(replica['name'],): replica[field] for replica in replicas}
+
+def replica_pool_connections():
+    replicas = db.replicas.stats()['replicas'] if db.replicas else []
+    return {(replica['name'], state): replica['pool'][state] for replica in replicas for state in POOL_STATES}
+
+def location_buffer_totals():
+    stats = location_buffer.stats()
+    return {(outcome,): stats[outcome] for outcome in ('accepted', 'rejected', 'flushed')}
+
+def catalog_lookups():
+    stats = catalog.stats()
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+metrics.REGISTRY.sampled('db_pool_connections', 'Storage connections by state (size is the pool limit)',
+                         ('backend', 'state'), pool_connections)
+metrics.REGISTRY.sampled('db_pool_timeouts_total', 'Borrowers that gave up waiting for a pooled connection',
+                         ('backend',), lambda: {(db.backend,): db.pool.stats().get('timeouts') if db.pool else 0},
+                         kind='counter')
+metrics.REGISTRY.sampled('db_replica_in_rotation', 'Whether a read replica is receiving reads', ('replica',),
+                         lambda: {labels: int(value) for labels, value in replica_samples('in_rotation').items()})
+metrics.REGISTRY.sampled('db_replica_lag_seconds', 'Replication lag at the last check', ('replica',),
+                         lambda: replica_samples('lag_seconds'))
+metrics.REGISTRY.sampled('db_replica_reads_total', 'Reads sent to each replica', ('replica',),
+                         lambda: replica_samples('reads'), kind='counter')
+metrics.REGISTRY.sampled('db_replica_pool_connections', 'Replica connections by state (size is the pool limit)',
+                         ('replica', 'state'), replica_pool_connections)
+metrics.REGISTRY.sampled('db_connected', 'Whether storage is connected', (),
+                         lambda: {(): 1 if db.pool else 0})
+metrics.REGISTRY.sampled('location_buffer_queue_depth', 'GPS pings waiting to be written', (),
+                         lambda: {(): location_buffer.depth()})
+metrics.REGISTRY.sampled('location_buffer_pings_total', 'GPS pings by outcome', ('outcome',),
+                         location_buffer_totals, kind='counter')
+metrics.REGISTRY.sampled('catalog_cache_lookups_total', 'Route catalog cache lookups', ('result',),
+                         catalog_lookups, kind='counter')
+metrics.REGISTRY.sampled('catalog_cache_routes', 'Routes in the cached catalog snapshot', (),
+                         lambda: {(): catalog.stats()['routes']})
+metrics.REGISTRY.sampled('live_stream_subscribers', 'Open /api/buses/stream connections', (),
+                         lambda: {(): live_updates.subscriber_count()})
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -32,22 +166,157 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'database': 'connected' if db.connection and db.connection.is_connected() else 'disconnected'
+        'database': 'connected' if db.is_connected() else 'disconnected',
+        'storage': {'backend': db.backend, 'read_only': db.read_only},
+        'replicas': db.replicas.stats() if db.replicas else None,
+        'catalog_cache': catalog.stats(),
+        'location_buffer': location_buffer.stats(),
+        'stream_subscribers': live_updates.subscriber_count()
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of this worker process"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+def geometry_tolerance(default):
+    """Shape tolerance for ?geometry=full|simplified|none&zoom=N, or an error response"""
+    geometry = request.args.get('geometry', default)
+    if geometry not in GEOMETRY_OPTIONS:
+        return None, (jsonify({
+            'success': False,
+            'error': f"geometry must be one of: {', '.join(GEOMETRY_OPTIONS)}"
+        }), 400)
+    return polyline.tolerance_for(geometry, request.args.get('zoom', type=int)), None
+
+def encode_cursor(route_id):
+    """Opaque ?cursor= value for the page after route_id"""
+    return base64.urlsafe_b64encode(route_id.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Route id a ?cursor= value points after, or None if it is malformed"""
+    try:
+        route_id = base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return route_id or None
+
+def parse_list(name, allowed):
+    """Comma separated ?name= values (None if absent), or an error response for unknown ones"""
+    raw = request.args.get(name)
+    if raw is None:
+        return None, None
+    values = {value.strip() for value in raw.split(',') if value.strip()}
+    unknown = values - set(allowed)
+    if unknown:
+        return None, (jsonify({
+            'success': False,
+            'error': f"Unknown {name}: {', '.join(sorted(unknown))}; expected some of: {', '.join(allowed)}"
+        }), 400)
+    return values, None
+
+def route_projection():
+    """Route keys to return for ?fields= and ?include= (None for everything) and the includes, or an error"""
+    fields, error = parse_list('fields', ROUTE_FIELDS)
+    if error:
+        return None, None, error
+    includes, error = parse_list('include', ROUTE_INCLUDES)
+    if error:
+        return None, None, error
+
+    if fields is None and includes is None:
+        return None, set(ROUTE_INCLUDES), None
+    # Asking for fields alone means no child data
+    keep = (fields | {'id'}) if fields is not None else set(ROUTE_FIELDS)
+    includes = includes or set()
+    if 'stops' in includes:
+        keep.add('stops')
+    if 'coordinates' in includes:
+        keep.add('polyline')
+    return keep, includes, None
+
+def project(views, keep):
+    """Route views reduced to the keys in keep"""
+    if keep is None:
+        return views
+    return [{key: value for key, value in view.items() if key in keep} for view in views]
+
 @app.route('/api/routes', methods=['GET'])
+@conditional(lambda: catalog.version())
 def get_routes():
-    """Get all routes or search routes by origin/destination"""
+    """Get all routes, search routes by origin/destination, or fetch several routes by id"""
     origin = request.args.get('origin')
     destination = request.args.get('destination')
-    
-    try:
-        routes = db.get_routes(origin, destination)
+    ids = request.args.get('ids')
+    tolerance, error = geometry_tolerance('simplified')
+    if error:
+        return error
+    keep, includes, error = route_projection()
+    if error:
+        return error
+    if 'coordinates' not in includes:
+        tolerance = None
+
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor')
+    if limit is not None and not 1 <= limit <= MAX_ROUTE_PAGE_SIZE:
         return jsonify({
+            'success': False,
+            'error': f'limit must be between 1 and {MAX_ROUTE_PAGE_SIZE}'
+        }), 400
+    after_id = None
+    if cursor is not None:
+        after_id = decode_cursor(cursor)
+        if after_id is None:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid cursor'
+            }), 400
+    paged = limit is not None or cursor is not None
+
+    try:
+        if ids:
+            route_ids = [i.strip() for i in ids.split(',') if i.strip()]
+            if len(route_ids) > MAX_BATCH_ROUTE_IDS:
+                return jsonify({
+                    'success': False,
+                    'error': f'At most {MAX_BATCH_ROUTE_IDS} route ids can be requested at once'
+                }), 400
+
+            routes = catalog.get_routes_by_ids(route_ids)
+            found = {r['id'] for r in routes}
+            return jsonify({
+                'success': True,
+                'data': project(catalog.present(routes, tolerance), keep),
+                'count': len(routes),
+                'missing': [i for i in route_ids if i not in found]
+            })
+
+        if origin and destination:
+            routes = catalog.get_routes(origin, destination)
+            if paged:
+                routes = sorted((r for r in routes if after_id is None or r['id'] > after_id),
+                                key=lambda r: r['id'])
+                if limit is not None:
+                    routes = routes[:limit + 1]
+        else:
+            # One row past the page tells whether there is a next one
+            routes = catalog.get_routes_page(after_id, limit + 1 if limit is not None else None,
+                                             stops='stops' in includes, shapes=tolerance is not None)
+
+        next_cursor = None
+        if limit is not None and len(routes) > limit:
+            routes = routes[:limit]
+            next_cursor = encode_cursor(routes[-1]['id'])
+
+        body = {
             'success': True,
-            'data': routes,
+            'data': project(catalog.present(routes, tolerance), keep),
             'count': len(routes)
-        })
+        }
+        if paged:
+            body['next_cursor'] = next_cursor
+        return jsonify(body)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -55,16 +324,20 @@ def get_routes():
         }), 500
 
 @app.route('/api/routes/<route_id>', methods=['GET'])
+@conditional(lambda: catalog.version())
 def get_route(route_id):
     """Get specific route details"""
+    tolerance, error = geometry_tolerance('full')
+    if error:
+        return error
+    
     try:
-        routes = db.get_routes()
-        route = next((r for r in routes if r['id'] == route_id), None)
+        route = catalog.get_route(route_id)
         
         if route:
             return jsonify({
                 'success': True,
-                'data': route
+                'data': catalog.present([route], tolerance)[0]
             })
         else:
             return jsonify({
@@ -92,13 +365,19 @@ def create_route():
                     'error': f'Missing required field: {field}'
                 }), 400
         
-        success = db.insert_route(route_data)
+        counts = catalog.import_route(route_data)
         
-        if success:
+        if counts['routes']:
             return jsonify({
                 'success': True,
                 'message': 'Route created successfully'
             }), 201
+        elif counts['skipped']:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid route',
+                'errors': counts['errors']
+            }), 400
         else:
             return jsonify({
                 'success': False,
@@ -111,6 +390,77 @@ def create_route():
             'error': str(e)
         }), 500
 
+def format_live_bus(bus, route_id=None):
+    """Shape a get_live_buses row for the frontend"""
+    return {
+        'id': bus['bus_id'],
+        'routeId': bus.get('route_id') or route_id or 'unknown',
+        'busNumber': bus['bus_number'],
+        'position': [float(bus['latitude']), float(bus['longitude'])],
+        'currentStop': bus['current_stop_name'],
+        'nextStop': bus['next_stop_name'],
+        'vehicleType': bus['vehicle_type'],
+        'capacity': {
+            'total': bus['total_seats'],
+            'occupied': bus['occupied_seats'],
+            'available': bus['total_seats'] - bus['occupied_seats'],
+            'status': capacity_status(bus['occupied_seats'], bus['total_seats'])
+        },
+        'delay': {
+            'minutes': bus['delay_minutes'],
+            'reason': bus['delay_reason']
+        },
+        'lastUpdated': bus['timestamp'].isoformat() if bus['timestamp'] else None
+    }
+
+@app.route('/api/catalog/changes', methods=['GET'])
+def get_catalog_changes():
+    """Routes, stops and stop lists changed or deleted since a sync token, for clients keeping an offline copy"""
+    since = request.args.get('since', '')
+    limit = min(max(request.args.get('limit', catalog_changes.DEFAULT_PAGE_SIZE, type=int), 1),
+                catalog_changes.MAX_PAGE_SIZE)
+    try:
+        after = catalog_changes.decode_token(since)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    try:
+        result = db.get_catalog_changes(after, limit)
+        if result is None:
+            return jsonify({
+                'success': False,
+                'error': 'Catalog changes are unavailable'
+            }), 503
+
+        changes = result['changes']
+        # Entities changed and then removed before this read count as deleted too
+        current = {('route', r['id']) for r in result['routes']} | {('stop', s['id']) for s in result['stops']}
+        deleted = {entity: [] for entity in catalog_changes.ENTITIES}
+        for change in changes:
+            if (change['entity'], change['entity_id']) not in current:
+                deleted[change['entity']].append(change['entity_id'])
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'routes': result['routes'],
+                'stops': result['stops'],
+                'route_stops': result['route_stops'],
+                'deleted': {'routes': deleted['route'], 'stops': deleted['stop']}
+            },
+            'count': len(changes),
+            'next_since': catalog_changes.encode_token(changes[-1]) if changes else since,
+            'has_more': len(changes) == limit
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/buses/live', methods=['GET'])
 def get_live_buses():
     """Get live bus locations"""
@@ -120,30 +470,7 @@ def get_live_buses():
         buses = db.get_live_buses(route_id)
         
         # Format bus data for frontend
-        formatted_buses = []
-        for bus in buses:
-            formatted_bus = {
-                'id': bus['bus_id'],
-                'routeId': route_id or 'unknown',
-                'busNumber': bus['bus_number'],
-                'position': [float(bus['latitude']), float(bus['longitude'])],
-                'currentStop': bus['current_stop_name'],
-                'nextStop': bus['next_stop_name'],
-                'vehicleType': bus['vehicle_type'],
-                'capacity': {
-                    'total': bus['total_seats'],
-                    'occupied': bus['occupied_seats'],
-                    'available': bus['total_seats'] - bus['occupied_seats'],
-                    'status': 'full' if bus['occupied_seats'] >= bus['total_seats'] * 0.9 else 
-                             'moderate' if bus['occupied_seats'] >= bus['total_seats'] * 0.7 else 'available'
-                },
-                'delay': {
-                    'minutes': bus['delay_minutes'],
-                    'reason': bus['delay_reason']
-                },
-                'lastUpdated': bus['timestamp'].isoformat() if bus['timestamp'] else None
-            }
-            formatted_buses.append(formatted_bus)
+        formatted_buses = [format_live_bus(bus, route_id) for bus in buses]
         
         return jsonify({
             'success': True,
@@ -157,11 +484,29 @@ def get_live_buses():
             'error': str(e)
         }), 500
 
+@app.route('/api/buses/stream', methods=['GET'])
+def stream_live_buses():
+    """Stream live bus position updates as Server-Sent Events"""
+    route_id = request.args.get('route_id')
+    
+    if live_updates.is_full():
+        return jsonify({
+            'success': False,
+            'error': 'Too many live stream clients, retry later'
+        }), 503
+    
+    # Start with the current positions, then send only changes; the stream
+    # subscribes when it starts and unsubscribes when the client goes away
+    initial = [format_live_bus(bus, route_id) for bus in db.get_live_buses(route_id)]
+    return Response(
+        stream_with_context(live_updates.stream(route_id, initial)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/buses/<bus_id>/location', methods=['POST'])
-def update_bus_location():
+def update_bus_location(bus_id):
     """Update bus location"""
-    bus_id = request.view_args['bus_id']
-    
     try:
         data = request.get_json()
         
@@ -172,10 +517,18 @@ def update_bus_location():
                 'error': 'Latitude and longitude are required'
             }), 400
         
+        latitude = coordinate(data['latitude'], 90)
+        longitude = coordinate(data['longitude'], 180)
+        if latitude is None or longitude is None:
+            return jsonify({
+                'success': False,
+                'error': 'latitude must be within -90..90 and longitude within -180..180'
+            }), 400
+        
         success = db.update_bus_location(
             bus_id=bus_id,
-            latitude=data['latitude'],
-            longitude=data['longitude'],
+            latitude=latitude,
+            longitude=longitude,
             current_stop_id=data.get('current_stop_id'),
             next_stop_id=data.get('next_stop_id'),
             occupied_seats=data.get('occupied_seats', 0),
@@ -184,6 +537,8 @@ def update_bus_location():
         )
         
         if success:
+            live_updates.publish([{**data, 'bus_id': bus_id, 'latitude': latitude, 'longitude': longitude,
+                                   'timestamp': datetime.now()}])
             return jsonify({
                 'success': True,
                 'message': 'Bus location updated successfully'
@@ -200,6 +555,159 @@ def update_bus_location():
             'error': str(e)
         }), 500
 
+@app.route('/api/buses/locations:batch', methods=['POST'])
+def batch_update_bus_locations():
+    """Queue many bus location pings for a background batched write"""
+    data = request.get_json(silent=True) or {}
+    pings = data.get('locations') if isinstance(data, dict) else data
+    
+    if not isinstance(pings, list) or not pings:
+        return jsonify({
+            'success': False,
+            'error': 'A non-empty list of locations is required'
+        }), 400
+    
+    if len(pings) > MAX_LOCATION_BATCH:
+        return jsonify({
+            'success': False,
+            'error': f'At most {MAX_LOCATION_BATCH} locations can be sent at once'
+        }), 400
+    
+    received_at = datetime.now()
+    rows = []
+    errors = []
+    for index, ping in enumerate(pings):
+        if not isinstance(ping, dict) or not ping.get('bus_id') \
+                or ping.get('latitude') is None or ping.get('longitude') is None:
+            errors.append({'index': index, 'error': 'bus_id, latitude and longitude are required'})
+            continue
+        latitude = coordinate(ping['latitude'], 90)
+        longitude = coordinate(ping['longitude'], 180)
+        if latitude is None or longitude is None:
+            errors.append({'index': index, 'error': 'latitude must be within -90..90 and longitude within -180..180'})
+            continue
+        try:
+            recorded_at = datetime.fromisoformat(ping['timestamp']) if ping.get('timestamp') else received_at
+        except (TypeError, ValueError):
+            errors.append({'index': index, 'error': 'timestamp must be an ISO 8601 string'})
+            continue
+        if recorded_at.tzinfo is not None:
+            # Stored timestamps are naive local time, like NOW() in the database
+            recorded_at = recorded_at.astimezone().replace(tzinfo=None)
+        rows.append({
+            'bus_id': ping['bus_id'],
+            'latitude': latitude,
+            'longitude': longitude,
+            'current_stop_id': ping.get('current_stop_id'),
+            'next_stop_id': ping.get('next_stop_id'),
+            'occupied_seats': ping.get('occupied_seats', 0),
+            'delay_minutes': ping.get('delay_minutes', 0),
+            'delay_reason': ping.get('delay_reason'),
+            'timestamp': recorded_at
+        })
+    
+    if not rows:
+        return jsonify({
+            'success': False,
+            'error': 'No valid locations in the batch',
+            'errors': errors
+        }), 400
+    
+    accepted = location_buffer.submit(rows)
+    # Queued pings reach subscribers before the buffer stores them. Pings for
+    # buses that don't exist would be dropped by INSERT IGNORE, so publish()
+    # skips buses missing from the bus -> route map.
+    live_updates.publish(rows[:accepted])
+    if not accepted:
+        return jsonify({
+            'success': False,
+            'error': 'Location queue is full, retry later'
+        }), 503
+    
+    return jsonify({
+        'success': True,
+        'accepted': accepted,
+        'rejected': len(pings) - accepted,
+        'errors': errors,
+        'queue_depth': location_buffer.depth()
+    }), 202
+
+@app.route('/api/stops/search', methods=['GET'])
+def search_stops():
+    """Autocomplete stops by name, including Sinhala/Tamil/English aliases"""
+    query = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    if not query:
+        return jsonify({
+            'success': False,
+            'error': 'Query parameter q is required'
+        }), 400
+    
+    try:
+        stops = catalog.search_stops(query, limit)
+        return jsonify({
+            'success': True,
+            'data': stops,
+            'count': len(stops)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/stops/nearby', methods=['GET'])
+def get_nearby_stops():
+    """Stops near a point, nearest first, with the routes serving each"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = min(max(request.args.get('radius', 1.0, type=float), 0.01), MAX_NEARBY_RADIUS_KM)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    
+    if lat is None or lng is None:
+        return jsonify({
+            'success': False,
+            'error': 'lat and lng are required'
+        }), 400
+    
+    try:
+        stops = catalog.nearby_stops(lat, lng, radius, limit)
+        for stop in stops:
+            # Average walking speed of 5 km/h, as the frontend assumes
+            stop['walkingTime'] = math.ceil(stop['distance'] / 5 * 60)
+        return jsonify({
+            'success': True,
+            'data': stops,
+            'count': len(stops)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def format_arrival(arrival):
+    """Shape a get_bus_arrivals row for the frontend"""
+    eta_minutes = (arrival['estimated_arrival'] - datetime.now()).total_seconds() / 60
+    
+    return {
+        'busId': arrival['bus_id'],
+        'busNumber': arrival['bus_number'],
+        'routeName': arrival['route_name'],
+        'vehicleType': arrival['vehicle_type'],
+        'eta': max(0, int(eta_minutes)),
+        'estimatedArrival': arrival['estimated_arrival'].isoformat(),
+        'actualArrival': arrival['actual_arrival'].isoformat() if arrival['actual_arrival'] else None,
+        'delay': arrival['delay_minutes'],
+        'capacity': {
+            'status': arrival['capacity_status'],
+            'total': arrival['total_seats']
+        }
+    }
+
 @app.route('/api/stops/<stop_id>/arrivals', methods=['GET'])
 def get_stop_arrivals(stop_id):
     """Get bus arrivals for a specific stop"""
@@ -209,25 +717,7 @@ def get_stop_arrivals(stop_id):
         arrivals = db.get_bus_arrivals(stop_id, limit)
         
         # Format arrival data
-        formatted_arrivals = []
-        for arrival in arrivals:
-            eta_minutes = (arrival['estimated_arrival'] - datetime.now()).total_seconds() / 60
-            
-            formatted_arrival = {
-                'busId': arrival['bus_id'],
-                'busNumber': arrival['bus_number'],
-                'routeName': arrival['route_name'],
-                'vehicleType': arrival['vehicle_type'],
-                'eta': max(0, int(eta_minutes)),
-                'estimatedArrival': arrival['estimated_arrival'].isoformat(),
-                'actualArrival': arrival['actual_arrival'].isoformat() if arrival['actual_arrival'] else None,
-                'delay': arrival['delay_minutes'],
-                'capacity': {
-                    'status': arrival['capacity_status'],
-                    'total': arrival['total_seats']
-                }
-            }
-            formatted_arrivals.append(formatted_arrival)
+        formatted_arrivals = [format_arrival(arrival) for arrival in arrivals]
         
         return jsonify({
             'success': True,
@@ -296,11 +786,13 @@ def add_user_favorite(user_id):
         }), 500
 
 @app.route('/api/search/routes', methods=['GET'])
+@conditional(lambda: catalog.version())
 def search_routes():
     """Advanced route search with intermediate stops"""
     origin = request.args.get('origin')
     destination = request.args.get('destination')
     include_transfers = request.args.get('include_transfers', 'false').lower() == 'true'
+    max_transfers = min(max(request.args.get('max_transfers', 2, type=int), 1), MAX_TRANSFERS)
     
     if not origin or not destination:
         return jsonify({
@@ -308,20 +800,23 @@ def search_routes():
             'error': 'Both origin and destination are required'
         }), 400
     
+    tolerance, error = geometry_tolerance('simplified')
+    if error:
+        return error
+    
     try:
         # Get direct routes
-        direct_routes = db.get_routes(origin, destination)
+        direct_routes = catalog.get_routes(origin, destination)
         
         results = {
-            'direct_routes': direct_routes,
+            'direct_routes': catalog.present(direct_routes, tolerance),
             'transfer_routes': []
         }
         
         # If no direct routes and transfers are requested, find transfer options
         if not direct_routes and include_transfers:
-            # This would implement the transfer logic from routeUtils.js
-            # For now, return empty transfer routes
-            results['transfer_routes'] = []
+            journeys = catalog.plan_journeys(origin, destination, max_transfers=max_transfers)
+            results['transfer_routes'] = [j for j in journeys if j['transfers'] > 0]
         
         return jsonify({
             'success': True,
@@ -336,17 +831,62 @@ def search_routes():
             'error': str(e)
         }), 500
 
+@app.route('/api/gtfs', methods=['GET'])
+def export_gtfs():
+    """Download the route network as a GTFS feed, streamed as it is zipped"""
+    if not db.is_connected():
+        return jsonify({
+            'success': False,
+            'error': 'Storage is not available'
+        }), 503
+    
+    return Response(
+        gtfs.export_feed(db),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=gtfs.zip'}
+    )
+
 @app.route('/api/migrate-data', methods=['POST'])
 def migrate_sample_data():
-    """Migrate sample data from routes.js to database"""
+    """Bulk import routes from an uploaded file (JSON, JSON Lines or GTFS zip), a JSON body, or the sample data"""
     try:
-        # This would import and migrate the sample data
-        # For now, return success message
+        upload = request.files.get('file')
+        body = request.get_json(silent=True) if request.is_json else None
+        
+        importer = CatalogImporter(db, progress=print_import_progress)
+        if upload and (upload.filename or '').endswith('.zip'):
+            # GTFS feeds are staged on disk and imported route by route
+            counts = importer.run(gtfs.read_feed(upload.stream))
+        elif upload:
+            # JSON Lines uploads are streamed route by route instead of loaded whole
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8')
+            counts = importer.run(read_routes(stream, upload.filename or ''))
+        elif body and isinstance(body.get('routes'), list):
+            counts = importer.run(body['routes'])
+        else:
+            from data.routes import busRoutes
+            counts = importer.run(busRoutes)
+        
+        catalog.invalidate()
+        
+        if counts['failed_batches']:
+            return jsonify({
+                'success': False,
+                'error': f"{counts['failed_batches']} batches failed to import",
+                'data': counts
+            }), 500
+        
         return jsonify({
             'success': True,
-            'message': 'Data migration completed successfully'
+            'message': f"Imported {counts['routes']} routes in {counts['seconds']}s",
+            'data': counts
         })
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid route file: {e}'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
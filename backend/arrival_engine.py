@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from geo import EARTH_RADIUS_KM, stop_position
+from storage import STORAGE_ERRORS, capacity_status
+
+# Named lock so only one process computes predictions per tick
+LOCK_NAME = 'sri_lanka_bus_arrival_engine'
+
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+
+# Used when a route has no usable duration to derive its average speed from
+DEFAULT_SPEED_KMH = 25.0
+
+# A stop less than this far behind the bus counts as reached, not passed
+PASSED_TOLERANCE_KM = 0.05
+
+
+def haversine_km_array(lat1, lng1, lat2, lng2):
+    """Element-wise great-circle distance in kilometres over NumPy arrays"""
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+class RouteGeometry:
+    """A route's polyline with the distance along it of every stop"""
+
+    def __init__(self, route):
+        stops = route['stops']
+        self.stop_ids = [stop['id'] for stop in stops]
+        stop_points = np.array([stop_position(stop) for stop in stops], dtype=float)
+
+        points = np.array(route.get('coordinates') or [], dtype=float).reshape(-1, 2)
+        # Routes without a drawn shape are treated as straight lines between their stops
+        self.points = points if len(points) >= 2 else stop_points
+        self.cos_lat = np.cos(np.radians(self.points[:, 0].mean()))
+        self.segment_km = haversine_km_array(self.points[:-1, 0], self.points[:-1, 1],
+                                             self.points[1:, 0], self.points[1:, 1])
+        self.chainage = np.concatenate(([0.0], np.cumsum(self.segment_km)))
+        self.length_km = float(self.chainage[-1])
+
+        stop_chainage, _ = self.project(stop_points)
+        # Stops are served in order, so a projection may never step back along the line
+        self.stop_chainage = np.maximum.accumulate(stop_chainage)
+
+        duration = float(route.get('duration') or 0)
+        if duration > 0 and self.length_km > 0:
+            self.km_per_minute = self.length_km / duration
+        else:
+            self.km_per_minute = DEFAULT_SPEED_KMH / 60
+
+    def _plane(self, points):
+        # Equirectangular projection; accurate enough to pick the closest segment
+        return np.column_stack((points[:, 1] * self.cos_lat, points[:, 0]))
+
+    def project(self, positions):
+        """Distance along the line and distance off it, both in km, for an (n, 2) array of lat/lng"""
+        line = self._plane(self.points)
+        start = line[:-1]
+        direction = line[1:] - start
+        length2 = (direction ** 2).sum(axis=1)
+
+        # (positions, segments) grid of the closest point on every segment
+        p = self._plane(positions)[:, None, :]
+        t = ((p - start) * direction).sum(axis=2) / np.where(length2 > 0, length2, 1.0)
+        t = np.clip(t, 0.0, 1.0)
+        offset2 = ((p - (start + t[..., None] * direction)) ** 2).sum(axis=2)
+
+        segment = offset2.argmin(axis=1)
+        rows = np.arange(len(positions))
+        along = self.chainage[segment] + t[rows, segment] * self.segment_km[segment]
+        return along, np.sqrt(offset2[rows, segment]) * KM_PER_DEGREE
+
+
+class ArrivalEngine:
+    """Predicts when every active bus reaches each of its remaining stops.
+
+    Each tick reads the latest position of every bus that reported recently,
+    projects the positions of all buses on a route onto its polyline at once,
+    and turns the remaining distance to each downstream stop into an ETA at
+    the route's average speed. Only buses with a new ping since the last tick
+    are recomputed, and predictions are bulk-upserted into bus_arrivals.
+    """
+
+    def __init__(self, db, interval=None, active_minutes=None, max_off_route_km=None, catalog_ttl=None):
+        self.db = db
+        self.interval = interval or float(os.getenv('ARRIVAL_ENGINE_INTERVAL', 15))
+        # Buses that have not reported for this long are not predicted
+        self.active_minutes = active_minutes or float(os.getenv('ARRIVAL_ENGINE_ACTIVE_MINUTES', 10))
+        # Pings further than this from the route polyline are treated as off route and skipped
+        self.max_off_route_km = max_off_route_km or float(os.getenv('ARRIVAL_ENGINE_MAX_OFF_ROUTE_KM', 1.0))
+        self.catalog_ttl = catalog_ttl or float(os.getenv('ARRIVAL_ENGINE_CATALOG_TTL', 300))
+        self._geometry = {}
+        self._geometry_loaded = None
+        # bus id -> (ping timestamp, stops passed) as of the last prediction written
+        self._last = {}
+
+    def _geometries(self):
+        expired = self._geometry_loaded is None or time.monotonic() - self._geometry_loaded > self.catalog_ttl
+        if expired:
+            routes = self.db.get_catalog()
+            # Keep the previous geometry if the catalog cannot be read
+            if routes is not None:
+                self._geometry = {route['id']: RouteGeometry(route) for route in routes if len(route['stops']) >= 2}
+                self._last = {}
+            self._geometry_loaded = time.monotonic()
+        return self._geometry
+
+    def predict(self, positions):
+        """bus_arrivals rows for the given bus positions; skips buses with no new ping"""
+        geometries = self._geometries()
+        by_route = {}
+        for position in positions:
+            last = self._last.get(position['bus_id'])
+            if last is None or last[0] != position['timestamp']:
+                by_route.setdefault(position['route_id'], []).append(position)
+
+        rows = []
+        for route_id, buses in by_route.items():
+            geometry = geometries.get(route_id)
+            if geometry is None:
+                continue
+
+            points = np.array([(float(b['latitude']), float(b['longitude'])) for b in buses], dtype=float)
+            along, off_route = geometry.project(points)
+
+            # (buses, stops) matrix of remaining distance and minutes to every stop
+            remaining = geometry.stop_chainage[None, :] - along[:, None]
+            minutes = np.maximum(remaining, 0.0) / geometry.km_per_minute
+            passed = (remaining < -PASSED_TOLERANCE_KM).sum(axis=1)
+
+            stamps = np.array([b['timestamp'] for b in buses], dtype='datetime64[s]')
+            estimates = (stamps[:, None] + np.rint(minutes * 60).astype('timedelta64[s]')).tolist()
+
+            for i, bus in enumerate(buses):
+                if off_route[i] > self.max_off_route_km:
+                    continue
+                previous = self._last.get(bus['bus_id'])
+                # Stops passed since the last ping get their actual arrival; a new trip starts over
+                first_passed = previous[1] if previous and previous[1] <= passed[i] else 0
+                capacity = capacity_status(bus.get('occupied_seats'), bus.get('total_seats'))
+                delay = bus.get('delay_minutes') or 0
+
+                for j in range(first_passed, len(geometry.stop_ids)):
+                    if j < passed[i]:
+                        rows.append((bus['bus_id'], geometry.stop_ids[j], bus['timestamp'], bus['timestamp'],
+                                     delay, capacity))
+                    else:
+                        rows.append((bus['bus_id'], geometry.stop_ids[j], estimates[i][j], None, delay, capacity))
+                self._last[bus['bus_id']] = (bus['timestamp'], int(passed[i]))
+        return rows
+
+    def run_once(self):
+        """Run one prediction tick; returns counts, or None if another process holds the lock"""
+        with self.db.named_lock(LOCK_NAME) as acquired:
+            if not acquired:
+                return None
+            started = time.perf_counter()
+            positions = self.db.get_active_bus_positions(datetime.now() - timedelta(minutes=self.active_minutes))
+            rows = self.predict(positions)
+            computed = time.perf_counter()
+            if rows and not self.db.upsert_bus_arrivals(rows):
+                # Forget what was written so the next tick retries every bus
+                self._last = {}
+            return {
+                'buses': len(positions),
+                'predictions': len(rows),
+                'compute_ms': round((computed - started) * 1000, 1),
+                'total_ms': round((time.perf_counter() - started) * 1000, 1)
+            }
+
+if __name__ == '__main__':
+    import argparse
+
+    from storage import create_database
+
+    parser = argparse.ArgumentParser(description="Predict bus arrivals at downstream stops")
+    parser.add_argument('--loop', action='store_true', help='keep running every --interval seconds')
+    parser.add_argument('--interval', type=float, default=None)
+    args = parser.parse_args()
+
+    db = create_database()
+    if not db.connect():
+        print("Failed to connect to database")
+        sys.exit(1)
+
+    engine = ArrivalEngine(db, interval=args.interval)
+    while True:
+        try:
+            result = engine.run_once()
+            if result is None:
+                print("Another arrival engine is running, skipping")
+            elif not args.loop:
+                print(result)
+        except STORAGE_ERRORS as e:
+            print(f"Error predicting arrivals: {e}")
+            if not args.loop:
+                sys.exit(1)
+        if not args.loop:
+            break
+        time.sleep(engine.interval)
+
+    db.disconnect()
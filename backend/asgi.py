@@ -0,0 +1,211 @@
+"""ASGI entry point for high-concurrency deployments.
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+Live-bus and arrival reads are served natively on the event loop from an
+aiomysql pool, so slow queries no longer pin a worker. They follow the same
+replica routing and X-Client-Id read-your-writes window as the Flask reads.
+The /api/buses/stream Server-Sent Events stream is always served on the
+event loop, so open streams don't hold the threads Flask runs on. Every
+other route is handed to the Flask app in api.py on a thread pool, so both
+entry points expose the same API and the sync app keeps working unchanged.
+With the SQLite or in-memory storage backends the other reads go to Flask.
+"""
+import asyncio
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import api
+import compression
+import json_provider
+import metrics
+from async_database import AsyncDatabaseManager
+
+# The native handlers query MySQL directly
+SERVE_ASYNC = api.db.backend == 'mysql'
+
+# Shares api.db's replica router and recent writers, so native reads are routed like the Flask ones
+adb = AsyncDatabaseManager(api.db) if SERVE_ASYNC else None
+
+# Threads serving the Flask routes
+flask_app = WSGIMiddleware(api.app, workers=int(os.getenv('ASGI_WSGI_WORKERS', 32)))
+
+_connect_lock = asyncio.Lock()
+
+if SERVE_ASYNC:
+    metrics.REGISTRY.sampled('async_db_pool_connections', 'aiomysql connections by state (size is the pool limit)',
+                             ('state',), lambda: {(state,): value for state, value in adb.stats().items()})
+
+
+async def ensure_async_database():
+    """Create the async pool, retrying on later requests if the database was unreachable"""
+    if adb.pool:
+        return True
+    async with _connect_lock:
+        return await adb.connect()
+
+
+def client_id(scope):
+    """X-Client-Id of the request, which keys read-your-writes like tag_client() in api.py"""
+    value = dict(scope['headers']).get(b'x-client-id')
+    return value.decode('latin-1') if value else None
+
+
+async def live_buses(query, client):
+    """Get live bus locations"""
+    route_id = query.get('route_id')
+    buses = await adb.get_live_buses(route_id, client)
+    formatted_buses = [api.format_live_bus(bus, route_id) for bus in buses]
+    return 200, {
+        'success': True,
+        'data': formatted_buses,
+        'count': len(formatted_buses)
+    }
+
+
+async def stop_arrivals(query, client, stop_id):
+    """Get bus arrivals for a specific stop"""
+    try:
+        limit = int(query.get('limit', 10))
+    except ValueError:
+        limit = 10
+    arrivals = await adb.get_bus_arrivals(stop_id, limit, client)
+    formatted_arrivals = [api.format_arrival(arrival) for arrival in arrivals]
+    return 200, {
+        'success': True,
+        'data': formatted_arrivals,
+        'count': len(formatted_arrivals)
+    }
+
+
+# GET routes served on the event loop; anything else goes to Flask
+# (path pattern, handler, Flask rule reported as the metrics endpoint)
+ASYNC_ROUTES = [
+    (re.compile(r'^/api/buses/live$'), live_buses, '/api/buses/live'),
+    (re.compile(r'^/api/stops/(?P<stop_id>[^/]+)/arrivals$'), stop_arrivals, '/api/stops/<stop_id>/arrivals'),
+]
+
+
+async def stream_live_buses(scope, receive, send):
+    """Stream live bus position updates as Server-Sent Events"""
+    started = time.perf_counter()
+    route_id = parse_query(scope).get('route_id')
+    hub = api.live_updates
+    if hub.is_full():
+        await send_json(scope, send, 503, {
+            'success': False,
+            'error': 'Too many live stream clients, retry later'
+        })
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, 'GET', '/api/buses/stream', '503')
+        return
+
+    # Start with the current positions, then send only changes
+    if SERVE_ASYNC and await ensure_async_database():
+        buses = await adb.get_live_buses(route_id, client_id(scope))
+    else:
+        buses = await asyncio.get_running_loop().run_in_executor(None, api.db.get_live_buses, route_id)
+    initial = [api.format_live_bus(bus, route_id) for bus in buses]
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+        (b'access-control-allow-origin', b'*'),
+    ]})
+    # Like the Flask routes, the time to start the response rather than the stream's lifetime
+    metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, 'GET', '/api/buses/stream', '200')
+
+    # Sending to a closed connection does not fail, so stop on the disconnect message
+    frames = hub.astream(route_id, initial)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            frame = asyncio.ensure_future(frames.__anext__())
+            await asyncio.wait((frame, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if not frame.done():
+                frame.cancel()
+                await asyncio.wait((frame,))
+                break
+            try:
+                data = frame.result()
+            except StopAsyncIteration:
+                break
+            await send({'type': 'http.response.body', 'body': data.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await frames.aclose()
+
+
+def parse_query(scope):
+    return {k: v[0] for k, v in parse_qs(scope['query_string'].decode('latin-1')).items()}
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_json(scope, send, status, body):
+    """Send a JSON response, compressed the same way as the Flask responses"""
+    data = json_provider.dumps_bytes(body)
+    headers = [
+        (b'content-type', b'application/json'),
+        (b'vary', b'Accept-Encoding'),
+        # Matches CORS(app) in api.py
+        (b'access-control-allow-origin', b'*'),
+    ]
+
+    request_headers = dict(scope['headers'])
+    encoding = compression.choose_encoding(request_headers.get(b'accept-encoding', b'').decode('latin-1'))
+    if encoding and len(data) >= compression.MIN_SIZE:
+        data = compression.compress(data, encoding)
+        headers.append((b'content-encoding', encoding.encode()))
+    headers.append((b'content-length', str(len(data)).encode()))
+
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if SERVE_ASYNC:
+                await ensure_async_database()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if adb:
+                await adb.disconnect()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/buses/stream':
+        return await stream_live_buses(scope, receive, send)
+
+    if SERVE_ASYNC and scope['type'] == 'http' and scope['method'] == 'GET':
+        for pattern, handler, rule in ASYNC_ROUTES:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            started = time.perf_counter()
+            query = parse_query(scope)
+            try:
+                await ensure_async_database()
+                status, body = await handler(query, client_id(scope), **match.groupdict())
+            except Exception as e:
+                status, body = 500, {'success': False, 'error': str(e)}
+            await send_json(scope, send, status, body)
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, 'GET', rule, str(status))
+            return
+
+    return await flask_app(scope, receive, send)
@@ -0,0 +1,152 @@
+import asyncio
+import ssl
+from contextlib import asynccontextmanager
+
+import aiomysql
+from pymysql.err import MySQLError
+
+from database import DatabaseManager
+from replicas import replica_configs
+
+
+class AsyncDatabaseManager:
+    """asyncio counterpart of DatabaseManager for the reads served by asgi.py.
+
+    Uses the same AIVEN_MYSQL_* settings and the same SQL as DatabaseManager,
+    over an aiomysql connection pool, so many slow queries can be in flight
+    on one event loop instead of each pinning a worker thread.
+
+    Reads go to the replica the sync manager's ReplicaRouter picks, which
+    keeps checking replica lag, and to the primary for a client that wrote
+    within the read-your-writes window.
+    """
+
+    def __init__(self, db):
+        # The app's connected sync manager; its replica router and recent writers are read on every query
+        self.db = db
+        self.config = self.db.config
+        self.pool_size = self.db.pool_size
+        self.pool_timeout = self.db.pool_timeout
+        self.pool_recycle = int(self.db.pool_ping_interval * 10)
+        self.pool = None
+        # Replica name (host:port) -> aiomysql pool
+        self.replica_pools = {}
+
+    async def connect(self):
+        """Create the connection pools and verify the database is reachable"""
+        if self.pool:
+            return True
+
+        try:
+            self.pool = await self._create_pool(self.config)
+            print("Successfully created async MySQL connection pool")
+        except (MySQLError, OSError) as e:
+            print(f"Error connecting to MySQL database: {e}")
+            return False
+
+        # An unreachable replica only loses its share of the reads
+        for config in replica_configs(self.config):
+            name = f"{config['host']}:{config['port']}"
+            try:
+                self.replica_pools[name] = await self._create_pool(config)
+            except (MySQLError, OSError) as e:
+                print(f"Error connecting to MySQL replica {name}: {e}")
+        return True
+
+    async def _create_pool(self, config):
+        ssl_context = None
+        if not config.get('ssl_disabled'):
+            ssl_context = ssl.create_default_context(cafile=config['ssl_ca'])
+        return await aiomysql.create_pool(
+            host=config['host'],
+            port=config['port'],
+            user=config['user'],
+            password=config['password'],
+            db=config['database'],
+            ssl=ssl_context,
+            autocommit=config.get('autocommit', True),
+            minsize=1,
+            maxsize=self.pool_size,
+            # Drop connections before the server's idle timeout closes them
+            pool_recycle=self.pool_recycle
+        )
+
+    async def disconnect(self):
+        """Close all pooled database connections"""
+        for pool in self.replica_pools.values():
+            pool.close()
+            await pool.wait_closed()
+        self.replica_pools = {}
+        if self.pool:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+            print("Async MySQL connection pool closed")
+
+    @asynccontextmanager
+    async def cursor(self, dictionary=False, pool=None):
+        """Borrow a pooled connection (from the primary by default) for one cursor, waiting at most pool_timeout seconds"""
+        pool = pool or self.pool
+        connection = await asyncio.wait_for(pool.acquire(), self.pool_timeout)
+        try:
+            cursor_class = aiomysql.DictCursor if dictionary else aiomysql.Cursor
+            async with connection.cursor(cursor_class) as cursor:
+                yield cursor
+        except Exception:
+            # Closed connections are dropped by release() instead of going back to the pool
+            connection.close()
+            raise
+        finally:
+            pool.release(connection)
+
+    def read_pool(self, client_id=None):
+        """Pool of the replica in rotation to read from, or the primary's if none is or client_id just wrote"""
+        router = self.db.replicas
+        if not router or not self.replica_pools or self.db.recently_wrote(client_id):
+            return self.pool
+        replica = router.choose()
+        pool = self.replica_pools.get(replica.name) if replica is not None else None
+        if pool is None:
+            return self.pool
+        replica.reads += 1
+        return pool
+
+    def stats(self):
+        """Pool size and how many connections are idle or in use"""
+        if not self.pool:
+            return {'size': self.pool_size, 'open': 0, 'idle': 0, 'in_use': 0}
+        return {
+            'size': self.pool.maxsize,
+            'open': self.pool.size,
+            'idle': self.pool.freesize,
+            'in_use': self.pool.size - self.pool.freesize
+        }
+
+    async def get_live_buses(self, route_id=None, client_id=None):
+        """Get the latest position of every bus that reported in the last 5 minutes"""
+        if not self.pool:
+            return []
+
+        query, params = DatabaseManager.live_buses_query(route_id)
+        try:
+            async with self.cursor(dictionary=True, pool=self.read_pool(client_id)) as cursor:
+                await cursor.execute(query, params)
+                return await cursor.fetchall()
+
+        except (MySQLError, asyncio.TimeoutError) as e:
+            print(f"Error getting live buses: {e}")
+            return []
+
+    async def get_bus_arrivals(self, stop_id, limit=10, client_id=None):
+        """Get upcoming bus arrivals for a stop"""
+        if not self.pool:
+            return []
+
+        try:
+            async with self.cursor(dictionary=True, pool=self.read_pool(client_id)) as cursor:
+                await cursor.execute(DatabaseManager.BUS_ARRIVALS_QUERY, (stop_id, limit))
+                return await cursor.fetchall()
+
+        except (MySQLError, asyncio.TimeoutError) as e:
+            print(f"Error getting bus arrivals: {e}")
+            return []
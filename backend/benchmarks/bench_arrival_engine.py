@@ -0,0 +1,99 @@
+"""Per-tick compute time of ArrivalEngine.predict against fleet size.
+
+Runs entirely in memory on a synthetic network, so no database is needed;
+the bus_arrivals upsert is not included in the timings.
+
+    python benchmarks/bench_arrival_engine.py --routes 500 --buses-per-route 4
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from arrival_engine import ArrivalEngine
+from benchmarks.synthetic import generate_network
+
+
+class CatalogSource:
+    """Just enough of DatabaseManager for ArrivalEngine to load geometry"""
+
+    def __init__(self, routes):
+        self.routes = routes
+
+    def get_catalog(self):
+        return self.routes
+
+
+def fleet_positions(routes, buses_per_route, seed=7):
+    """Buses placed at random points along each route's polyline"""
+    rng = random.Random(seed)
+    positions = []
+    for route in routes:
+        for n in range(buses_per_route):
+            lat, lng = rng.choice(route['coordinates'])
+            positions.append({
+                'bus_id': f"{route['id']}-b{n}",
+                'route_id': route['id'],
+                'latitude': lat + rng.uniform(-0.0005, 0.0005),
+                'longitude': lng + rng.uniform(-0.0005, 0.0005),
+                'occupied_seats': rng.randint(0, 60),
+                'total_seats': 50,
+                'delay_minutes': rng.randint(0, 10),
+                'timestamp': datetime.now().replace(microsecond=0)
+            })
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, default=500)
+    parser.add_argument('--buses-per-route', type=int, default=4)
+    parser.add_argument('--stops-per-route', type=int, default=30)
+    parser.add_argument('--points-per-route', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    network = generate_network(args.routes, stops_per_route=args.stops_per_route,
+                               points_per_route=args.points_per_route)
+    engine = ArrivalEngine(CatalogSource(network['routes']))
+
+    started = time.perf_counter()
+    engine._geometries()
+    geometry_ms = (time.perf_counter() - started) * 1000
+
+    positions = fleet_positions(network['routes'], args.buses_per_route)
+    timings = []
+    predictions = 0
+    for tick in range(args.repeat):
+        # Every bus reports a new ping each tick, the worst case for the engine
+        stamp = datetime.now().replace(microsecond=0) + timedelta(seconds=tick + 1)
+        for position in positions:
+            position['timestamp'] = stamp
+        started = time.perf_counter()
+        predictions = len(engine.predict(positions))
+        timings.append((time.perf_counter() - started) * 1000)
+
+    result = {
+        'routes': args.routes,
+        'buses': len(positions),
+        'predictions_per_tick': predictions,
+        'geometry_build_ms': round(geometry_ms, 1),
+        'tick_ms_median': round(statistics.median(timings), 1),
+        'tick_ms_max': round(max(timings), 1)
+    }
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key:>22}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Query count and latency of DatabaseManager.get_routes against catalog size.
+
+Compares the old per-route (N+1) child loading with the batched loader.
+Needs a reachable MySQL server configured through the usual AIVEN_MYSQL_*
+variables; data is written to a separate benchmark database.
+
+    python benchmarks/bench_route_catalog.py --sizes 10,100,500 --database sri_lanka_bus_bench
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import DatabaseManager
+from benchmarks.synthetic import generate_network
+
+
+class CountingCursor:
+    """Cursor proxy that counts execute() calls"""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def execute(self, *args, **kwargs):
+        self._counter['queries'] += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingDatabaseManager(DatabaseManager):
+    def __init__(self):
+        super().__init__()
+        self.counter = {'queries': 0}
+
+    @contextmanager
+    def cursor(self, dictionary=False):
+        with super().cursor(dictionary=dictionary) as cursor:
+            yield CountingCursor(cursor, self.counter)
+
+
+def legacy_get_routes(db):
+    """The previous implementation: two extra queries per route"""
+    with db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM routes ORDER BY id")
+        routes = cursor.fetchall()
+        for route in routes:
+            cursor.execute("""
+                SELECT s.*, rs.stop_order as `order`
+                FROM stops s
+                JOIN route_stops rs ON s.id = rs.stop_id
+                WHERE rs.route_id = %s
+                ORDER BY rs.stop_order
+            """, (route['id'],))
+            route['stops'] = cursor.fetchall()
+            cursor.execute("""
+                SELECT latitude, longitude
+                FROM route_coordinates
+                WHERE route_id = %s
+                ORDER BY sequence_order
+            """, (route['id'],))
+            route['coordinates'] = [[float(c['latitude']), float(c['longitude'])] for c in cursor.fetchall()]
+        return routes
+
+
+def measure(db, fn, repeat):
+    timings = []
+    db.counter['queries'] = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return db.counter['queries'] // repeat, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,500')
+    parser.add_argument('--database', default='sri_lanka_bus_bench')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path', help='also write results to this file')
+    args = parser.parse_args()
+
+    db = CountingDatabaseManager()
+    db.config['database'] = args.database
+    if not db.connect() or not db.migrate():
+        sys.exit(1)
+
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM routes WHERE id LIKE 'bench-%'")
+        cursor.execute("DELETE FROM stops WHERE id LIKE 'bench-%'")
+
+    sizes = sorted(int(s) for s in args.sizes.split(','))
+    network = generate_network(sizes[-1])
+    loaded = 0
+    results = []
+
+    print(f"{'routes':>8} {'legacy q':>9} {'legacy ms':>10} {'batched q':>10} {'batched ms':>11}")
+    for size in sizes:
+        for route in network['routes'][loaded:size]:
+            db.insert_route(route)
+        loaded = size
+
+        legacy_queries, legacy_ms = measure(db, lambda: legacy_get_routes(db), args.repeat)
+        batched_queries, batched_ms = measure(db, db.get_routes, args.repeat)
+        results.append({
+            'routes': size,
+            'legacy': {'queries': legacy_queries, 'median_ms': round(legacy_ms, 2)},
+            'batched': {'queries': batched_queries, 'median_ms': round(batched_ms, 2)}
+        })
+        print(f"{size:>8} {legacy_queries:>9} {legacy_ms:>10.1f} {batched_queries:>10} {batched_ms:>11.1f}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Serialization time and bytes on the wire per endpoint payload.
+
+Compares Flask's default jsonify provider with FastJSONProvider (orjson
+when installed, otherwise the standard library) and reports the response
+size uncompressed, gzipped and brotli-compressed. Payloads are built from
+a synthetic catalog in the shape the database returns, so no database is
+needed.
+
+    python benchmarks/bench_serialization.py --routes 500 --buses 2000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+import json_provider
+from catalog_cache import route_view
+from polyline import route_shapes
+from benchmarks.synthetic import generate_network
+
+
+def database_routes(num_routes):
+    """Synthetic routes with DECIMAL and TIMESTAMP values as mysql.connector returns them"""
+    created = datetime(2024, 1, 1, 6, 30)
+    routes = []
+    for route in generate_network(num_routes, points_per_route=200)['routes']:
+        stops = [{
+            'id': stop['id'],
+            'name': stop['name'],
+            'latitude': Decimal(str(stop['lat'])),
+            'longitude': Decimal(str(stop['lng'])),
+            'created_at': created,
+            'order': stop['order']
+        } for stop in route['stops']]
+        routes.append(dict(
+            route,
+            fare=Decimal(str(route['fare'])),
+            stops=stops,
+            created_at=created,
+            updated_at=created,
+            shapes={tolerance: encoded for tolerance, (encoded, _) in route_shapes(route['coordinates']).items()}
+        ))
+    return routes
+
+
+def live_buses(num_buses, rng):
+    now = datetime.now()
+    return [{
+        'id': f'bus-{i}',
+        'routeId': f'bench-{i % 500:05d}',
+        'busNumber': f'NB-{1000 + i}',
+        'position': [round(rng.uniform(6.0, 9.8), 6), round(rng.uniform(79.7, 81.8), 6)],
+        'currentStop': 'Colombo Fort',
+        'nextStop': 'Peliyagoda',
+        'vehicleType': 'regular',
+        'capacity': {'total': 50, 'occupied': 30, 'available': 20, 'status': 'available'},
+        'delay': {'minutes': rng.randint(0, 15), 'reason': None},
+        'lastUpdated': (now - timedelta(seconds=rng.randint(0, 300))).isoformat()
+    } for i in range(num_buses)]
+
+
+def stop_arrivals(count, rng):
+    now = datetime.now()
+    return [{
+        'id': i,
+        'bus_id': f'bus-{i}',
+        'stop_id': 'f1',
+        'estimated_arrival': now + timedelta(minutes=rng.randint(1, 60)),
+        'actual_arrival': None,
+        'delay_minutes': rng.randint(0, 10),
+        'capacity_status': 'available',
+        'created_at': now,
+        'bus_number': f'NB-{1000 + i}',
+        'vehicle_type': 'regular',
+        'total_seats': 50,
+        'route_name': 'Colombo Fort - Kandy'
+    } for i in range(count)]
+
+
+def timed(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', type=int, default=500)
+    parser.add_argument('--buses', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    app = Flask(__name__)
+    baseline = DefaultJSONProvider(app)
+    routes = database_routes(args.routes)
+
+    payloads = {
+        '/api/routes?geometry=none': [route_view(r, None) for r in routes],
+        '/api/routes?geometry=simplified': [route_view(r, 50) for r in routes],
+        '/api/routes?geometry=full': [route_view(r, 0) for r in routes],
+        '/api/buses/live': live_buses(args.buses, rng),
+        '/api/stops/{id}/arrivals': stop_arrivals(50, rng)
+    }
+
+    results = []
+    for endpoint, data in payloads.items():
+        body = {'success': True, 'data': data, 'count': len(data)}
+        default_bytes, default_ms = timed(lambda: baseline.dumps(body).encode('utf-8'), args.repeat)
+        fast_bytes, fast_ms = timed(lambda: json_provider.dumps_bytes(body), args.repeat)
+        gzipped, gzip_ms = timed(lambda: compression.compress(fast_bytes, 'gzip'), args.repeat)
+        row = {
+            'endpoint': endpoint,
+            'default_ms': round(default_ms, 2),
+            'fast_ms': round(fast_ms, 2),
+            'bytes': len(fast_bytes),
+            'default_bytes': len(default_bytes),
+            'gzip_bytes': len(gzipped),
+            'gzip_ms': round(gzip_ms, 2)
+        }
+        if compression.brotli is not None:
+            brotlied, br_ms = timed(lambda: compression.compress(fast_bytes, 'br'), args.repeat)
+            row.update(br_bytes=len(brotlied), br_ms=round(br_ms, 2))
+        results.append(row)
+
+    if args.json:
+        print(json.dumps({'serializer': json_provider.SERIALIZER, 'results': results}))
+        return
+
+    print(f"serializer: {json_provider.SERIALIZER}")
+    columns = list(results[0])
+    print('  '.join(f'{c:>14}' if c != 'endpoint' else f'{c:<34}' for c in columns))
+    for row in results:
+        print('  '.join(f'{str(row.get(c, "")):>14}' if c != 'endpoint' else f'{row[c]:<34}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
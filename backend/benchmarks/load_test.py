@@ -0,0 +1,295 @@
+"""Load test for the main API endpoints with throughput and latency percentiles.
+
+By default the API is started in-process on a local HTTP server, backed by
+the in-memory stand-in database seeded with a synthetic network, so no
+MySQL host is needed. --url points the same scenarios at a running server
+instead (for example gunicorn serving benchmarks.standin_app).
+
+    python benchmarks/load_test.py --concurrency 16 --duration 10 --output load_test.json
+    python benchmarks/load_test.py --baseline load_test.json --max-regression 0.25
+
+Results are written as JSON: one entry per scenario with request and error
+counts, requests per second, and p50/p95/p99 latency in milliseconds. With
+--baseline, p95 latencies are compared against an earlier result file and
+the exit status is 1 if any scenario regressed by more than --max-regression.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, urlencode, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+SCENARIOS = ('routes', 'search', 'live', 'ingest', 'arrivals')
+
+
+class Client:
+    """Keep-alive HTTP client for one load-generating thread"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        """Send a request and return (status, response bytes); reconnects once if the connection dropped"""
+        headers = {'Accept-Encoding': 'gzip, br'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        for attempt in range(2):
+            if self.connection is None:
+                cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+                self.connection = cls(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+class Targets:
+    """Route ids, stop names, stop ids and bus ids to aim requests at, discovered through the API"""
+
+    def __init__(self, base_url):
+        client = Client(base_url)
+        status, body = client.request('GET', '/api/routes?geometry=none')
+        if status != 200:
+            raise SystemExit(f"GET /api/routes returned {status}; is the API up?")
+        self.routes = json.loads(_decoded(body))['data']
+        status, body = client.request('GET', '/api/buses/live')
+        self.bus_ids = [bus['id'] for bus in json.loads(_decoded(body))['data']] if status == 200 else []
+        self.stop_ids = sorted({stop['id'] for route in self.routes for stop in route['stops']})
+        if not self.routes or not self.bus_ids:
+            raise SystemExit("The API returned no routes or no live buses to load test against")
+
+
+def _decoded(body):
+    """Response body as text; the client accepts compressed responses"""
+    if body[:2] == b'\x1f\x8b':
+        import gzip
+        return gzip.decompress(body)
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        import brotli
+        return brotli.decompress(body)
+
+
+def make_request(scenario, targets, rng, ingest_batch):
+    """(method, path, body) for one request of a scenario"""
+    if scenario == 'routes':
+        return 'GET', '/api/routes?geometry=simplified', None
+    if scenario == 'search':
+        route = rng.choice(targets.routes)
+        first, second = sorted(rng.sample(range(len(route['stops'])), 2))
+        params = {
+            'origin': route['stops'][first]['name'],
+            'destination': route['stops'][second]['name'],
+            'include_transfers': 'true'
+        }
+        return 'GET', f'/api/search/routes?{urlencode(params)}', None
+    if scenario == 'live':
+        return 'GET', f"/api/buses/live?route_id={quote(rng.choice(targets.routes)['id'])}", None
+    if scenario == 'ingest':
+        pings = []
+        for bus_id in rng.sample(targets.bus_ids, min(ingest_batch, len(targets.bus_ids))):
+            route = rng.choice(targets.routes)
+            stop = rng.choice(route['stops'])
+            pings.append({
+                'bus_id': bus_id,
+                'latitude': round(float(stop['latitude']) + rng.uniform(-0.001, 0.001), 6),
+                'longitude': round(float(stop['longitude']) + rng.uniform(-0.001, 0.001), 6),
+                'occupied_seats': rng.randint(0, 50),
+                'delay_minutes': rng.randint(0, 5)
+            })
+        return 'POST', '/api/buses/locations:batch', {'locations': pings}
+    if scenario == 'arrivals':
+        return 'GET', f'/api/stops/{quote(rng.choice(targets.stop_ids))}/arrivals?limit=10', None
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_scenario(base_url, scenario, targets, concurrency, duration, warmup, ingest_batch):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+
+    def worker(number):
+        client = Client(base_url)
+        rng = random.Random(number)
+        mine, failures = [], 0
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            method, path, body = make_request(scenario, targets, rng, ingest_batch)
+            started = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body)
+                ok = status < 400
+            except (http.client.HTTPException, OSError):
+                ok = False
+            elapsed = (time.perf_counter() - started) * 1000
+            # Requests that started during warm-up are not measured
+            if started >= start_at:
+                if ok:
+                    mine.append(elapsed)
+                else:
+                    failures += 1
+        with lock:
+            latencies.extend(mine)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    error_count = sum(errors)
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'requests': len(latencies),
+        'errors': error_count,
+        'throughput_rps': round(len(latencies) / duration, 1),
+        'p50_ms': _rounded(percentile(latencies, 0.50)),
+        'p95_ms': _rounded(percentile(latencies, 0.95)),
+        'p99_ms': _rounded(percentile(latencies, 0.99)),
+        'mean_ms': _rounded(sum(latencies) / len(latencies) if latencies else None),
+        'max_ms': _rounded(latencies[-1] if latencies else None)
+    }
+
+
+def _rounded(value):
+    return round(value, 2) if value is not None else None
+
+
+def start_local_server(args):
+    """Serve the stand-in backed API on a free local port; returns its base URL"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from benchmarks.standin_app import create_app
+
+    app, standin = create_app(args.routes, args.stops, args.buses, args.db_latency_ms)
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, name='load-test-server', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline_path, max_regression):
+    """Print p95 changes against a baseline file; returns the scenarios that regressed"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {row['scenario']: row for row in json.load(f)['results']}
+
+    regressed = []
+    for row in results:
+        before = baseline.get(row['scenario'])
+        if not before or not before.get('p95_ms') or row['p95_ms'] is None:
+            continue
+        change = (row['p95_ms'] - before['p95_ms']) / before['p95_ms']
+        flag = 'REGRESSION' if change > max_regression else ''
+        print(f"{row['scenario']:<10} p95 {before['p95_ms']:>9} -> {row['p95_ms']:>9} ms ({change:+.0%}) {flag}")
+        if flag:
+            regressed.append(row['scenario'])
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='load test a running server instead of starting one in-process')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each scenario')
+    parser.add_argument('--ingest-batch', type=int, default=50, help='pings per locations:batch request')
+    parser.add_argument('--routes', type=int, default=300)
+    parser.add_argument('--stops', type=int, default=3000)
+    parser.add_argument('--buses', type=int, default=1000)
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='delay added to every stand-in database call')
+    parser.add_argument('--output', default='load_test_results.json')
+    parser.add_argument('--baseline', help='earlier result file to compare p95 latency against')
+    parser.add_argument('--max-regression', type=float, default=0.25)
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    base_url = args.url.rstrip('/') if args.url else start_local_server(args)
+    targets = Targets(base_url)
+    print(f"Load testing {base_url}: {len(targets.routes)} routes, {len(targets.stop_ids)} stops, "
+          f"{len(targets.bus_ids)} live buses, concurrency {args.concurrency}")
+
+    results = []
+    for scenario in scenarios:
+        row = run_scenario(base_url, scenario, targets, args.concurrency, args.duration, args.warmup, args.ingest_batch)
+        results.append(row)
+        print(f"{scenario:<10} {row['throughput_rps']:>9} req/s  p50 {row['p50_ms']} ms  "
+              f"p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {row['errors']}")
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'target': args.url or 'in-process stand-in',
+        'config': {
+            'concurrency': args.concurrency, 'duration_s': args.duration, 'warmup_s': args.warmup,
+            'ingest_batch': args.ingest_batch, 'routes': args.routes, 'stops': args.stops,
+            'buses': args.buses, 'db_latency_ms': args.db_latency_ms
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.baseline and compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""The Flask API wired to the in-memory stand-in database.
+
+Used in-process by load_test.py, or served by a real WSGI server so the
+load test can measure it under production worker settings:
+
+    BENCH_ROUTES=300 BENCH_BUSES=1000 gunicorn -w 4 -b 127.0.0.1:5055 'benchmarks.standin_app:wsgi_app()'
+    python benchmarks/load_test.py --url http://127.0.0.1:5055
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import api
+import metrics
+from catalog_cache import RouteCatalogCache
+from live_updates import LiveUpdateHub
+from location_buffer import LocationWriteBuffer
+from benchmarks.standin_db import StandInDatabase
+from storage import OPERATIONS
+
+
+def create_app(num_routes=None, num_stops=None, num_buses=None, latency_ms=None):
+    """Point api.py at a freshly seeded stand-in database and return the Flask app"""
+    standin = StandInDatabase(
+        num_routes=num_routes or int(os.getenv('BENCH_ROUTES', 300)),
+        num_stops=num_stops or int(os.getenv('BENCH_STOPS', 3000)),
+        num_buses=num_buses or int(os.getenv('BENCH_BUSES', 1000)),
+        latency_ms=latency_ms if latency_ms is not None else float(os.getenv('BENCH_DB_LATENCY_MS', 0))
+    )
+    standin.seed_arrivals()
+    metrics.instrument_storage(standin, OPERATIONS)
+
+    # The request handlers look these globals up on every call
+    api.live_updates.stop()
+    api.location_buffer.stop()
+    api.db = standin
+    api.catalog = RouteCatalogCache(standin)
+    api.location_buffer = LocationWriteBuffer(standin)
+    api.location_buffer.start()
+    api.live_updates = LiveUpdateHub(standin)
+    api.live_updates.start()
+    return api.app, standin
+
+
+def wsgi_app():
+    """Application factory for WSGI servers, configured through BENCH_* variables"""
+    return create_app()[0]
@@ -0,0 +1,77 @@
+"""In-memory stand-in database for load tests without a MySQL host.
+
+The in-memory storage backend filled with a synthetic network, with an
+optional fixed delay per call to mimic the round trip to a hosted database.
+Results are shaped like mysql.connector dictionary rows so the API code
+paths are the ones used in production.
+"""
+import functools
+import random
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import generate_network
+from catalog_import import CatalogImporter
+from memory_storage import MemoryDatabaseManager
+
+
+class StandInDatabase(MemoryDatabaseManager):
+    def __init__(self, num_routes=300, num_stops=3000, num_buses=1000, latency_ms=0.0, seed=42):
+        super().__init__(read_only=False, seed='none')
+        self.latency = latency_ms / 1000
+        self.calls = 0
+        self.connect()
+
+        network = generate_network(num_routes, num_stops=num_stops, stops_per_route=15,
+                                   points_per_route=120, seed=seed)
+        CatalogImporter(self, batch_size=1000).run(network['routes'])
+
+        rng = random.Random(seed)
+        routes = sorted(self.routes)
+        buses, locations = [], []
+        now = datetime.now().replace(microsecond=0)
+        for i in range(num_buses):
+            route_id = routes[i % len(routes)]
+            bus_id = f'bench-bus-{i:05d}'
+            buses.append({
+                'id': bus_id, 'route_id': route_id, 'bus_number': f'NB-{1000 + i}',
+                'vehicle_type': rng.choice(['regular', 'ac']), 'total_seats': 50, 'status': 'active'
+            })
+            lat, lng = rng.choice(self.coordinates[route_id])
+            locations.append({
+                'bus_id': bus_id, 'latitude': lat, 'longitude': lng,
+                'occupied_seats': rng.randint(0, 55), 'delay_minutes': rng.randint(0, 10), 'timestamp': now
+            })
+        self.upsert_buses(buses)
+        self.insert_bus_locations(locations)
+        self.calls = 0
+
+    def seed_arrivals(self):
+        """Fill bus_arrivals by running the arrival engine over the current fleet positions"""
+        from arrival_engine import ArrivalEngine
+
+        self.arrivals = {}
+        rows = ArrivalEngine(self).predict(self.get_active_bus_positions(None))
+        self.upsert_bus_arrivals(rows)
+        self.calls = 0
+        return len(rows)
+
+
+def _with_latency(method):
+    @functools.wraps(method)
+    def call(self, *args, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return method(self, *args, **kwargs)
+    return call
+
+
+# Every storage call the API makes pays the simulated round trip once
+for _name in ('get_catalog', 'get_catalog_version', 'get_catalog_changes', 'get_stop_aliases', 'get_route',
+              'get_routes_by_ids', 'get_routes_page', 'get_routes', 'get_routes_between_stops', 'get_stops',
+              'search_stops', 'get_stops_near', 'write_catalog_rows', 'update_bus_location',
+              'insert_bus_locations', 'get_live_buses', 'get_active_bus_positions', 'get_locations_after',
+              'get_bus_routes', 'upsert_bus_arrivals', 'get_bus_arrivals', 'add_user_favorite',
+              'get_user_favorites'):
+    setattr(StandInDatabase, _name, _with_latency(getattr(MemoryDatabaseManager, _name)))
@@ -0,0 +1,71 @@
+import math
+import random
+
+# Rough bounding box of Sri Lanka
+LAT_RANGE = (5.95, 9.80)
+LNG_RANGE = (79.70, 81.85)
+
+TOWN_NAMES = [
+    'Colombo', 'Kandy', 'Galle', 'Matara', 'Jaffna', 'Negombo', 'Kurunegala', 'Ratnapura',
+    'Badulla', 'Anuradhapura', 'Trincomalee', 'Batticaloa', 'Kalutara', 'Kegalle', 'Chilaw',
+    'Puttalam', 'Hambantota', 'Nuwara Eliya', 'Polonnaruwa', 'Vavuniya', 'Ampara', 'Matale',
+    'Gampaha', 'Panadura', 'Moratuwa', 'Maharagama', 'Homagama', 'Kadawatha', 'Avissawella',
+    'Embilipitiya', 'Dambulla', 'Mannar'
+]
+
+
+def generate_network(num_routes, num_stops=None, stops_per_route=12, points_per_route=40,
+                     id_prefix='bench-', seed=42):
+    """Build a synthetic route catalog shaped like data/routes.py, with stops shared across routes"""
+    rng = random.Random(seed)
+    num_stops = num_stops or max(stops_per_route, num_routes * stops_per_route // 3)
+
+    stops = []
+    for i in range(num_stops):
+        town = TOWN_NAMES[i % len(TOWN_NAMES)]
+        stops.append({
+            'id': f'{id_prefix}s{i:05d}',
+            'name': f'{town} {i // len(TOWN_NAMES) + 1}',
+            'lat': round(rng.uniform(*LAT_RANGE), 6),
+            'lng': round(rng.uniform(*LNG_RANGE), 6)
+        })
+
+    routes = []
+    for i in range(num_routes):
+        chosen = rng.sample(stops, min(stops_per_route, len(stops)))
+        # Order stops along the dominant axis so each route runs in one direction
+        chosen.sort(key=lambda s: (s['lat'], s['lng']))
+        route_stops = [dict(stop, order=n + 1) for n, stop in enumerate(chosen)]
+
+        coordinates = []
+        for a, b in zip(route_stops, route_stops[1:]):
+            steps = max(1, points_per_route // max(1, len(route_stops) - 1))
+            for k in range(steps):
+                t = k / steps
+                coordinates.append([
+                    round(a['lat'] + (b['lat'] - a['lat']) * t, 6),
+                    round(a['lng'] + (b['lng'] - a['lng']) * t, 6)
+                ])
+        coordinates.append([route_stops[-1]['lat'], route_stops[-1]['lng']])
+
+        length_km = sum(_haversine_km(a, b) for a, b in zip(route_stops, route_stops[1:]))
+        routes.append({
+            'id': f'{id_prefix}{i:05d}',
+            'name': f"{route_stops[0]['name']} - {route_stops[-1]['name']}",
+            'origin': route_stops[0]['name'],
+            'destination': route_stops[-1]['name'],
+            'fare': round(30 + length_km * 2.5, 2),
+            'duration': max(10, int(length_km * 2)),
+            'frequency': rng.choice([5, 10, 15, 20, 30]),
+            'type': rng.choice(['regular', 'regular', 'express', 'ac']),
+            'stops': route_stops,
+            'coordinates': coordinates
+        })
+
+    return {'stops': stops, 'routes': routes}
+
+
+def _haversine_km(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a['lat'], a['lng'], b['lat'], b['lng']))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(h))
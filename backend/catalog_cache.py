@@ -0,0 +1,359 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+import uuid
+from types import MappingProxyType
+
+import polyline
+from data.place_aliases import placeAliases
+from spatial_index import StopSpatialIndex
+from stop_index import StopNameIndex, fold_name
+from transfer_planner import TransferPlanner
+
+
+def route_view(route, tolerance):
+    """Route as served by the API, with its shape as an encoded polyline at tolerance (None for no shape)"""
+    view = {key: value for key, value in route.items() if key not in ('coordinates', 'shapes')}
+    if tolerance is not None:
+        encoded = (route.get('shapes') or {}).get(tolerance)
+        if encoded is None:
+            # Shape not stored yet (e.g. before the backfill ran): encode it on the fly
+            encoded = polyline.encode(polyline.simplify(route.get('coordinates') or [], tolerance))
+        view['polyline'] = encoded
+    return view
+
+
+class CatalogSnapshot:
+    """Immutable view of the whole route catalog at one point in time"""
+
+    # Tells apart the snapshots this process patched, which no other process serves
+    _patches = itertools.count(1)
+    _process = uuid.uuid4().hex[:8]
+
+    def __init__(self, routes, loaded_at, aliases=(), catalog_version=None):
+        self.routes = tuple(routes)
+        self.by_id = MappingProxyType({route['id']: route for route in self.routes})
+        self.aliases = tuple(aliases)
+        self.loaded_at = loaded_at
+        # Storage.get_catalog_version() read before the catalog, so the data is at least that new
+        self.catalog_version = catalog_version
+        self._planner = None
+        self._stop_index = None
+        self._stop_routes = None
+        self._spatial_index = None
+        # tolerance -> route id -> API view, filled in as routes are requested
+        self._views = {}
+        self._ids = None
+        self._termini = None
+
+    def version(self):
+        """Catalog version this snapshot was loaded at, as returned by Storage.get_catalog_version"""
+        return self.catalog_version
+
+    def planner(self):
+        """Transfer planner indexes for this snapshot, built on first use"""
+        if self._planner is None:
+            self._planner = TransferPlanner(self.routes)
+        return self._planner
+
+    def stop_index(self):
+        """Stop-name search index for this snapshot, built on first use"""
+        if self._stop_index is None:
+            stops = (stop for route in self.routes for stop in route['stops'])
+            self._stop_index = StopNameIndex(stops, self.aliases, placeAliases)
+        return self._stop_index
+
+    def spatial_index(self):
+        """Grid index over stop positions for this snapshot, built on first use"""
+        if self._spatial_index is None:
+            self._spatial_index = StopSpatialIndex(stop for route in self.routes for stop in route['stops'])
+        return self._spatial_index
+
+    def view(self, route, tolerance):
+        """Cached route_view for a route in this snapshot"""
+        views = self._views.setdefault(tolerance, {})
+        cached = views.get(route['id'])
+        if cached is None:
+            cached = views[route['id']] = route_view(route, tolerance)
+        return cached
+
+    def stop_routes(self):
+        """stop id -> [(route position, stop order)] for every route calling at the stop"""
+        if self._stop_routes is None:
+            stop_routes = {}
+            for position, route in enumerate(self.routes):
+                for stop in route['stops']:
+                    stop_routes.setdefault(stop['id'], []).append((position, stop['order']))
+            self._stop_routes = stop_routes
+        return self._stop_routes
+
+    def page(self, after_id=None, limit=None):
+        """Routes with id greater than after_id in id order, at most limit"""
+        if self._ids is None:
+            self._ids = sorted(self.by_id)
+        start = 0 if after_id is None else bisect.bisect_right(self._ids, after_id)
+        end = None if limit is None else start + limit
+        return [self.by_id[route_id] for route_id in self._ids[start:end]]
+
+    def termini(self):
+        """Folded (origin, destination) names of every route, in route order"""
+        if self._termini is None:
+            self._termini = [(fold_name(r['origin']), fold_name(r['destination'])) for r in self.routes]
+        return self._termini
+
+    def with_route(self, route):
+        """New snapshot with route added or replaced, keeping the original load time.
+
+        Its version is marked as patched by this process: the loaded version
+        alone would name both the old and the patched contents.
+        """
+        routes = [r for r in self.routes if r['id'] != route['id']]
+        routes.append(route)
+        routes.sort(key=lambda r: r['id'])
+        version = self.catalog_version
+        if version is not None:
+            version = dict(version, patch=f'{self._process}.{next(self._patches)}')
+        return CatalogSnapshot(routes, self.loaded_at, self.aliases, version)
+
+    def search(self, origin, destination):
+        """Routes calling at a stop matching origin before a stop matching destination.
+
+        A route whose own origin (destination) name contains the query counts
+        as matching at its first (last) stop, as the original SQL search did.
+        """
+        index = self.stop_index()
+        stop_routes = self.stop_routes()
+        origin_key, destination_key = fold_name(origin), fold_name(destination)
+
+        first = {}
+        for stop_id in index.resolve(origin):
+            for position, order in stop_routes.get(stop_id, ()):
+                if order < first.get(position, float('inf')):
+                    first[position] = order
+
+        last = {}
+        for stop_id in index.resolve(destination):
+            for position, order in stop_routes.get(stop_id, ()):
+                if order > last.get(position, float('-inf')):
+                    last[position] = order
+
+        if origin_key or destination_key:
+            for position, (route_origin, route_destination) in enumerate(self.termini()):
+                at_origin = bool(origin_key) and origin_key in route_origin
+                at_destination = bool(destination_key) and destination_key in route_destination
+                orders = [stop['order'] for stop in self.routes[position]['stops']] if at_origin or at_destination else ()
+                if not orders:
+                    continue
+                if at_origin:
+                    first[position] = min(orders)
+                if at_destination:
+                    last[position] = max(orders)
+
+        return [self.routes[p] for p in sorted(last) if p in first and first[p] < last[p]]
+
+
+class RouteCatalogCache:
+    """Serves route reads from an in-memory snapshot of the catalog.
+
+    The snapshot is replaced as a whole, never modified in place, so readers
+    always see a consistent catalog. Routes written through this process are
+    patched into a new snapshot immediately; the TTL bounds how long a worker
+    can serve data that another worker has changed. Route dicts handed out
+    are shared with the snapshot and must be treated as read-only.
+    """
+
+    def __init__(self, db, ttl=None, max_routes=None):
+        self.db = db
+        self.ttl = ttl if ttl is not None else float(os.getenv('CATALOG_CACHE_TTL', 300))
+        # Catalogs larger than this are not kept in memory; reads go to the database instead
+        self.max_routes = max_routes if max_routes is not None else int(os.getenv('CATALOG_CACHE_MAX_ROUTES', 20000))
+        self._snapshot = None
+        # When the catalog last turned out to be over max_routes; it is not reloaded for another ttl
+        self._oversized_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+        self.patches = 0
+
+    def _fresh(self, snapshot):
+        return snapshot is not None and time.monotonic() - snapshot.loaded_at < self.ttl
+
+    def snapshot(self):
+        """Current catalog snapshot, reloading it from the database when missing or expired"""
+        snapshot = self._snapshot
+        if self._fresh(snapshot):
+            self.hits += 1
+            return snapshot
+        if self._oversized_at is not None and time.monotonic() - self._oversized_at < self.ttl:
+            return None
+
+        # One thread reloads; the rest keep serving the expired snapshot
+        # meanwhile and only wait when there is none to serve
+        if not self._lock.acquire(blocking=snapshot is None):
+            self.hits += 1
+            return snapshot
+        try:
+            return self._reload()
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        """Load a new snapshot; called with the lock held"""
+        # Another thread may have reloaded while we waited for the lock
+        snapshot = self._snapshot
+        if self._fresh(snapshot):
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        version = self.db.get_catalog_version()
+        routes = self.db.get_catalog()
+        if routes is None:
+            # Database unavailable: keep serving the stale snapshot rather than nothing
+            return snapshot
+        if len(routes) > self.max_routes:
+            print(f"Route catalog has {len(routes)} routes, more than the cache limit of {self.max_routes}")
+            self._snapshot = None
+            self._oversized_at = time.monotonic()
+            return None
+
+        snapshot = CatalogSnapshot(routes, time.monotonic(), self.db.get_stop_aliases(), version)
+        self._snapshot = snapshot
+        self._oversized_at = None
+        self.loads += 1
+        return snapshot
+
+    def invalidate(self):
+        """Drop the snapshot so the next read reloads the catalog"""
+        self._snapshot = None
+        self._oversized_at = None
+        self.invalidations += 1
+
+    def version(self):
+        """Version of the catalog this worker serves, or None if it cannot be read"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_catalog_version()
+        return snapshot.version()
+
+    def get_routes(self, origin=None, destination=None):
+        """Same contract as DatabaseManager.get_routes, served from memory"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_routes(origin, destination)
+        if origin and destination:
+            return snapshot.search(origin, destination)
+        return list(snapshot.routes)
+
+    def get_routes_page(self, after_id=None, limit=None, stops=True, shapes=True):
+        """Same contract as Storage.get_routes_page; snapshot routes always carry their stops and shapes"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_routes_page(after_id, limit, stops, shapes)
+        return snapshot.page(after_id, limit)
+
+    def get_route(self, route_id):
+        """Single route by id, or None"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_route(route_id)
+        return snapshot.by_id.get(route_id)
+
+    def get_routes_by_ids(self, route_ids):
+        """Routes for the given ids in the order requested; unknown ids are skipped"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_routes_by_ids(route_ids)
+        return [snapshot.by_id[i] for i in dict.fromkeys(route_ids) if i in snapshot.by_id]
+
+    def present(self, routes, tolerance):
+        """API views of routes with their shape at tolerance, reusing the snapshot's cached views"""
+        snapshot = self._snapshot
+        return [
+            snapshot.view(route, tolerance)
+            if snapshot is not None and snapshot.by_id.get(route['id']) is route
+            else route_view(route, tolerance)
+            for route in routes
+        ]
+
+    def search_stops(self, query, limit=10):
+        """Autocomplete stops by name or alias"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return [
+                {'id': s['id'], 'name': s['name'], 'lat': float(s['latitude']), 'lng': float(s['longitude']),
+                 'matched': s['name'], 'language': 'en', 'match': 'prefix', 'score': 1.0}
+                for s in self.db.search_stops(query, limit)
+            ]
+        return snapshot.stop_index().search(query, limit)
+
+    def nearby_stops(self, lat, lng, radius_km, limit=10):
+        """Stops within radius_km of a point, nearest first, with the routes serving each"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return self.db.get_stops_near(lat, lng, radius_km, limit)
+
+        stop_routes = snapshot.stop_routes()
+        results = []
+        for distance, stop in snapshot.spatial_index().nearby(lat, lng, radius_km, limit):
+            routes = [snapshot.routes[position] for position, _ in stop_routes.get(stop['id'], ())]
+            results.append({
+                'id': stop['id'],
+                'name': stop['name'],
+                'lat': float(stop['latitude']),
+                'lng': float(stop['longitude']),
+                'distance': round(distance, 3),
+                'routes': [{'id': r['id'], 'name': r['name'], 'type': r['type']} for r in routes]
+            })
+        return results
+
+    def plan_journeys(self, origin, destination, max_transfers=2, limit=3):
+        """Ranked journeys with transfers between origin and destination"""
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return []
+
+        index = snapshot.stop_index()
+        planner = snapshot.planner()
+        origins = planner.stations_for_names(index.stops[s]['name'] for s in index.resolve(origin))
+        destinations = planner.stations_for_names(index.stops[s]['name'] for s in index.resolve(destination))
+        return planner.plan_between(origins, destinations, max_transfers=max_transfers, limit=limit)
+
+    def import_route(self, route_data):
+        """Write a route through to the database and patch it into the snapshot; returns the import counts"""
+        counts = self.db.import_route(route_data)
+        if counts['routes']:
+            self.refresh_route(route_data['id'])
+        return counts
+
+    def refresh_route(self, route_id):
+        """Reload one route into the current snapshot, or drop the snapshot if that fails"""
+        with self._lock:
+            snapshot = self._snapshot
+            route = self.db.get_route(route_id) if snapshot is not None else None
+            if route is None:
+                self._snapshot = None
+                self.invalidations += 1
+                return
+            self._snapshot = snapshot.with_route(route)
+            self.patches += 1
+
+    def stats(self):
+        """Hit/miss counters and snapshot details"""
+        snapshot = self._snapshot
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'loads': self.loads,
+            'invalidations': self.invalidations,
+            'patches': self.patches,
+            'routes': len(snapshot.routes) if snapshot else 0,
+            'age_seconds': round(time.monotonic() - snapshot.loaded_at, 1) if snapshot else None,
+            'ttl_seconds': self.ttl
+        }
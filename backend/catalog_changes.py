@@ -0,0 +1,69 @@
+import base64
+
+# Catalog entities with a row in catalog_changes; keyset order sorts them by name
+ENTITIES = ('route', 'stop')
+
+# Change rows returned by one GET /api/catalog/changes page, by default and at most
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+
+def encode_token(change):
+    """Opaque ?since= token for the position just after a change row"""
+    key = f"{change['version']}:{change['entity']}:{change['entity_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """(version, entity, entity_id) a ?since= token points after; None for an empty token.
+
+    Raises ValueError for a token this server did not issue.
+    """
+    if not token:
+        return None
+    try:
+        key = base64.b64decode(token + '=' * (-len(token) % 4), altchars=b'-_', validate=True).decode()
+        version, entity, entity_id = key.split(':', 2)
+        version = int(version)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid since token {token!r}") from None
+    if entity not in ENTITIES:
+        raise ValueError(f"Invalid since token {token!r}")
+    return version, entity, entity_id
+
+
+def _route_values(row):
+    route_id, name, origin, destination, fare, duration, frequency, route_type = row
+    return (route_id, name, origin, destination, round(float(fare), 2), int(duration), int(frequency),
+            route_type or 'regular')
+
+
+def _stop_values(row):
+    stop_id, name, lat, lng = row
+    # DECIMAL(10,8) / DECIMAL(11,8) columns keep 8 decimals
+    return stop_id, name, round(float(lat), 8), round(float(lng), 8)
+
+
+def changed_ids(routes, stops, route_stops, stored_routes, stored_stops, stored_route_stops):
+    """Ids of the routes and stops in a catalog write that differ from what is stored.
+
+    The first three arguments are write_catalog_rows() tuples; the stored_*
+    ones are the current rows for the same ids in the same column order.
+    A route also counts as changed when its stop list changes.
+    """
+    stored_routes = {row[0]: _route_values(row) for row in stored_routes}
+    stored_stops = {row[0]: _stop_values(row) for row in stored_stops}
+
+    stop_lists, stored_stop_lists = {}, {}
+    for route_id, stop_id, order in route_stops:
+        stop_lists.setdefault(route_id, set()).add((stop_id, int(order)))
+    for route_id, stop_id, order in stored_route_stops:
+        stored_stop_lists.setdefault(route_id, set()).add((stop_id, int(order)))
+
+    route_ids = list(dict.fromkeys(
+        row[0] for row in routes
+        if stored_routes.get(row[0]) != _route_values(row)
+        or stop_lists.get(row[0], set()) != stored_stop_lists.get(row[0], set())
+    ))
+    stop_ids = list(dict.fromkeys(row[0] for row in stops if stored_stops.get(row[0]) != _stop_values(row)))
+    return route_ids, stop_ids
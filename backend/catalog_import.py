@@ -0,0 +1,161 @@
+import json
+import os
+import time
+
+import polyline
+from geo import stop_position
+from storage import StorageError
+
+# Values allowed by the routes.type column
+ROUTE_TYPES = ('regular', 'express', 'ac', 'luxury', 'semi-luxury')
+
+REQUIRED_FIELDS = ('id', 'name', 'origin', 'destination', 'fare', 'duration', 'frequency', 'stops')
+
+# Validation errors kept in the result; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+def read_routes(stream, filename=''):
+    """Route definitions from an uploaded file: JSON Lines are streamed, a JSON array is read whole"""
+    if filename.endswith(('.jsonl', '.ndjson')):
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+        return
+
+    data = json.load(stream)
+    yield from data.get('routes', []) if isinstance(data, dict) else data
+
+
+class CatalogImporter:
+    """Bulk-loads route definitions into any storage backend in batches.
+
+    Routes are consumed from any iterable, batch_size at a time, so large
+    files are never held in memory. Stops shared by several routes are
+    written once. Each batch is one atomic write_catalog_rows() call that replaces the stop
+    lists, coordinates and shapes of the routes in it, so a failed batch leaves
+    earlier batches committed and the import can simply be run again.
+    """
+
+    def __init__(self, db, batch_size=None, progress=None):
+        self.db = db
+        self.batch_size = batch_size or int(os.getenv('IMPORT_BATCH_SIZE', 200))
+        # Called with the running counts after every batch
+        self.progress = progress or (lambda counts: None)
+
+    def run(self, routes):
+        """Import routes and return row counts"""
+        started = time.monotonic()
+        counts = {
+            'routes': 0, 'stops': 0, 'route_stops': 0, 'coordinates': 0, 'shapes': 0,
+            'batches': 0, 'skipped': 0, 'duplicate_routes': 0, 'stop_conflicts': 0, 'failed_batches': 0
+        }
+        errors = []
+        seen_routes = set()
+        seen_stops = {}
+
+        batch = []
+        for route in routes:
+            problem = self._validate(route)
+            if problem:
+                counts['skipped'] += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(problem)
+                continue
+            if route['id'] in seen_routes:
+                counts['duplicate_routes'] += 1
+                continue
+            seen_routes.add(route['id'])
+
+            batch.append(route)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch, seen_stops, counts, errors)
+                batch = []
+
+        if batch:
+            self._write_batch(batch, seen_stops, counts, errors)
+
+        counts['seconds'] = round(time.monotonic() - started, 2)
+        counts['errors'] = errors
+        return counts
+
+    @staticmethod
+    def _validate(route):
+        if not isinstance(route, dict):
+            return 'Route definition is not an object'
+        missing = [field for field in REQUIRED_FIELDS if field not in route]
+        if missing:
+            return f"Route {route.get('id', '?')}: missing {', '.join(missing)}"
+        if route.get('type', 'regular') not in ROUTE_TYPES:
+            return f"Route {route['id']}: unknown type {route['type']!r}"
+        if not isinstance(route['stops'], list):
+            return f"Route {route['id']}: stops must be a list"
+        for stop in route['stops']:
+            if not isinstance(stop, dict) or 'id' not in stop or 'name' not in stop:
+                return f"Route {route['id']}: every stop needs an id, a name and a position"
+            if not (('lat' in stop and 'lng' in stop) or ('latitude' in stop and 'longitude' in stop)):
+                return f"Route {route['id']}: every stop needs an id, a name and a position"
+            try:
+                stop_position(stop)
+            except (TypeError, ValueError):
+                return f"Route {route['id']}: stop {stop['id']} has a non-numeric position"
+        for coord in route.get('coordinates') or []:
+            try:
+                float(coord[0]), float(coord[1])
+            except (TypeError, ValueError, IndexError, KeyError):
+                return f"Route {route['id']}: coordinates must be [latitude, longitude] pairs"
+        return None
+
+    def _write_batch(self, batch, seen_stops, counts, errors):
+        route_rows, stop_rows, route_stop_rows, coordinate_rows, shape_rows = [], [], [], [], []
+        new_stops = {}
+
+        for route in batch:
+            route_rows.append((
+                route['id'], route['name'], route['origin'], route['destination'],
+                route['fare'], route['duration'], route['frequency'], route.get('type', 'regular')
+            ))
+
+            for position, stop in enumerate(route['stops']):
+                lat, lng = stop_position(stop)
+                known = seen_stops.get(stop['id'])
+                if known is None:
+                    # First definition of a stop wins; later routes only reference it
+                    seen_stops[stop['id']] = (lat, lng)
+                    new_stops[stop['id']] = (stop['id'], stop['name'], lat, lng)
+                elif known != (lat, lng):
+                    counts['stop_conflicts'] += 1
+                route_stop_rows.append((route['id'], stop['id'], stop.get('order', position + 1)))
+
+            coordinates = route.get('coordinates') or []
+            coordinate_rows.extend(
+                (route['id'], coord[0], coord[1], i + 1) for i, coord in enumerate(coordinates)
+            )
+            shape_rows.extend(
+                (route['id'], tolerance, encoded, count)
+                for tolerance, (encoded, count) in polyline.route_shapes(coordinates).items()
+            )
+
+        stop_rows = list(new_stops.values())
+
+        try:
+            self.db.write_catalog_rows(route_rows, stop_rows, route_stop_rows, coordinate_rows, shape_rows)
+
+        except StorageError as e:
+            # Let the next import write these stops rather than assuming they exist
+            for stop_id in new_stops:
+                seen_stops.pop(stop_id, None)
+            counts['failed_batches'] += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"Batch starting at route {batch[0]['id']} failed: {e}")
+            print(f"Error importing batch starting at route {batch[0]['id']}: {e}")
+            return
+
+        counts['batches'] += 1
+        counts['routes'] += len(route_rows)
+        counts['stops'] += len(stop_rows)
+        counts['route_stops'] += len(route_stop_rows)
+        counts['coordinates'] += len(coordinate_rows)
+        counts['shapes'] += len(shape_rows)
+        self.progress(counts)
@@ -0,0 +1,78 @@
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent as is; compressing them costs more than it saves
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+# Brotli quality 4 compresses about as fast as gzip -6 but smaller
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/plain', 'text/csv', 'application/javascript')
+
+
+def _accepted(header):
+    """Encodings the client accepts (q > 0), lower-cased"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def choose_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header"""
+    accepted = _accepted(accept_encoding or '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def register_compression(app):
+    """Compress eligible responses of app with the best encoding the client accepts"""
+
+    @app.after_request
+    def compress_response(response):
+        response.vary.add('Accept-Encoding')
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code >= 300
+                or response.status_code == 204
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    return compress_response
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections shared by all request threads"""
+
+    def __init__(self, config, size=5, timeout=10, ping_interval=30):
+        self.config = config
+        self.size = size
+        self.timeout = timeout
+        # Connections idle for longer than this are pinged before being handed out
+        self.ping_interval = ping_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        # Borrowers that gave up waiting for a connection
+        self.timeouts = 0
+
+    def _open(self):
+        """Open a brand new connection, counting it against the pool size"""
+        try:
+            return mysql.connector.connect(**self.config)
+        except Error:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def discard(self, connection):
+        """Close a connection that cannot be reused instead of returning it, freeing its slot in the pool"""
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def _healthy(self, connection, idle_since):
+        """Check a pooled connection before lending it out, reconnecting if needed"""
+        if time.monotonic() - idle_since < self.ping_interval:
+            return True
+        try:
+            connection.ping(reconnect=True, attempts=2, delay=0)
+            return True
+        except Error:
+            return False
+
+    def acquire(self):
+        """Borrow a connection, opening a new one if the pool is not yet full"""
+        if self._closed:
+            raise PoolError("Connection pool is closed")
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                connection, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._created < self.size
+                    if can_open:
+                        self._created += 1
+                if can_open:
+                    return self._open()
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolError(f"No connection available within {self.timeout}s")
+                try:
+                    connection, idle_since = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    self.timeouts += 1
+                    raise PoolError(f"No connection available within {self.timeout}s")
+
+            if self._healthy(connection, idle_since):
+                return connection
+            # Stale connection: throw it away and try again with a fresh one
+            self.discard(connection)
+
+    def release(self, connection):
+        """Return a borrowed connection to the pool"""
+        if self._closed:
+            self.discard(connection)
+            return
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Error:
+            self.discard(connection)
+            return
+        self._idle.put((connection, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block; it is closed instead of reused if the block raises"""
+        connection = self.acquire()
+        try:
+            yield connection
+        except Exception:
+            # The connection may be dead (e.g. server gone away after a failover), and a recently
+            # used connection is not pinged before it is lent out again
+            self.discard(connection)
+            raise
+        self.release(connection)
+
+    def stats(self):
+        """Current pool occupancy"""
+        idle = self._idle.qsize()
+        return {
+            'size': self.size,
+            'open': self._created,
+            'idle': idle,
+            'in_use': self._created - idle,
+            'timeouts': self.timeouts
+        }
+
+    def close(self):
+        """Close every idle connection and stop handing out new ones"""
+        self._closed = True
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connection)
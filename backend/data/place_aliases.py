@@ -0,0 +1,27 @@
+# Sinhala, Tamil and alternative English names for places served by the network.
+# A stop is reachable under these aliases when the place name appears in its name,
+# e.g. searching "මහනුවර" or "கண்டி" finds "Kandy".
+placeAliases = {
+    "Colombo": { "si": ["කොළඹ"], "ta": ["கொழும்பு"], "en": [] },
+    "Fort": { "si": ["කොටුව"], "ta": ["கோட்டை"], "en": [] },
+    "Pettah": { "si": ["පිටකොටුව"], "ta": ["புறக்கோட்டை"], "en": [] },
+    "Borella": { "si": ["බොරැල්ල"], "ta": ["பொரளை"], "en": [] },
+    "Nugegoda": { "si": ["නුගේගොඩ"], "ta": ["நுகேகொடை"], "en": [] },
+    "Maharagama": { "si": ["මහරගම"], "ta": ["மகரகம"], "en": [] },
+    "Homagama": { "si": ["හෝමාගම"], "ta": ["ஹோமாகம"], "en": [] },
+    "Kadawatha": { "si": ["කඩවත"], "ta": ["கடவத்த"], "en": [] },
+    "Kandy": { "si": ["මහනුවර"], "ta": ["கண்டி"], "en": ["Mahanuwara", "Senkadagala"] },
+    "Kegalle": { "si": ["කෑගල්ල"], "ta": ["கேகாலை"], "en": [] },
+    "Galle": { "si": ["ගාල්ල"], "ta": ["காலி"], "en": ["Galla"] },
+    "Matara": { "si": ["මාතර"], "ta": ["மாத்தறை"], "en": [] },
+    "Kalutara": { "si": ["කළුතර"], "ta": ["களுத்துறை"], "en": ["Kaluthara"] },
+    "Negombo": { "si": ["මීගමුව"], "ta": ["நீர்கொழும்பு"], "en": ["Meegamuwa"] },
+    "Chilaw": { "si": ["හලාවත"], "ta": ["சிலாபம்"], "en": ["Halawatha"] },
+    "Puttalam": { "si": ["පුත්තලම"], "ta": ["புத்தளம்"], "en": [] },
+    "Kurunegala": { "si": ["කුරුණෑගල"], "ta": ["குருநாகல்"], "en": [] },
+    "Anuradhapura": { "si": ["අනුරාධපුරය"], "ta": ["அனுராதபுரம்"], "en": [] },
+    "Jaffna": { "si": ["යාපනය"], "ta": ["யாழ்ப்பாணம்"], "en": ["Yalpanam", "Yapanaya"] },
+    "Ratnapura": { "si": ["රත්නපුර"], "ta": ["இரத்தினபுரி"], "en": ["Rathnapura"] },
+    "Trincomalee": { "si": ["ත්‍රිකුණාමලය"], "ta": ["திருகோணமலை"], "en": ["Trinco"] },
+    "Batticaloa": { "si": ["මඩකලපුව"], "ta": ["மட்டக்களப்பு"], "en": [] }
+}
@@ -1,16 +1,36 @@
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-import mysql.connector
 from mysql.connector import Error
 from datetime import datetime, timedelta
 import json
+from connection_pool import ConnectionPool
+import catalog_changes
+import metrics
+import migrations
+import polyline
+from replicas import ReplicaRouter, replica_configs
+from sql_storage import SQLStorage
+from storage import CATALOG_TABLES, StorageError
+
+# Schema version that added the route_shapes table
+ROUTE_SHAPES_VERSION = 7
+
+class DatabaseManager(SQLStorage):
+    backend = 'mysql'
+
+    # Clients remembered for read-your-writes before expired ones are pruned
+    MAX_TRACKED_WRITERS = 10000
 
-class DatabaseManager:
     def __init__(self):
+        # The MySQL primary always accepts writes
+        super().__init__(read_only=False)
         # Aiven MySQL connection configuration
         # In production, these should be environment variables
         self.config = {
@@ -23,456 +43,701 @@ class DatabaseManager:
             'ssl_ca': os.path.join(os.path.dirname(__file__), os.getenv('AIVEN_MYSQL_SSL_CA_FILENAME', 'ca.pem')),
             'autocommit': True
         }
-        self.connection = None
+        # Connection pool settings, shared by every request thread in the process
+        self.pool_size = int(os.getenv('AIVEN_MYSQL_POOL_SIZE', 5))
+        self.pool_timeout = float(os.getenv('AIVEN_MYSQL_POOL_TIMEOUT', 10))
+        self.pool_ping_interval = float(os.getenv('AIVEN_MYSQL_POOL_PING_INTERVAL', 30))
+        # Reads from a client that wrote within this many seconds go to the primary
+        self.read_your_writes = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+        # Client tagged by set_client() and time of the last write, per request thread
+        self._session = threading.local()
+        self._recent_writers = {}
+        self._writers_lock = threading.Lock()
 
     def connect(self):
-        """Establish connection to Aiven MySQL database"""
+        """Create the connection pool and verify the database is reachable"""
+        if self.pool:
+            return True
+        pool = ConnectionPool(self.config, size=self.pool_size,
+                              timeout=self.pool_timeout, ping_interval=self.pool_ping_interval)
         try:
-            self.connection = mysql.connector.connect(**self.config)
-            if self.connection.is_connected():
-                print("Successfully connected to Aiven MySQL database")
-                return True
+            with pool.connection() as connection:
+                if connection.is_connected():
+                    print("Successfully connected to Aiven MySQL database")
+            self.pool = pool
         except Error as e:
             print(f"Error connecting to MySQL database: {e}")
+            pool.close()
             return False
 
+        configs = replica_configs(self.config)
+        if configs:
+            self.replicas = ReplicaRouter(configs, pool_size=self.pool_size, pool_timeout=self.pool_timeout,
+                                          pool_ping_interval=self.pool_ping_interval)
+            self.replicas.start()
+            in_rotation = sum(replica.in_rotation for replica in self.replicas.replicas)
+            print(f"Reading from {in_rotation} of {len(configs)} MySQL replicas ({self.replicas.selection})")
+        return True
+
     def disconnect(self):
-        """Close database connection"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("MySQL connection closed")
+        """Close all pooled database connections"""
+        if self.replicas:
+            self.replicas.close()
+            self.replicas = None
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+            print("MySQL connection pool closed")
+
+    def is_connected(self):
+        """Check that a pooled connection can reach the database"""
+        if not self.pool:
+            return False
+        try:
+            with self.pool.connection() as connection:
+                return connection.is_connected()
+        except Error:
+            return False
 
-    def create_tables(self):
-        """Create necessary tables for the bus app"""
-        if not self.connection:
+    @contextmanager
+    def get_connection(self):
+        """Borrow a connection from the pool for the duration of a with-block"""
+        with self.pool.connection() as connection:
+            yield connection
+
+    @contextmanager
+    def cursor(self, dictionary=False):
+        """Borrow a pooled connection and yield a cursor on it"""
+        with self.get_connection() as connection:
+            cursor = metrics.wrap_cursor(connection.cursor(dictionary=dictionary), self.backend)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self, dictionary=False):
+        """Yield a cursor inside a transaction that commits on success and rolls back on error"""
+        with self.get_connection() as connection:
+            connection.start_transaction()
+            cursor = metrics.wrap_cursor(connection.cursor(dictionary=dictionary), self.backend)
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        self._wrote()
+
+    def _read_connection(self):
+        """(pool, connection) on a read replica, or on the primary if none is usable or this client just wrote"""
+        replica = None
+        if self.replicas and not self._reads_from_primary():
+            replica = self.replicas.choose()
+
+        if replica is not None:
+            try:
+                connection = replica.pool.acquire()
+                replica.reads += 1
+                return replica.pool, connection
+            except Error as e:
+                self.replicas.remove(replica, e)
+        return self.pool, self.pool.acquire()
+
+    @contextmanager
+    def read_cursor(self, dictionary=False):
+        """Yield a cursor on a read replica, or on the primary if none is usable or this client just wrote"""
+        pool, connection = self._read_connection()
+        try:
+            cursor = metrics.wrap_cursor(connection.cursor(dictionary=dictionary), self.backend)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+        except Exception:
+            # Same as ConnectionPool.connection(): a connection that failed may be dead
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+
+    def set_client(self, client_id):
+        """Tag the calls made by this thread with the client they serve, for read-your-writes"""
+        self._session.client = client_id
+        self._session.wrote_at = None
+
+    def _wrote(self):
+        """Send this thread's and this client's reads to the primary for the read-your-writes window"""
+        now = time.monotonic()
+        self._session.wrote_at = now
+        client = getattr(self._session, 'client', None)
+        if client is None or not self.replicas:
+            return
+        with self._writers_lock:
+            if len(self._recent_writers) >= self.MAX_TRACKED_WRITERS:
+                cutoff = now - self.read_your_writes
+                self._recent_writers = {
+                    writer: wrote_at for writer, wrote_at in self._recent_writers.items() if wrote_at > cutoff
+                }
+            self._recent_writers[client] = now
+
+    def _reads_from_primary(self):
+        cutoff = time.monotonic() - self.read_your_writes
+        wrote_at = getattr(self._session, 'wrote_at', None)
+        if wrote_at is not None and wrote_at > cutoff:
+            return True
+        return self.recently_wrote(getattr(self._session, 'client', None))
+
+    def recently_wrote(self, client_id):
+        """Whether client_id wrote within the read-your-writes window, so its reads go to the primary"""
+        if client_id is None:
             return False
+        cutoff = time.monotonic() - self.read_your_writes
+        return self._recent_writers.get(client_id, cutoff) > cutoff
+
+    @contextmanager
+    def named_lock(self, name):
+        """Yield whether a MySQL named lock was taken, so only one process across all hosts holds it"""
+        with self.cursor() as lock_cursor:
+            lock_cursor.execute("SELECT GET_LOCK(%s, 0)", (name,))
+            acquired = lock_cursor.fetchone()[0] == 1
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    lock_cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+                    lock_cursor.fetchone()
+
+    def get_schema_version(self):
+        """Return the schema version recorded in the database, or None if unreachable"""
+        if not self.pool:
+            return None
 
-        cursor = self.connection.cursor()
-        
         try:
-            # Routes table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS routes (
-                    id VARCHAR(20) PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    origin VARCHAR(100) NOT NULL,
-                    destination VARCHAR(100) NOT NULL,
-                    fare DECIMAL(10,2) NOT NULL,
-                    duration INT NOT NULL,
-                    frequency INT NOT NULL,
-                    type ENUM('regular', 'express', 'ac') DEFAULT 'regular',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Stops table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS stops (
-                    id VARCHAR(50) PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    latitude DECIMAL(10, 8) NOT NULL,
-                    longitude DECIMAL(11, 8) NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Route stops junction table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS route_stops (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    route_id VARCHAR(20) NOT NULL,
-                    stop_id VARCHAR(50) NOT NULL,
-                    stop_order INT NOT NULL,
-                    FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
-                    FOREIGN KEY (stop_id) REFERENCES stops(id) ON DELETE CASCADE,
-                    UNIQUE KEY unique_route_stop (route_id, stop_id),
-                    INDEX idx_route_order (route_id, stop_order)
-                )
-            """)
-
-            # Route coordinates table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS route_coordinates (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    route_id VARCHAR(20) NOT NULL,
-                    latitude DECIMAL(10, 8) NOT NULL,
-                    longitude DECIMAL(11, 8) NOT NULL,
-                    sequence_order INT NOT NULL,
-                    FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
-                    INDEX idx_route_sequence (route_id, sequence_order)
-                )
-            """)
-
-            # Buses table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS buses (
-                    id VARCHAR(50) PRIMARY KEY,
-                    route_id VARCHAR(20) NOT NULL,
-                    bus_number VARCHAR(20) NOT NULL,
-                    vehicle_type ENUM('regular', 'ac') DEFAULT 'regular',
-                    total_seats INT DEFAULT 50,
-                    status ENUM('active', 'inactive', 'maintenance') DEFAULT 'active',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE
-                )
-            """)
-
-            # Bus locations table (for live tracking)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS bus_locations (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    bus_id VARCHAR(50) NOT NULL,
-                    latitude DECIMAL(10, 8) NOT NULL,
-                    longitude DECIMAL(11, 8) NOT NULL,
-                    current_stop_id VARCHAR(50),
-                    next_stop_id VARCHAR(50),
-                    occupied_seats INT DEFAULT 0,
-                    delay_minutes INT DEFAULT 0,
-                    delay_reason VARCHAR(255),
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
-                    FOREIGN KEY (current_stop_id) REFERENCES stops(id),
-                    FOREIGN KEY (next_stop_id) REFERENCES stops(id),
-                    INDEX idx_bus_timestamp (bus_id, timestamp)
-                )
-            """)
-
-            # User favorites table (for future login functionality)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_favorites (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id VARCHAR(100) NOT NULL,
-                    route_id VARCHAR(20) NOT NULL,
-                    origin_stop_id VARCHAR(50),
-                    destination_stop_id VARCHAR(50),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
-                    FOREIGN KEY (origin_stop_id) REFERENCES stops(id),
-                    FOREIGN KEY (destination_stop_id) REFERENCES stops(id),
-                    UNIQUE KEY unique_user_favorite (user_id, route_id, origin_stop_id, destination_stop_id)
-                )
-            """)
-
-            # Bus arrival predictions table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS bus_arrivals (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    bus_id VARCHAR(50) NOT NULL,
-                    stop_id VARCHAR(50) NOT NULL,
-                    estimated_arrival TIMESTAMP NOT NULL,
-                    actual_arrival TIMESTAMP NULL,
-                    delay_minutes INT DEFAULT 0,
-                    capacity_status ENUM('available', 'moderate', 'full') DEFAULT 'available',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
-                    FOREIGN KEY (stop_id) REFERENCES stops(id) ON DELETE CASCADE,
-                    INDEX idx_stop_arrival (stop_id, estimated_arrival)
-                )
-            """)
+            with self.cursor() as cursor:
+                return migrations.current_version(cursor)
+        except Error as e:
+            print(f"Error reading schema version: {e}")
+            return None
+
+    def migrate(self, target=None):
+        """Apply pending schema migrations up to target (default: latest)"""
+        if not self.pool:
+            return False
 
-            self.connection.commit()
-            print("All tables created successfully")
+        try:
+            with self.cursor() as cursor:
+                version = migrations.migrate(cursor, target)
+            print(f"Database schema is at version {version}")
+            if version >= ROUTE_SHAPES_VERSION:
+                # Routes written before shapes were stored get theirs now
+                self.build_route_shapes()
             return True
 
         except Error as e:
-            print(f"Error creating tables: {e}")
+            print(f"Error migrating database: {e}")
             return False
-        finally:
-            cursor.close()
 
-    def insert_route(self, route_data):
-        """Insert a new route into the database"""
-        if not self.connection:
+    def ensure_schema(self, auto_migrate=None):
+        """Check the schema version once at startup and migrate if it is behind"""
+        if auto_migrate is None:
+            auto_migrate = os.getenv('AUTO_MIGRATE', 'true').lower() == 'true'
+
+        version = self.get_schema_version()
+        if version is None:
+            return False
+        if version >= migrations.LATEST_VERSION:
+            return True
+        if not auto_migrate:
+            print(f"Database schema is at version {version}, "
+                  f"expected {migrations.LATEST_VERSION}; run 'python database.py migrate'")
             return False
+        return self.migrate()
+
+    def create_tables(self):
+        """Create necessary tables for the bus app"""
+        return self.migrate()
+
+    def _write_route_shapes(self, cursor, route_id, coordinates):
+        """Store the encoded polyline of a route at every simplification level"""
+        cursor.execute("DELETE FROM route_shapes WHERE route_id = %s", (route_id,))
+        cursor.executemany("""
+            INSERT INTO route_shapes (route_id, tolerance_m, polyline, point_count)
+            VALUES (%s, %s, %s, %s)
+        """, [
+            (route_id, tolerance, encoded, count)
+            for tolerance, (encoded, count) in polyline.route_shapes(coordinates).items()
+        ])
+
+    def build_route_shapes(self, rebuild=False):
+        """Encode and simplify route_coordinates for routes without stored shapes (or all with rebuild)"""
+        if not self.pool:
+            return 0
 
-        cursor = self.connection.cursor()
-        
         try:
-            # Insert route
-            route_query = """
-                INSERT INTO routes (id, name, origin, destination, fare, duration, frequency, type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                name = VALUES(name), origin = VALUES(origin), destination = VALUES(destination),
-                fare = VALUES(fare), duration = VALUES(duration), frequency = VALUES(frequency),
-                type = VALUES(type), updated_at = CURRENT_TIMESTAMP
-            """
-            cursor.execute(route_query, (
-                route_data['id'], route_data['name'], route_data['origin'],
-                route_data['destination'], route_data['fare'], route_data['duration'],
-                route_data['frequency'], route_data.get('type', 'regular')
-            ))
-
-            # Insert stops
-            for stop in route_data['stops']:
-                stop_query = """
+            with self.cursor(dictionary=True) as cursor:
+                if rebuild:
+                    cursor.execute("SELECT id FROM routes ORDER BY id")
+                else:
+                    cursor.execute("""
+                        SELECT r.id FROM routes r
+                        LEFT JOIN route_shapes rsh ON rsh.route_id = r.id
+                        WHERE rsh.route_id IS NULL
+                        ORDER BY r.id
+                    """)
+                route_ids = [row['id'] for row in cursor.fetchall()]
+
+            for i in range(0, len(route_ids), self.ROUTE_BATCH_SIZE):
+                batch = route_ids[i:i + self.ROUTE_BATCH_SIZE]
+                with self.transaction() as cursor:
+                    cursor.execute(f"""
+                        SELECT route_id, latitude, longitude FROM route_coordinates
+                        WHERE route_id IN ({', '.join(['%s'] * len(batch))})
+                        ORDER BY route_id, sequence_order
+                    """, tuple(batch))
+                    coordinates = {route_id: [] for route_id in batch}
+                    for route_id, latitude, longitude in cursor.fetchall():
+                        coordinates[route_id].append((float(latitude), float(longitude)))
+                    for route_id, points in coordinates.items():
+                        self._write_route_shapes(cursor, route_id, points)
+
+            if route_ids:
+                print(f"Built shapes for {len(route_ids)} routes")
+            return len(route_ids)
+
+        except Error as e:
+            print(f"Error building route shapes: {e}")
+            return 0
+
+    # Rows per executemany() call, to stay well under max_allowed_packet
+    ROWS_PER_STATEMENT = 1000
+
+    def write_catalog_rows(self, routes, stops, route_stops, coordinates, shapes):
+        """Upsert routes and stops and replace the children of those routes in one transaction"""
+        route_ids = tuple(row[0] for row in routes)
+        in_list = ', '.join(['%s'] * len(route_ids))
+
+        try:
+            with self.transaction() as cursor:
+                # Compare with the stored rows first so unchanged routes and stops stay out of the change log
+                changed_routes, changed_stops = catalog_changes.changed_ids(
+                    routes, stops, route_stops,
+                    self._select_in(cursor, "SELECT id, name, origin, destination, fare, duration, frequency, type "
+                                            "FROM routes WHERE id IN ({})", route_ids),
+                    self._select_in(cursor, "SELECT id, name, latitude, longitude FROM stops WHERE id IN ({})",
+                                    tuple(dict.fromkeys(row[0] for row in stops))),
+                    self._select_in(cursor, "SELECT route_id, stop_id, stop_order FROM route_stops "
+                                            "WHERE route_id IN ({})", route_ids)
+                )
+
+                self._insert_many(cursor, """
+                    INSERT INTO routes (id, name, origin, destination, fare, duration, frequency, type)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                    name = VALUES(name), origin = VALUES(origin), destination = VALUES(destination),
+                    fare = VALUES(fare), duration = VALUES(duration), frequency = VALUES(frequency),
+                    type = VALUES(type), updated_at = CURRENT_TIMESTAMP
+                """, routes)
+                self._insert_many(cursor, """
                     INSERT INTO stops (id, name, latitude, longitude)
                     VALUES (%s, %s, %s, %s)
                     ON DUPLICATE KEY UPDATE
                     name = VALUES(name), latitude = VALUES(latitude), longitude = VALUES(longitude)
-                """
-                cursor.execute(stop_query, (stop['id'], stop['name'], stop['lat'], stop['lng']))
+                """, stops)
+
+                # Children are replaced wholesale so re-importing a route never leaves stale rows
+                if route_ids:
+                    for table in ('route_stops', 'route_coordinates', 'route_shapes'):
+                        cursor.execute(f"DELETE FROM {table} WHERE route_id IN ({in_list})", route_ids)
 
-                # Insert route-stop relationship
-                route_stop_query = """
+                self._insert_many(cursor, """
                     INSERT INTO route_stops (route_id, stop_id, stop_order)
                     VALUES (%s, %s, %s)
                     ON DUPLICATE KEY UPDATE stop_order = VALUES(stop_order)
-                """
-                cursor.execute(route_stop_query, (route_data['id'], stop['id'], stop['order']))
-
-            # Insert route coordinates
-            for i, coord in enumerate(route_data['coordinates']):
-                coord_query = """
+                """, route_stops)
+                self._insert_many(cursor, """
                     INSERT INTO route_coordinates (route_id, latitude, longitude, sequence_order)
                     VALUES (%s, %s, %s, %s)
-                """
-                cursor.execute(coord_query, (route_data['id'], coord[0], coord[1], i + 1))
+                """, coordinates)
+                self._insert_many(cursor, """
+                    INSERT INTO route_shapes (route_id, tolerance_m, polyline, point_count)
+                    VALUES (%s, %s, %s, %s)
+                """, shapes)
+                self._record_catalog_changes(cursor, changed_routes, changed_stops)
+
+        except Error as e:
+            raise StorageError(e) from e
+
+    def _insert_many(self, cursor, query, rows):
+        for i in range(0, len(rows), self.ROWS_PER_STATEMENT):
+            cursor.executemany(query, rows[i:i + self.ROWS_PER_STATEMENT])
+
+    def _select_in(self, cursor, query, ids):
+        """Rows of query for ids, filling its IN ({}) list in chunks of ROWS_PER_STATEMENT"""
+        rows = []
+        for i in range(0, len(ids), self.ROWS_PER_STATEMENT):
+            batch = ids[i:i + self.ROWS_PER_STATEMENT]
+            cursor.execute(query.format(', '.join(['%s'] * len(batch))), batch)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def _record_catalog_changes(self, cursor, route_ids, stop_ids, deleted=False):
+        """Log routes and stops changed (or deleted) by the current transaction under a new catalog version.
+
+        Delete paths must call this with deleted=True in the same transaction
+        so offline clients learn about the removal.
+        """
+        if not route_ids and not stop_ids:
+            return
+        # Row lock held until commit: versions are committed in increasing order
+        cursor.execute("UPDATE catalog_sequence SET value = LAST_INSERT_ID(value + 1) WHERE id = 1")
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        version = cursor.fetchone()[0]
+        self._insert_many(cursor, """
+            INSERT INTO catalog_changes (entity, entity_id, version, deleted)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE version = VALUES(version), deleted = VALUES(deleted)
+        """, [('route', route_id, version, deleted) for route_id in route_ids]
+              + [('stop', stop_id, version, deleted) for stop_id in stop_ids])
+
+    def iter_catalog_rows(self, table, batch_size=1000):
+        """Stream a catalog table in key order from a server-side result set"""
+        columns, order = CATALOG_TABLES[table]
+        if not self.pool:
+            raise StorageError("Not connected to MySQL")
 
-            self.connection.commit()
+        try:
+            pool, connection = self._read_connection()
+        except Error as e:
+            raise StorageError(f"Error reading {table}: {e}") from e
+        finished = False
+        try:
+            # Unbuffered, so each fetchmany() reads the next rows off the wire
+            # instead of the whole result being loaded by execute()
+            cursor = metrics.wrap_cursor(connection.cursor(buffered=False, dictionary=True), self.backend)
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+            finished = True
+        except Error as e:
+            raise StorageError(f"Error reading {table}: {e}") from e
+        finally:
+            if finished:
+                pool.release(connection)
+            else:
+                # Rows left unread on the wire make the connection unusable
+                pool.discard(connection)
+
+    def upsert_stop_aliases(self, aliases):
+        """Insert or update stop aliases given as {stop_id, alias, language} rows"""
+        if not self.pool:
+            return False
+
+        try:
+            with self.transaction() as cursor:
+                self._insert_many(cursor, """
+                    INSERT INTO stop_aliases (stop_id, alias, language)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE language = VALUES(language)
+                """, [(row['stop_id'], row['alias'], row['language']) for row in aliases])
+                # Aliases are part of the served catalog, so they move its version too
+                self._record_catalog_changes(cursor, (), dict.fromkeys(row['stop_id'] for row in aliases))
             return True
 
         except Error as e:
-            print(f"Error inserting route: {e}")
-            self.connection.rollback()
+            print(f"Error writing stop aliases: {e}")
             return False
-        finally:
-            cursor.close()
 
-    def get_routes(self, origin=None, destination=None):
-        """Get routes from database with optional filtering"""
-        if not self.connection:
-            return []
+    def get_catalog_version(self):
+        """Latest catalog change version, or None if the database could not be read"""
+        if not self.pool:
+            return None
 
-        cursor = self.connection.cursor(dictionary=True)
-        
         try:
-            if origin and destination:
-                # Find routes that have both origin and destination stops
-                query = """
-                    SELECT DISTINCT r.* FROM routes r
-                    JOIN route_stops rs1 ON r.id = rs1.route_id
-                    JOIN stops s1 ON rs1.stop_id = s1.id
-                    JOIN route_stops rs2 ON r.id = rs2.route_id
-                    JOIN stops s2 ON rs2.stop_id = s2.id
-                    WHERE (s1.name LIKE %s OR r.origin LIKE %s)
-                    AND (s2.name LIKE %s OR r.destination LIKE %s)
-                    AND rs1.stop_order < rs2.stop_order
-                """
-                cursor.execute(query, (f'%{origin}%', f'%{origin}%', f'%{destination}%', f'%{destination}%'))
-            else:
-                query = "SELECT * FROM routes ORDER BY id"
-                cursor.execute(query)
-
-            routes = cursor.fetchall()
-            
-            # Get stops and coordinates for each route
-            for route in routes:
-                # Get stops
-                stops_query = """
-                    SELECT s.*, rs.stop_order as `order`
-                    FROM stops s
-                    JOIN route_stops rs ON s.id = rs.stop_id
-                    WHERE rs.route_id = %s
-                    ORDER BY rs.stop_order
-                """
-                cursor.execute(stops_query, (route['id'],))
-                route['stops'] = cursor.fetchall()
-
-                # Get coordinates
-                coords_query = """
-                    SELECT latitude, longitude
-                    FROM route_coordinates
-                    WHERE route_id = %s
-                    ORDER BY sequence_order
-                """
-                cursor.execute(coords_query, (route['id'],))
-                coords = cursor.fetchall()
-                route['coordinates'] = [[float(c['latitude']), float(c['longitude'])] for c in coords]
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT value AS version FROM catalog_sequence WHERE id = 1")
+                return cursor.fetchone()
 
-            return routes
+        except Error as e:
+            print(f"Error reading catalog version: {e}")
+            return None
+
+    def upsert_buses(self, buses):
+        """Insert or update buses given as rows with BUS_COLUMNS"""
+        if not self.pool:
+            return False
+
+        columns = ', '.join(self.BUS_COLUMNS)
+        placeholders = ', '.join(['%s'] * len(self.BUS_COLUMNS))
+        updates = ', '.join(f"{c} = VALUES({c})" for c in self.BUS_COLUMNS if c != 'id')
+        try:
+            with self.transaction() as cursor:
+                self._insert_many(cursor, f"""
+                    INSERT INTO buses ({columns}) VALUES ({placeholders})
+                    ON DUPLICATE KEY UPDATE {updates}
+                """, [tuple(bus.get(c) for c in self.BUS_COLUMNS) for bus in buses])
+            return True
 
         except Error as e:
-            print(f"Error getting routes: {e}")
-            return []
-        finally:
-            cursor.close()
+            print(f"Error writing buses: {e}")
+            return False
 
     def update_bus_location(self, bus_id, latitude, longitude, current_stop_id=None, 
                            next_stop_id=None, occupied_seats=0, delay_minutes=0, delay_reason=None):
         """Update bus location and status"""
-        if not self.connection:
+        if not self.pool:
             return False
 
-        cursor = self.connection.cursor()
-        
+        location = {
+            'bus_id': bus_id, 'latitude': latitude, 'longitude': longitude,
+            'current_stop_id': current_stop_id, 'next_stop_id': next_stop_id,
+            'occupied_seats': occupied_seats, 'delay_minutes': delay_minutes,
+            'delay_reason': delay_reason, 'timestamp': datetime.now()
+        }
         try:
-            query = """
-                INSERT INTO bus_locations 
-                (bus_id, latitude, longitude, current_stop_id, next_stop_id, 
-                 occupied_seats, delay_minutes, delay_reason)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            cursor.execute(query, (
-                bus_id, latitude, longitude, current_stop_id, next_stop_id,
-                occupied_seats, delay_minutes, delay_reason
-            ))
-            
-            self.connection.commit()
+            with self.transaction() as cursor:
+                self._write_locations(cursor, [location])
             return True
 
         except Error as e:
             print(f"Error updating bus location: {e}")
             return False
-        finally:
-            cursor.close()
+
+    # Column order for multi-row bus_locations inserts
+    LOCATION_COLUMNS = ('bus_id', 'latitude', 'longitude', 'current_stop_id', 'next_stop_id',
+                        'occupied_seats', 'delay_minutes', 'delay_reason', 'timestamp')
+
+    def insert_bus_locations(self, locations):
+        """Insert many location pings with one multi-row insert"""
+        if not self.pool:
+            return False
+        if not locations:
+            return True
+
+        try:
+            with self.transaction() as cursor:
+                # IGNORE skips pings for unknown buses/stops instead of failing the whole batch
+                self._write_locations(cursor, locations, ignore=True)
+            return True
+
+        except Error as e:
+            print(f"Error inserting bus locations: {e}")
+            return False
+
+    def _write_locations(self, cursor, locations, ignore=False):
+        """Append pings to the history and upsert each bus's latest position"""
+        columns = ', '.join(self.LOCATION_COLUMNS)
+        placeholders = ', '.join(['%s'] * len(self.LOCATION_COLUMNS))
+        modifier = 'IGNORE ' if ignore else ''
+
+        cursor.executemany(f"""
+            INSERT {modifier}INTO bus_locations ({columns})
+            VALUES ({placeholders})
+        """, [tuple(location.get(c) for c in self.LOCATION_COLUMNS) for location in locations])
+
+        # Only the newest ping per bus matters for the current position
+        latest = {}
+        for location in locations:
+            current = latest.get(location['bus_id'])
+            if current is None or location['timestamp'] >= current['timestamp']:
+                latest[location['bus_id']] = location
+
+        # Out-of-order pings must not overwrite a newer position; timestamp is assigned last
+        # because MySQL evaluates the assignments left to right
+        updates = ', '.join(
+            f"{c} = IF(VALUES(timestamp) >= timestamp, VALUES({c}), {c})"
+            for c in self.LOCATION_COLUMNS if c not in ('bus_id', 'timestamp')
+        )
+        cursor.executemany(f"""
+            INSERT {modifier}INTO bus_current_location ({columns})
+            VALUES ({placeholders})
+            ON DUPLICATE KEY UPDATE {updates}, timestamp = GREATEST(timestamp, VALUES(timestamp))
+        """, [tuple(location.get(c) for c in self.LOCATION_COLUMNS) for location in latest.values()])
+
+    @staticmethod
+    def live_buses_query(route_id=None):
+        """SQL and parameters for get_live_buses, shared with AsyncDatabaseManager"""
+        query = """
+            SELECT bcl.*, b.route_id, b.bus_number, b.vehicle_type, b.total_seats,
+                   s1.name as current_stop_name, s2.name as next_stop_name
+            FROM bus_current_location bcl
+            JOIN buses b ON bcl.bus_id = b.id
+            LEFT JOIN stops s1 ON bcl.current_stop_id = s1.id
+            LEFT JOIN stops s2 ON bcl.next_stop_id = s2.id
+            WHERE bcl.timestamp >= DATE_SUB(NOW(), INTERVAL 5 MINUTE)
+        """
+
+        params = []
+        if route_id:
+            # buses(route_id) is indexed, so this only touches the route's buses
+            query += " AND b.route_id = %s"
+            params.append(route_id)
+
+        query += " ORDER BY bcl.timestamp DESC"
+        return query, params
 
     def get_live_buses(self, route_id=None):
-        """Get live bus locations"""
-        if not self.connection:
+        """Get the latest position of every bus that reported in the last 5 minutes"""
+        if not self.pool:
             return []
 
-        cursor = self.connection.cursor(dictionary=True)
-        
         try:
-            query = """
-                SELECT bl.*, b.bus_number, b.vehicle_type, b.total_seats,
-                       s1.name as current_stop_name, s2.name as next_stop_name
-                FROM bus_locations bl
-                JOIN buses b ON bl.bus_id = b.id
-                LEFT JOIN stops s1 ON bl.current_stop_id = s1.id
-                LEFT JOIN stops s2 ON bl.next_stop_id = s2.id
-                WHERE bl.timestamp >= DATE_SUB(NOW(), INTERVAL 5 MINUTE)
-            """
-            
-            params = []
-            if route_id:
-                query += " AND b.route_id = %s"
-                params.append(route_id)
-                
-            query += " ORDER BY bl.timestamp DESC"
-            
-            cursor.execute(query, params)
-            return cursor.fetchall()
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute(*self.live_buses_query(route_id))
+                return cursor.fetchall()
 
         except Error as e:
             print(f"Error getting live buses: {e}")
             return []
-        finally:
-            cursor.close()
+
+    # Rows per executemany() call when writing arrival predictions
+    ARRIVAL_BATCH_SIZE = 1000
+
+    def upsert_bus_arrivals(self, arrivals):
+        """Insert or update predictions given as (bus_id, stop_id, estimated, actual, delay, capacity) tuples"""
+        if not self.pool:
+            return False
+
+        # A recorded actual arrival is kept until a new trip predicts the stop again
+        query = """
+            INSERT INTO bus_arrivals
+                (bus_id, stop_id, estimated_arrival, actual_arrival, delay_minutes, capacity_status)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                estimated_arrival = IF(VALUES(actual_arrival) IS NULL OR actual_arrival IS NULL,
+                                       VALUES(estimated_arrival), estimated_arrival),
+                delay_minutes = VALUES(delay_minutes),
+                capacity_status = VALUES(capacity_status),
+                actual_arrival = IF(VALUES(actual_arrival) IS NULL, NULL,
+                                    COALESCE(actual_arrival, VALUES(actual_arrival)))
+        """
+        try:
+            with self.transaction() as cursor:
+                for i in range(0, len(arrivals), self.ARRIVAL_BATCH_SIZE):
+                    cursor.executemany(query, arrivals[i:i + self.ARRIVAL_BATCH_SIZE])
+            return True
+
+        except Error as e:
+            print(f"Error writing bus arrivals: {e}")
+            return False
+
+    # Shared with AsyncDatabaseManager
+    BUS_ARRIVALS_QUERY = """
+        SELECT ba.*, b.bus_number, b.vehicle_type, b.total_seats, r.name as route_name
+        FROM bus_arrivals ba
+        JOIN buses b ON ba.bus_id = b.id
+        JOIN routes r ON b.route_id = r.id
+        WHERE ba.stop_id = %s 
+        AND ba.estimated_arrival >= NOW()
+        AND ba.actual_arrival IS NULL
+        ORDER BY ba.estimated_arrival
+        LIMIT %s
+    """
 
     def get_bus_arrivals(self, stop_id, limit=10):
         """Get upcoming bus arrivals for a stop"""
-        if not self.connection:
+        if not self.pool:
             return []
 
-        cursor = self.connection.cursor(dictionary=True)
-        
         try:
-            query = """
-                SELECT ba.*, b.bus_number, b.vehicle_type, b.total_seats, r.name as route_name
-                FROM bus_arrivals ba
-                JOIN buses b ON ba.bus_id = b.id
-                JOIN routes r ON b.route_id = r.id
-                WHERE ba.stop_id = %s 
-                AND ba.estimated_arrival >= NOW()
-                ORDER BY ba.estimated_arrival
-                LIMIT %s
-            """
-            
-            cursor.execute(query, (stop_id, limit))
-            return cursor.fetchall()
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute(self.BUS_ARRIVALS_QUERY, (stop_id, limit))
+                return cursor.fetchall()
 
         except Error as e:
             print(f"Error getting bus arrivals: {e}")
             return []
-        finally:
-            cursor.close()
 
     def add_user_favorite(self, user_id, route_id, origin_stop_id=None, destination_stop_id=None):
         """Add a route to user favorites"""
-        if not self.connection:
+        if not self.pool:
             return False
 
-        cursor = self.connection.cursor()
-        
         try:
-            query = """
-                INSERT INTO user_favorites (user_id, route_id, origin_stop_id, destination_stop_id)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE created_at = CURRENT_TIMESTAMP
-            """
-            cursor.execute(query, (user_id, route_id, origin_stop_id, destination_stop_id))
-            
-            self.connection.commit()
+            with self.cursor() as cursor:
+                query = """
+                    INSERT INTO user_favorites (user_id, route_id, origin_stop_id, destination_stop_id)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE created_at = CURRENT_TIMESTAMP
+                """
+                cursor.execute(query, (user_id, route_id, origin_stop_id, destination_stop_id))
+            self._wrote()
             return True
 
         except Error as e:
             print(f"Error adding user favorite: {e}")
             return False
-        finally:
-            cursor.close()
-
-    def get_user_favorites(self, user_id):
-        """Get user's favorite routes"""
-        if not self.connection:
-            return []
 
-        cursor = self.connection.cursor(dictionary=True)
-        
-        try:
-            query = """
-                SELECT uf.*, r.name as route_name, r.origin, r.destination,
-                       s1.name as origin_stop_name, s2.name as destination_stop_name
-                FROM user_favorites uf
-                JOIN routes r ON uf.route_id = r.id
-                LEFT JOIN stops s1 ON uf.origin_stop_id = s1.id
-                LEFT JOIN stops s2 ON uf.destination_stop_id = s2.id
-                WHERE uf.user_id = %s
-                ORDER BY uf.created_at DESC
-            """
-            
-            cursor.execute(query, (user_id,))
-            return cursor.fetchall()
+# Example usage and data migration
+def print_import_progress(counts):
+    print(f"Imported {counts['routes']} routes, {counts['stops']} stops, "
+          f"{counts['coordinates']} coordinates ({counts['batches']} batches)")
 
-        except Error as e:
-            print(f"Error getting user favorites: {e}")
-            return []
-        finally:
-            cursor.close()
+def migrate_sample_data(path=None):
+    """Migrate sample data from data/routes.py (or a JSON/JSON Lines file) to the database"""
+    from catalog_import import CatalogImporter, read_routes
 
-# Example usage and data migration
-def migrate_sample_data():
-    """Migrate sample data from routes.js to database"""
-    project_root = os.path.join(os.path.dirname(__file__), '..')
-    sys.path.append(project_root)
+    db = DatabaseManager()
+    if not db.connect():
+        return None
+    db.create_tables()
 
+    importer = CatalogImporter(db, progress=print_import_progress)
     try:
-        from data.routes import busRoutes
-    except ImportError as e:
-        print(f"Error importing sample data: {e}")
-        return    
-    db = DatabaseManager()
-    if db.connect():
-        db.create_tables()
-        
-        for route in busRoutes:
-            success = db.insert_route(route)
-            if success:
-                print(f"Successfully migrated route {route['id']}")
-            else:
-                print(f"Failed to migrate route {route['id']}")
-        
+        if path:
+            with open(path, encoding='utf-8') as stream:
+                counts = importer.run(read_routes(stream, path))
+        else:
+            from data.routes import busRoutes
+            counts = importer.run(busRoutes)
+    finally:
         db.disconnect()
 
+    for error in counts['errors']:
+        print(f"  {error}")
+    print(f"Import finished in {counts['seconds']}s: {counts['skipped']} skipped, "
+          f"{counts['failed_batches']} failed batches")
+    return counts
+
 if __name__ == "__main__":
-    # Test database connection and create tables
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the Sri Lanka Bus App database schema")
+    subparsers = parser.add_subparsers(dest='command')
+    migrate_parser = subparsers.add_parser('migrate', help='apply pending schema migrations (default)')
+    migrate_parser.add_argument('--to', type=int, dest='target', help='stop at this schema version')
+    subparsers.add_parser('status', help='show applied and pending migrations')
+    shapes_parser = subparsers.add_parser('shapes', help='encode and simplify route shapes')
+    shapes_parser.add_argument('--rebuild', action='store_true', help='rebuild shapes for every route')
+    import_parser = subparsers.add_parser('import', help='bulk import routes (default: data/routes.py)')
+    import_parser.add_argument('file', nargs='?', help='JSON array or JSON Lines file of route definitions')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        counts = migrate_sample_data(args.file)
+        sys.exit(0 if counts and not counts['failed_batches'] else 1)
+
     db = DatabaseManager()
-    if db.connect():
-        print("Database connection successful!")
-        db.create_tables()
-        db.disconnect()
-    else:
+    if not db.connect():
         print("Failed to connect to database")
-
+        sys.exit(1)
+
+    print("Database connection successful!")
+    if args.command == 'status':
+        version = db.get_schema_version()
+        print(f"Schema version: {version} (latest: {migrations.LATEST_VERSION})")
+        for number, description, _ in migrations.pending_migrations(version or 0):
+            print(f"  pending {number}: {description}")
+        ok = version is not None
+    elif args.command == 'shapes':
+        db.build_route_shapes(rebuild=args.rebuild)
+        ok = True
+    else:
+        ok = db.migrate(getattr(args, 'target', None))
+    db.disconnect()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,17 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def stop_position(stop):
+    """(lat, lng) of a stop row from the database or an entry in data/routes.py"""
+    if 'latitude' in stop:
+        return float(stop['latitude']), float(stop['longitude'])
+    return float(stop['lat']), float(stop['lng'])
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(h))
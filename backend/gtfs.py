@@ -0,0 +1,481 @@
+"""GTFS feed export and import for the route network.
+
+export_feed() streams the catalog out as a GTFS zip, one table pass per
+file, and read_feed() turns a GTFS zip back into route definitions for
+CatalogImporter. Neither holds a whole table in memory.
+"""
+import csv
+import io
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+import zipfile
+from datetime import date, timedelta
+
+from catalog_import import ROUTE_TYPES
+from storage import StorageError
+
+# Agency every exported route belongs to; set these for a published feed
+AGENCY_ID = os.getenv('GTFS_AGENCY_ID', 'SLBUS')
+AGENCY_NAME = os.getenv('GTFS_AGENCY_NAME', 'Sri Lanka Bus App')
+AGENCY_URL = os.getenv('GTFS_AGENCY_URL', 'http://localhost:5173')
+AGENCY_TIMEZONE = os.getenv('GTFS_AGENCY_TIMEZONE', 'Asia/Colombo')
+CURRENCY = os.getenv('GTFS_CURRENCY', 'LKR')
+
+# Hours the routes run at their frequency, and how long the exported calendar lasts
+SERVICE_START = os.getenv('GTFS_SERVICE_START', '05:00:00')
+SERVICE_END = os.getenv('GTFS_SERVICE_END', '22:00:00')
+SERVICE_DAYS = int(os.getenv('GTFS_SERVICE_DAYS', 365))
+SERVICE_ID = 'daily'
+
+# GTFS route_type of every route (bus)
+BUS_ROUTE_TYPE = 3
+
+# Rows read from storage per fetch and written per zip chunk
+EXPORT_BATCH_SIZE = int(os.getenv('GTFS_EXPORT_BATCH_SIZE', 5000))
+
+# Directory and page cache size (KiB) of the SQLite file a feed is staged in on import
+STAGING_DIR = os.getenv('GTFS_STAGING_DIR') or None
+STAGING_CACHE_KB = int(os.getenv('GTFS_STAGING_CACHE_KB', 65536))
+
+# Minutes between buses assumed when a feed gives no frequencies and a single trip
+DEFAULT_FREQUENCY = 60
+
+REQUIRED_FILES = ('stops.txt', 'routes.txt', 'trips.txt', 'stop_times.txt')
+
+# Non-standard routes.txt columns keeping what GTFS has no field for; other consumers ignore them
+ROUTE_COLUMNS = ('route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type',
+                 'route_origin', 'route_destination', 'route_class')
+
+
+def _seconds(value):
+    """Seconds since midnight of a GTFS HH:MM:SS time (hours may pass 24), None if blank"""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    except ValueError:
+        raise ValueError(f"time {value!r} is not HH:MM:SS") from None
+
+
+def _time(seconds):
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def _decimal(value, places=8):
+    return f'{float(value):.{places}f}'.rstrip('0').rstrip('.')
+
+
+class _ChunkSink:
+    """Write-only file object without seek() whose bytes are taken out chunk by chunk.
+
+    ZipFile writes to it in streaming mode, with a data descriptor after
+    each member instead of seeking back to patch the header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _write_member(feed, sink, name, header, rows, batch_size):
+    """Write one CSV member, yielding the zip bytes produced every batch_size rows"""
+    with feed.open(name, 'w', force_zip64=True) as member:
+        with io.TextIOWrapper(member, encoding='utf-8', newline='') as text:
+            writer = csv.writer(text)
+            writer.writerow(header)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                text.flush()
+                chunk = sink.take()
+                if chunk:
+                    yield chunk
+
+
+def export_feed(db, batch_size=None):
+    """Yield a GTFS zip of the route catalog in chunks.
+
+    Stops, stop lists and shape points are streamed from storage with
+    iter_catalog_rows() and compressed as they arrive, so memory holds one
+    batch plus a small summary per route. Each route becomes one trip run
+    every `frequency` minutes between SERVICE_START and SERVICE_END; its
+    first and last stops are timed from the route duration and the stops in
+    between are left untimed. Raises StorageError if a table cannot be read.
+    """
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    start = _seconds(SERVICE_START)
+    first_day = date.today()
+    last_day = first_day + timedelta(days=SERVICE_DAYS)
+    # route id -> (fare, duration, frequency, destination), and the routes with a shape
+    summaries = {}
+    shaped = set()
+
+    def shape_rows():
+        for point in db.iter_catalog_rows('route_coordinates', batch_size):
+            shaped.add(point['route_id'])
+            yield (point['route_id'], _decimal(point['latitude']), _decimal(point['longitude']),
+                   point['sequence_order'])
+
+    def route_rows():
+        for route in db.iter_catalog_rows('routes', batch_size):
+            # A missing duration times the last stop like the first, as an untimed route imports back;
+            # a missing frequency leaves the route out of frequencies.txt (a single trip)
+            summaries[route['id']] = (route['fare'] or 0, route['duration'] or 0, route['frequency'] or 0,
+                                      route['destination'])
+            yield (route['id'], AGENCY_ID, route['id'], route['name'], BUS_ROUTE_TYPE,
+                   route['origin'], route['destination'], route['type'] or 'regular')
+
+    def stop_time_rows():
+        calls_by_route = itertools.groupby(db.iter_catalog_rows('route_stops', batch_size),
+                                           key=lambda call: call['route_id'])
+        for route_id, calls in calls_by_route:
+            calls = list(calls)
+            if route_id not in summaries:
+                # Route added after routes.txt was written
+                continue
+            end = _time(start + int(summaries[route_id][1]) * 60)
+            for index, call in enumerate(calls):
+                if index == 0:
+                    times = (_time(start), _time(start), 1)
+                elif index == len(calls) - 1:
+                    times = (end, end, 1)
+                else:
+                    times = ('', '', 0)
+                yield route_id, times[0], times[1], call['stop_id'], call['stop_order'], times[2]
+
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as feed:
+        members = (
+            ('agency.txt', ('agency_id', 'agency_name', 'agency_url', 'agency_timezone'),
+             lambda: iter([(AGENCY_ID, AGENCY_NAME, AGENCY_URL, AGENCY_TIMEZONE)])),
+            ('calendar.txt', ('service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                              'saturday', 'sunday', 'start_date', 'end_date'),
+             lambda: iter([(SERVICE_ID, 1, 1, 1, 1, 1, 1, 1,
+                            first_day.strftime('%Y%m%d'), last_day.strftime('%Y%m%d'))])),
+            ('stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'),
+             lambda: ((stop['id'], stop['name'], _decimal(stop['latitude']), _decimal(stop['longitude']))
+                      for stop in db.iter_catalog_rows('stops', batch_size))),
+            # Shapes go before trips.txt so trips only reference shapes that exist
+            ('shapes.txt', ('shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'), shape_rows),
+            ('routes.txt', ROUTE_COLUMNS, route_rows),
+            ('fare_attributes.txt', ('fare_id', 'price', 'currency_type', 'payment_method', 'transfers',
+                                     'agency_id'),
+             lambda: ((route_id, _decimal(fare, 2), CURRENCY, 0, 0, AGENCY_ID)
+                      for route_id, (fare, *_) in summaries.items())),
+            ('fare_rules.txt', ('fare_id', 'route_id'),
+             lambda: ((route_id, route_id) for route_id in summaries)),
+            ('trips.txt', ('route_id', 'service_id', 'trip_id', 'trip_headsign', 'shape_id'),
+             lambda: ((route_id, SERVICE_ID, route_id, destination, route_id if route_id in shaped else '')
+                      for route_id, (_, _, _, destination) in summaries.items())),
+            ('frequencies.txt', ('trip_id', 'start_time', 'end_time', 'headway_secs', 'exact_times'),
+             lambda: ((route_id, SERVICE_START, SERVICE_END, int(frequency) * 60, 0)
+                      for route_id, (_, _, frequency, _) in summaries.items() if int(frequency) > 0)),
+            ('stop_times.txt', ('trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence',
+                                'timepoint'), stop_time_rows),
+        )
+        for name, header, rows in members:
+            yield from _write_member(feed, sink, name, header, rows(), batch_size)
+    yield sink.take()
+
+
+# Staging tables; stop_times and shapes are indexed only after they are loaded
+STAGING_SCHEMA = """
+    PRAGMA journal_mode = OFF;
+    PRAGMA synchronous = OFF;
+    PRAGMA temp_store = FILE;
+    CREATE TABLE stops (stop_id TEXT PRIMARY KEY, name TEXT, lat REAL, lng REAL);
+    CREATE TABLE routes (route_id TEXT PRIMARY KEY, name TEXT, origin TEXT, destination TEXT, class TEXT);
+    CREATE TABLE trips (trip_id TEXT PRIMARY KEY, route_id TEXT NOT NULL, shape_id TEXT);
+    CREATE TABLE stop_times (trip_id TEXT, stop_sequence INTEGER, stop_id TEXT, arrival INTEGER, departure INTEGER);
+    CREATE TABLE frequencies (trip_id TEXT, headway INTEGER);
+    CREATE TABLE shapes (shape_id TEXT, sequence INTEGER, lat REAL, lng REAL);
+    CREATE TABLE fare_attributes (fare_id TEXT PRIMARY KEY, price REAL);
+    CREATE TABLE fare_rules (fare_id TEXT, route_id TEXT);
+"""
+
+STAGING_INDEXES = """
+    CREATE INDEX stop_times_trip ON stop_times (trip_id, stop_sequence);
+    CREATE INDEX trips_route ON trips (route_id);
+    CREATE INDEX shapes_shape ON shapes (shape_id, sequence);
+    CREATE INDEX frequencies_trip ON frequencies (trip_id);
+    CREATE INDEX fare_rules_route ON fare_rules (route_id);
+    CREATE TABLE trip_stats (trip_id TEXT PRIMARY KEY, calls INTEGER, first_departure INTEGER,
+                             last_arrival INTEGER);
+    INSERT INTO trip_stats
+    SELECT trip_id, COUNT(*), MIN(COALESCE(departure, arrival)), MAX(COALESCE(arrival, departure))
+    FROM stop_times GROUP BY trip_id;
+"""
+
+# (file, staging table, feed columns, how many leading columns the file must have)
+STAGED_FILES = (
+    ('stops.txt', 'stops', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'), 1),
+    ('routes.txt', 'routes', ('route_id', 'route_long_name', 'route_short_name', 'route_origin',
+                              'route_destination', 'route_class'), 1),
+    ('trips.txt', 'trips', ('trip_id', 'route_id', 'shape_id'), 2),
+    ('stop_times.txt', 'stop_times', ('trip_id', 'stop_sequence', 'stop_id', 'arrival_time',
+                                      'departure_time'), 3),
+    ('frequencies.txt', 'frequencies', ('trip_id', 'headway_secs'), 2),
+    ('shapes.txt', 'shapes', ('shape_id', 'shape_pt_sequence', 'shape_pt_lat', 'shape_pt_lon'), 4),
+    ('fare_attributes.txt', 'fare_attributes', ('fare_id', 'price'), 2),
+    ('fare_rules.txt', 'fare_rules', ('fare_id', 'route_id'), 2),
+)
+
+
+def _number(value, convert=float):
+    value = value.strip()
+    return convert(value) if value else None
+
+
+def _required_number(value, column, convert=float):
+    if not value:
+        raise ValueError(f"{column} is blank")
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError(f"{column} {value!r} is not a number") from None
+
+
+def _staged_values(table, row):
+    """Staging table values for the feed columns of one CSV row"""
+    if table == 'stops':
+        stop_id, name, lat, lng = row
+        return stop_id, name or stop_id, _number(lat), _number(lng)
+    if table == 'routes':
+        route_id, long_name, short_name, origin, destination, route_class = row
+        return route_id, long_name or short_name or route_id, origin, destination, route_class
+    if table == 'stop_times':
+        trip_id, sequence, stop_id, arrival, departure = row
+        return (trip_id, _required_number(sequence, 'stop_sequence', int), stop_id,
+                _seconds(arrival), _seconds(departure))
+    if table == 'frequencies':
+        return row[0], _number(row[1], int)
+    if table == 'shapes':
+        shape_id, sequence, lat, lng = row
+        return (shape_id, _required_number(sequence, 'shape_pt_sequence', int),
+                _required_number(lat, 'shape_pt_lat'), _required_number(lng, 'shape_pt_lon'))
+    if table == 'fare_attributes':
+        return row[0], _number(row[1])
+    return row
+
+
+def _staged_rows(table, rows):
+    """Staging values of every row, naming the data row (counted from 1) a bad value is in"""
+    for number, row in enumerate(rows, 1):
+        try:
+            yield _staged_values(table, row)
+        except ValueError as e:
+            raise ValueError(f"row {number}: {e}") from None
+
+
+def _read_member(feed, name, columns, required):
+    """Rows of a feed file as tuples of columns ('' where an optional column is absent)"""
+    with feed.open(name) as member:
+        reader = csv.reader(io.TextIOWrapper(member, encoding='utf-8-sig', newline=''))
+        header = [column.strip() for column in next(reader, [])]
+        if not header:
+            return
+        missing = [column for column in columns[:required] if column not in header]
+        if missing:
+            raise ValueError(f"{name} has no {', '.join(missing)} column")
+        positions = [header.index(column) if column in header else None for column in columns]
+        for row in reader:
+            if not row:
+                continue
+            yield tuple(row[position].strip() if position is not None and position < len(row) else ''
+                        for position in positions)
+
+
+def _stage(staging, feed):
+    names = set(feed.namelist())
+    staging.executescript(STAGING_SCHEMA)
+    staging.execute(f"PRAGMA cache_size = {-STAGING_CACHE_KB}")
+    for name, table, columns, required in STAGED_FILES:
+        if name not in names:
+            continue
+        width = len(staging.execute(f"PRAGMA table_info({table})").fetchall())
+        placeholders = ', '.join('?' * width)
+        staging.execute("BEGIN")
+        try:
+            # executemany() pulls rows from the generator one at a time
+            staging.executemany(
+                f"INSERT OR IGNORE INTO {table} VALUES ({placeholders})",
+                _staged_rows(table, _read_member(feed, name, columns, required))
+            )
+        except (csv.Error, ValueError) as e:
+            staging.execute("ROLLBACK")
+            raise ValueError(f"{name}: {e}") from None
+        staging.execute("COMMIT")
+    staging.executescript(STAGING_INDEXES)
+
+
+def _staged_routes(staging):
+    """Route definitions built from the most complete trip of every staged route"""
+    routes = staging.execute("SELECT route_id, name, origin, destination, class FROM routes ORDER BY route_id")
+    for route_id, name, origin, destination, route_class in routes:
+        trip = staging.execute("""
+            SELECT t.trip_id, t.shape_id, s.first_departure, s.last_arrival
+            FROM trips t JOIN trip_stats s ON s.trip_id = t.trip_id
+            WHERE t.route_id = ?
+            ORDER BY s.calls DESC, t.trip_id LIMIT 1
+        """, (route_id,)).fetchone()
+        if trip is None:
+            continue
+        trip_id, shape_id, first_departure, last_arrival = trip
+
+        stops, seen = [], set()
+        calls = staging.execute("""
+            SELECT st.stop_id, s.name, s.lat, s.lng
+            FROM stop_times st JOIN stops s ON s.stop_id = st.stop_id
+            WHERE st.trip_id = ? AND s.lat IS NOT NULL AND s.lng IS NOT NULL
+            ORDER BY st.stop_sequence
+        """, (trip_id,))
+        for stop_id, stop_name, lat, lng in calls:
+            # A route lists each stop once; loops revisit their first stop
+            if stop_id in seen:
+                continue
+            seen.add(stop_id)
+            stops.append({'id': stop_id, 'name': stop_name, 'lat': lat, 'lng': lng, 'order': len(stops) + 1})
+        if not stops:
+            continue
+
+        duration = 0
+        if first_departure is not None and last_arrival is not None:
+            duration = round((last_arrival - first_departure) / 60)
+
+        headway = staging.execute("""
+            SELECT MIN(headway) FROM frequencies
+            WHERE headway > 0 AND trip_id IN (SELECT trip_id FROM trips WHERE route_id = ?)
+        """, (route_id,)).fetchone()[0]
+        if headway:
+            frequency = round(headway / 60)
+        else:
+            # Spread of first departures over the trips run during the day
+            trips, earliest, latest = staging.execute("""
+                SELECT COUNT(*), MIN(s.first_departure), MAX(s.first_departure)
+                FROM trips t JOIN trip_stats s ON s.trip_id = t.trip_id WHERE t.route_id = ?
+            """, (route_id,)).fetchone()
+            frequency = DEFAULT_FREQUENCY
+            if trips > 1 and earliest is not None and latest > earliest:
+                frequency = round((latest - earliest) / (trips - 1) / 60)
+
+        fare = staging.execute("""
+            SELECT MIN(a.price) FROM fare_rules r JOIN fare_attributes a ON a.fare_id = r.fare_id
+            WHERE r.route_id = ?
+        """, (route_id,)).fetchone()[0]
+
+        coordinates = [list(point) for point in staging.execute(
+            "SELECT lat, lng FROM shapes WHERE shape_id = ? ORDER BY sequence", (shape_id,)
+        )] if shape_id else []
+
+        yield {
+            'id': route_id,
+            'name': name,
+            'origin': origin or stops[0]['name'],
+            'destination': destination or stops[-1]['name'],
+            'fare': round(fare or 0, 2),
+            'duration': duration,
+            'frequency': max(frequency, 1),
+            'type': route_class if route_class in ROUTE_TYPES else 'regular',
+            'stops': stops,
+            'coordinates': coordinates
+        }
+
+
+def read_feed(source):
+    """Route definitions from a GTFS zip (a path or binary file), for CatalogImporter.run().
+
+    The feed is first loaded into a temporary SQLite file, so stop_times.txt
+    and shapes.txt are sorted and grouped on disk and only one route is held
+    in memory at a time. Each route takes the stops and shape of its trip
+    with the most stops, its duration from that trip's times, its frequency
+    from frequencies.txt or the spacing of its trips, and its fare from
+    fare_rules.txt. Raises ValueError for a zip that is not a usable feed.
+    """
+    try:
+        feed = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"not a GTFS zip: {e}") from None
+
+    with feed:
+        missing = [name for name in REQUIRED_FILES if name not in feed.namelist()]
+        if missing:
+            raise ValueError(f"GTFS feed has no {', '.join(missing)}")
+
+        handle, path = tempfile.mkstemp(prefix='gtfs-', suffix='.db', dir=STAGING_DIR)
+        os.close(handle)
+        staging = sqlite3.connect(path, isolation_level=None)
+        try:
+            _stage(staging, feed)
+            yield from _staged_routes(staging)
+        finally:
+            staging.close()
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from catalog_import import CatalogImporter
+    from database import print_import_progress
+    from storage import create_database
+
+    parser = argparse.ArgumentParser(description="Export or import the route catalog as a GTFS feed")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write the catalog to a GTFS zip')
+    export_parser.add_argument('file', help='zip file to write')
+    import_parser = subparsers.add_parser('import', help='load the routes of a GTFS zip')
+    import_parser.add_argument('file', help='GTFS zip to read')
+    args = parser.parse_args()
+
+    db = create_database()
+    if args.command == 'import':
+        # Loading a read-only edge database is what the command is for
+        db.read_only = False
+    if not db.connect():
+        print("Failed to connect to storage")
+        sys.exit(1)
+
+    try:
+        if args.command == 'export':
+            with open(args.file, 'wb') as output:
+                for chunk in export_feed(db):
+                    output.write(chunk)
+            print(f"Wrote {args.file}")
+            sys.exit(0)
+
+        db.ensure_schema(auto_migrate=True)
+        counts = CatalogImporter(db, progress=print_import_progress).run(read_feed(args.file))
+    except (StorageError, ValueError, OSError, sqlite3.Error) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        db.disconnect()
+
+    for error in counts['errors']:
+        print(f"  {error}")
+    print(f"Import finished in {counts['seconds']}s: {counts['skipped']} skipped, "
+          f"{counts['failed_batches']} failed batches")
+    sys.exit(0 if not counts['failed_batches'] else 1)
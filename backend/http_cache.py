@@ -0,0 +1,49 @@
+import functools
+import os
+
+from flask import Response, make_response, request
+
+# Seconds clients and CDNs may reuse a catalog response before revalidating it
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', 60))
+
+
+def catalog_etag(version):
+    """Weak ETag for a catalog version; weak because gzip, brotli and identity bodies share it"""
+    etag = f"v{version['version']}"
+    if version.get('patch'):
+        etag += f"-{version['patch']}"
+    return etag
+
+
+def conditional(current_version):
+    """Serve a view with catalog validators and answer revalidations with 304 before the view runs.
+
+    current_version() returns the catalog version (Storage.get_catalog_version)
+    or None when it cannot be read, in which case the view is served without
+    validators. There is no Last-Modified: a change version has no time that
+    clients and the database agree on.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version = current_version()
+            if version is None:
+                return view(*args, **kwargs)
+
+            etag = catalog_etag(version)
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.cache_control.public = True
+            response.cache_control.max_age = CATALOG_MAX_AGE
+            return response
+
+        return wrapper
+
+    return decorator
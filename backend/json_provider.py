@@ -0,0 +1,69 @@
+import json
+import os
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 'orjson' (the default when installed) or 'stdlib'
+SERIALIZER = os.getenv('JSON_SERIALIZER', 'orjson' if orjson else 'stdlib')
+if SERIALIZER == 'orjson' and orjson is None:
+    print("JSON_SERIALIZER=orjson but orjson is not installed, using the standard library")
+    SERIALIZER = 'stdlib'
+
+
+def _default(value):
+    """Values neither serializer handles natively: DECIMAL columns and stdlib-only date types"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if SERIALIZER == 'orjson':
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+
+    def dumps(obj):
+        return dumps_bytes(obj).decode('utf-8')
+
+    loads = orjson.loads
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode('utf-8')
+
+    loads = json.loads
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson when available.
+
+    Both backends write datetimes as ISO 8601 and DECIMAL values as numbers,
+    so responses are the same whichever one is in use. Keys keep insertion
+    order instead of being sorted.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
@@ -0,0 +1,281 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+
+import json_provider
+
+
+class Subscription:
+    """One streaming client; holds at most one pending update per bus"""
+
+    def __init__(self, route_id=None):
+        self.route_id = route_id
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def offer(self, delta):
+        # A newer update for the same bus replaces the one not yet sent
+        with self._lock:
+            self._pending[delta['id']] = delta
+        self._ready.set()
+
+    def wait(self, timeout):
+        return self._ready.wait(timeout)
+
+    def drain(self):
+        with self._lock:
+            deltas = list(self._pending.values())
+            self._pending.clear()
+            self._ready.clear()
+        return deltas
+
+
+class AsyncSubscription(Subscription):
+    """Subscription consumed on an event loop; offers from other threads wake it through the loop"""
+
+    def __init__(self, loop, route_id=None):
+        super().__init__(route_id)
+        self._loop = loop
+        self._async_ready = asyncio.Event()
+
+    def offer(self, delta):
+        super().offer(delta)
+        try:
+            self._loop.call_soon_threadsafe(self._async_ready.set)
+        except RuntimeError:
+            # The loop already shut down; nobody is waiting any more
+            pass
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self._async_ready.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def drain(self):
+        self._async_ready.clear()
+        return super().drain()
+
+
+# Frames shared by the WSGI and ASGI streams
+RETRY_FRAME = 'retry: 5000\n\n'
+FULL_FRAME = RETRY_FRAME + 'event: error\ndata: "Too many live stream clients, retry later"\n\n'
+HEARTBEAT_FRAME = ': heartbeat\n\n'
+
+
+def snapshot_frame(initial):
+    return f'event: snapshot\ndata: {json_provider.dumps(initial)}\n\n'
+
+
+def positions_frame(deltas):
+    return f'event: positions\ndata: {json_provider.dumps(deltas)}\n\n'
+
+
+class LiveUpdateHub:
+    """Fans bus position updates out to Server-Sent Events subscribers.
+
+    Pings ingested by this process are published directly. Pings taken by
+    other worker processes are picked up by one background poll of
+    bus_locations per process, instead of one poll per client. The poll
+    follows the insertion sequence, so pings the write-behind buffer flushes
+    late are still seen, and skips pings already published for their bus.
+    """
+
+    # Pings read per query while catching up with the insertion sequence
+    POLL_BATCH_SIZE = 1000
+
+    def __init__(self, db, heartbeat=None, poll_interval=None, max_subscribers=None):
+        self.db = db
+        self.heartbeat = heartbeat or float(os.getenv('LIVE_STREAM_HEARTBEAT', 15))
+        self.poll_interval = poll_interval if poll_interval is not None else float(os.getenv('LIVE_STREAM_POLL_INTERVAL', 2))
+        self.max_subscribers = max_subscribers or int(os.getenv('LIVE_STREAM_MAX_SUBSCRIBERS', 5000))
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._bus_routes = {}
+        self._bus_routes_loaded = 0.0
+        # bus id -> timestamp (to the second, as stored) of the newest ping published
+        self._last = {}
+        self._thread = None
+        self._stopping = False
+        self.published = 0
+
+    def start(self):
+        """Start polling for updates written by other processes"""
+        if self.poll_interval > 0 and (self._thread is None or not self._thread.is_alive()):
+            self._stopping = False
+            self._thread = threading.Thread(target=self._poll, name='live-updates', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(self.poll_interval + 5)
+
+    def subscribe(self, route_id=None, loop=None):
+        """Register a client, or return None if the process is at its subscriber limit.
+
+        Pass the event loop for a client served by an async generator.
+        """
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = AsyncSubscription(loop, route_id) if loop else Subscription(route_id)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def is_full(self):
+        return len(self._subscribers) >= self.max_subscribers
+
+    def _route_for(self, bus_id):
+        route_id = self._bus_routes.get(bus_id)
+        # Reload the bus -> route map for unknown buses, at most every 30 seconds
+        if route_id is None and time.monotonic() - self._bus_routes_loaded > 30:
+            self._bus_routes_loaded = time.monotonic()
+            self._bus_routes.update(self.db.get_bus_routes())
+            route_id = self._bus_routes.get(bus_id)
+        return route_id
+
+    def _is_known(self, bus_id):
+        self._route_for(bus_id)
+        return bus_id in self._bus_routes
+
+    @staticmethod
+    def _stamp(timestamp):
+        # TIMESTAMP columns keep whole seconds, so compare pings at that resolution
+        return timestamp.replace(microsecond=0) if isinstance(timestamp, datetime) else timestamp
+
+    def publish(self, locations):
+        """Deliver location rows to every subscriber watching their route.
+
+        Pings published here have not been stored yet, so pings for buses
+        that are not in the bus -> route map are skipped; storage would drop
+        them. A bus added since the last reload shows up through the poll.
+        """
+        known = [location for location in locations if self._is_known(location['bus_id'])]
+        self._deliver(self._newest(known, resend=True))
+
+    def _newest(self, locations, resend=False):
+        """Drop pings older than the last one published for their bus.
+
+        Pings ingested here come back through the poll once they are stored;
+        resend lets a direct publish repeat the same second, the poll never does.
+        """
+        fresh = []
+        for location in locations:
+            stamp = self._stamp(location['timestamp'])
+            last = self._last.get(location['bus_id'])
+            if last is None or stamp > last or (resend and stamp == last):
+                self._last[location['bus_id']] = stamp
+                fresh.append(location)
+        return fresh
+
+    def _deliver(self, locations):
+        if not self._subscribers:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for location in locations:
+            route_id = location.get('route_id') or self._route_for(location['bus_id'])
+            delta = self._delta(location, route_id)
+            for subscription in subscribers:
+                if subscription.route_id is None or subscription.route_id == route_id:
+                    subscription.offer(delta)
+            self.published += 1
+
+    @staticmethod
+    def _delta(location, route_id):
+        timestamp = location.get('timestamp')
+        return {
+            'id': location['bus_id'],
+            'routeId': route_id,
+            'position': [float(location['latitude']), float(location['longitude'])],
+            'currentStopId': location.get('current_stop_id'),
+            'nextStopId': location.get('next_stop_id'),
+            'occupiedSeats': location.get('occupied_seats'),
+            'delay': {
+                'minutes': location.get('delay_minutes'),
+                'reason': location.get('delay_reason')
+            },
+            'lastUpdated': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp
+        }
+
+    def stream(self, route_id=None, initial=None):
+        """Generator of SSE frames for one subscriber; ends when the client disconnects.
+
+        The client is only registered once the response starts, so a request
+        that fails or disconnects before then leaves nothing behind.
+        """
+        subscription = self.subscribe(route_id)
+        if subscription is None:
+            yield FULL_FRAME
+            return
+        try:
+            yield RETRY_FRAME
+            if initial is not None:
+                yield snapshot_frame(initial)
+            while True:
+                if subscription.wait(self.heartbeat):
+                    deltas = subscription.drain()
+                    if deltas:
+                        yield positions_frame(deltas)
+                else:
+                    yield HEARTBEAT_FRAME
+        finally:
+            self.unsubscribe(subscription)
+
+    async def astream(self, route_id=None, initial=None):
+        """Async generator of the same frames, for a client served on the event loop"""
+        subscription = self.subscribe(route_id, loop=asyncio.get_running_loop())
+        if subscription is None:
+            yield FULL_FRAME
+            return
+        try:
+            yield RETRY_FRAME
+            if initial is not None:
+                yield snapshot_frame(initial)
+            while True:
+                if await subscription.wait_async(self.heartbeat):
+                    deltas = subscription.drain()
+                    if deltas:
+                        yield positions_frame(deltas)
+                else:
+                    yield HEARTBEAT_FRAME
+        finally:
+            self.unsubscribe(subscription)
+
+    def _poll(self):
+        sequence = None
+        while not self._stopping:
+            time.sleep(self.poll_interval)
+            if not self._subscribers:
+                # Nobody to deliver to; resume from the newest ping once someone subscribes
+                sequence = None
+                continue
+
+            try:
+                sequence = self._poll_once(sequence)
+            except Exception as e:
+                print(f"Error polling live updates: {e}")
+
+    def _poll_once(self, sequence):
+        """Publish pings stored after sequence that are newer than what their bus last sent"""
+        while True:
+            start = sequence
+            sequence, rows = self.db.get_locations_after(sequence, self.POLL_BATCH_SIZE)
+            for row in rows:
+                self._bus_routes[row['bus_id']] = row['route_id']
+            self._deliver(self._newest(rows))
+            if start is None or len(rows) < self.POLL_BATCH_SIZE:
+                return sequence
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import deque
+
+
+class LocationWriteBuffer:
+    """Write-behind queue for GPS pings.
+
+    Requests only append to an in-memory queue; a background thread writes
+    the queue to bus_locations with one multi-row insert whenever it holds
+    max_batch pings or flush_interval seconds have passed. Pings still
+    queued when the process exits are flushed by stop().
+    """
+
+    def __init__(self, db, max_batch=None, flush_interval=None, max_queue=None):
+        self.db = db
+        self.max_batch = max_batch or int(os.getenv('LOCATION_BUFFER_BATCH_SIZE', 500))
+        self.flush_interval = flush_interval or float(os.getenv('LOCATION_BUFFER_FLUSH_INTERVAL', 1.0))
+        # Pings beyond this are rejected so a database outage cannot exhaust memory
+        self.max_queue = max_queue or int(os.getenv('LOCATION_BUFFER_MAX_QUEUE', 50000))
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='location-buffer', daemon=True)
+            self._thread.start()
+
+    def submit(self, rows):
+        """Queue location rows; returns how many were accepted"""
+        with self._lock:
+            room = max(self.max_queue - len(self._queue), 0)
+            accepted = rows[:room]
+            self._queue.extend(accepted)
+            depth = len(self._queue)
+        self.accepted += len(accepted)
+        self.rejected += len(rows) - len(accepted)
+        if depth >= self.max_batch:
+            self._wakeup.set()
+        return len(accepted)
+
+    def depth(self):
+        return len(self._queue)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # flush() put the failed batch back; keep the thread alive for the next attempt
+                print(f"Error flushing location buffer: {e}")
+
+    def _take(self):
+        with self._lock:
+            count = min(self.max_batch, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _requeue(self, rows):
+        with self._lock:
+            room = max(self.max_queue - len(self._queue), 0)
+            self._queue.extendleft(reversed(rows[:room]))
+        self.rejected += len(rows) - min(len(rows), room)
+
+    def flush(self):
+        """Write everything queued so far in batches of max_batch; returns rows written"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                rows = self._take()
+                if not rows:
+                    break
+
+                started = time.perf_counter()
+                try:
+                    ok = self.db.insert_bus_locations(rows)
+                except Exception:
+                    self.failures += 1
+                    self._requeue(rows)
+                    raise
+                elapsed = (time.perf_counter() - started) * 1000
+
+                if not ok:
+                    # Keep the pings for the next attempt rather than losing them
+                    self.failures += 1
+                    self._requeue(rows)
+                    break
+
+                written += len(rows)
+                self.flushed += len(rows)
+                self.batches += 1
+                self.last_flush_ms = elapsed
+                self.max_flush_ms = max(self.max_flush_ms, elapsed)
+                self.total_flush_ms += elapsed
+        return written
+
+    def stop(self):
+        """Stop the flush thread and write out whatever is still queued"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error flushing location buffer on shutdown: {e}")
+
+    def stats(self):
+        """Queue depth and flush metrics"""
+        return {
+            'queue_depth': self.depth(),
+            'max_queue': self.max_queue,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'avg_flush_ms': round(self.total_flush_ms / self.batches, 2) if self.batches else None
+        }
@@ -0,0 +1,654 @@
+import bisect
+import itertools
+import os
+import threading
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import catalog_changes
+from spatial_index import StopSpatialIndex
+from storage import CATALOG_TABLES, Storage, StorageError, copy_catalog, create_database
+
+
+class MemoryPool:
+    """Stands in for a connection pool; there are no connections to manage"""
+
+    def stats(self):
+        return {'size': 0, 'open': 0, 'idle': 0, 'in_use': 0}
+
+    def close(self):
+        pass
+
+
+class MemoryDatabaseManager(Storage):
+    """Storage backend keeping every table in indexed dicts inside the process.
+
+    Reads are dict lookups with no I/O, which suits read-only edge nodes: with
+    STORAGE_READ_ONLY=true the catalog is loaded once at connect() from
+    MEMORY_SEED and writes are refused. MEMORY_SEED is 'sample' (data/routes.py,
+    the default), 'mysql' or 'sqlite' to copy from that backend, the path of a
+    SQLite file, the path of a JSON or JSON Lines route file, or 'none'. Only
+    the latest position of each bus is kept, not the ping history.
+    """
+
+    backend = 'memory'
+
+    # Column order of the routes and stops rows passed to write_catalog_rows
+    ROUTE_COLUMNS = ('id', 'name', 'origin', 'destination', 'fare', 'duration', 'frequency', 'type')
+    STOP_COLUMNS = ('id', 'name', 'latitude', 'longitude')
+
+    def __init__(self, read_only=None, seed=None):
+        super().__init__(read_only)
+        self.seed = seed or os.getenv('MEMORY_SEED', 'sample')
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+
+        self.routes = {}
+        self.stops = {}
+        # route id -> [(stop_order, stop id)] in order, and route id -> {stop id: stop_order}
+        self.route_stops = {}
+        self.stop_orders = {}
+        # stop id -> route ids calling there
+        self.stop_routes = {}
+        self.coordinates = {}
+        self.shapes = {}
+        # (stop id, alias) -> alias row
+        self.aliases = {}
+        self.buses = {}
+        # route id -> bus ids
+        self.route_buses = {}
+        # bus id -> latest location row
+        self.current = {}
+        # bus id -> sequence number of the write that set its current location
+        self.current_sequence = {}
+        self.location_sequence = 0
+        # stop id -> {bus id: arrival row}
+        self.arrivals = {}
+        # user id -> {(route id, origin stop id, destination stop id): favorite row}
+        self.favorites = {}
+        # (entity, entity id) -> change row, and the last catalog version handed out
+        self.changes = {}
+        self.catalog_version = 0
+
+        # Rebuilt on the first read after the stops change
+        self._names = None
+        self._spatial = None
+        # Sorted route ids for keyset pages, rebuilt after routes are added
+        self._route_ids = None
+
+    def connect(self):
+        """Load MEMORY_SEED the first time; there is nothing to connect to"""
+        if self.pool:
+            return True
+        self.pool = MemoryPool()
+
+        # The seed is loaded even when the node refuses writes from the API
+        read_only, self.read_only = self.read_only, False
+        try:
+            self._load_seed()
+            return True
+        except (StorageError, OSError, ValueError) as e:
+            print(f"Error loading in-memory storage from {self.seed}: {e}")
+            self.pool = None
+            return False
+        finally:
+            self.read_only = read_only
+
+    def _load_seed(self):
+        from catalog_import import CatalogImporter, read_routes
+
+        seed = self.seed
+        if seed.lower() == 'none':
+            return
+        if seed.lower() == 'sample':
+            from data.routes import busRoutes
+            counts = CatalogImporter(self).run(busRoutes)
+        elif seed.lower() in ('mysql', 'sqlite') or seed.endswith(('.db', '.sqlite', '.sqlite3')):
+            if seed.lower() in ('mysql', 'sqlite'):
+                source = create_database(seed.lower())
+            else:
+                from sqlite_storage import SQLiteDatabaseManager
+                source = SQLiteDatabaseManager(read_only=True, path=seed)
+            if not source.connect():
+                raise StorageError(f"could not connect to {seed}")
+            try:
+                counts = copy_catalog(source, self)
+            finally:
+                source.disconnect()
+        else:
+            with open(seed, encoding='utf-8') as stream:
+                counts = CatalogImporter(self).run(read_routes(stream, seed))
+
+        print(f"Loaded {counts['routes']} routes and {counts['stops']} stops into memory")
+
+    def disconnect(self):
+        self.pool = None
+
+    def is_connected(self):
+        return bool(self.pool)
+
+    def get_schema_version(self):
+        return None
+
+    def ensure_schema(self, auto_migrate=None):
+        # Tables are plain dicts, so there is no schema to migrate
+        return bool(self.pool)
+
+    def write_catalog_rows(self, routes, stops, route_stops, coordinates, shapes):
+        """Upsert routes and stops and replace the children of those routes, all or nothing"""
+        if not self._writable():
+            raise StorageError("In-memory storage is not open for writing")
+
+        with self._lock:
+            # Check references first, like foreign keys, so a bad batch changes nothing
+            known_routes = set(self.routes).union(row[0] for row in routes)
+            known_stops = set(self.stops).union(row[0] for row in stops)
+            for route_id, stop_id, _ in route_stops:
+                if route_id not in known_routes or stop_id not in known_stops:
+                    raise StorageError(f"Route {route_id} references unknown stop {stop_id}")
+            for route_id in {row[0] for row in coordinates} | {row[0] for row in shapes}:
+                if route_id not in known_routes:
+                    raise StorageError(f"Unknown route {route_id}")
+
+            changed_routes, changed_stops = catalog_changes.changed_ids(
+                routes, stops, route_stops,
+                [tuple(self.routes[row[0]][c] for c in self.ROUTE_COLUMNS) for row in routes if row[0] in self.routes],
+                [tuple(self.stops[row[0]][c] for c in self.STOP_COLUMNS) for row in stops if row[0] in self.stops],
+                [(row[0], stop_id, order) for row in routes
+                 for stop_id, order in self.stop_orders.get(row[0], {}).items()]
+            )
+
+            now = datetime.now().replace(microsecond=0)
+            for route_id, name, origin, destination, fare, duration, frequency, route_type in routes:
+                existing = self.routes.get(route_id)
+                self.routes[route_id] = {
+                    'id': route_id, 'name': name, 'origin': origin, 'destination': destination,
+                    'fare': Decimal(str(fare)), 'duration': int(duration), 'frequency': int(frequency),
+                    'type': route_type or 'regular',
+                    'created_at': existing['created_at'] if existing else now, 'updated_at': now
+                }
+            for stop_id, name, lat, lng in stops:
+                existing = self.stops.get(stop_id)
+                self.stops[stop_id] = {
+                    'id': stop_id, 'name': name,
+                    'latitude': Decimal(str(lat)), 'longitude': Decimal(str(lng)),
+                    'created_at': existing['created_at'] if existing else now
+                }
+
+            # Children are replaced wholesale so re-importing a route never leaves stale rows
+            for route_id, *_ in routes:
+                for stop_id in self.stop_orders.pop(route_id, {}):
+                    self.stop_routes.get(stop_id, set()).discard(route_id)
+                self.route_stops.pop(route_id, None)
+                self.coordinates.pop(route_id, None)
+                self.shapes.pop(route_id, None)
+
+            changed = set()
+            for route_id, stop_id, order in route_stops:
+                self.stop_orders.setdefault(route_id, {})[stop_id] = order
+                self.stop_routes.setdefault(stop_id, set()).add(route_id)
+                changed.add(route_id)
+            for route_id in changed:
+                self.route_stops[route_id] = sorted(
+                    (order, stop_id) for stop_id, order in self.stop_orders[route_id].items()
+                )
+
+            for route_id, lat, lng, _ in sorted(coordinates, key=lambda row: (row[0], row[3])):
+                self.coordinates.setdefault(route_id, []).append([float(lat), float(lng)])
+            for route_id, tolerance, encoded, _ in shapes:
+                self.shapes.setdefault(route_id, {})[tolerance] = encoded
+
+            if routes:
+                self._route_ids = None
+            if stops:
+                self._names = None
+                self._spatial = None
+            self._record_catalog_changes(changed_routes, changed_stops)
+
+    def _record_catalog_changes(self, route_ids, stop_ids, deleted=False):
+        """Log routes and stops changed (or deleted) by the caller under a new catalog version"""
+        if not route_ids and not stop_ids:
+            return
+        self.catalog_version += 1
+        for entity, ids in (('route', route_ids), ('stop', stop_ids)):
+            for entity_id in ids:
+                self.changes[(entity, entity_id)] = {
+                    'entity': entity, 'entity_id': entity_id, 'version': self.catalog_version, 'deleted': deleted
+                }
+
+    def iter_catalog_rows(self, table, batch_size=1000):
+        """Rows of a catalog table in key order, copied batch_size keys at a time so the lock is held briefly"""
+        if table not in CATALOG_TABLES:
+            raise KeyError(table)
+        if not self.pool:
+            raise StorageError("In-memory storage is not connected")
+        with self._lock:
+            keys = sorted(self.stops if table == 'stops' else self.routes)
+        for start in range(0, len(keys), batch_size):
+            with self._lock:
+                rows = [row for key in keys[start:start + batch_size] for row in self._catalog_rows(table, key)]
+            yield from rows
+
+    def _catalog_rows(self, table, key):
+        if table == 'routes':
+            route = self.routes.get(key)
+            return [{column: route[column] for column in self.ROUTE_COLUMNS}] if route else []
+        if table == 'stops':
+            stop = self.stops.get(key)
+            return [self._stop_row(stop)] if stop else []
+        if table == 'route_stops':
+            return [{'route_id': key, 'stop_id': stop_id, 'stop_order': order}
+                    for order, stop_id in self.route_stops.get(key, ())]
+        return [{'route_id': key, 'latitude': lat, 'longitude': lng, 'sequence_order': sequence}
+                for sequence, (lat, lng) in enumerate(self.coordinates.get(key, ()), 1)]
+
+    def get_catalog_changes(self, after=None, limit=catalog_changes.DEFAULT_PAGE_SIZE):
+        """Change rows after the (version, entity, entity_id) key with the current routes, stops and stop lists"""
+        if not self.pool:
+            return None
+        with self._lock:
+            keys = sorted((c['version'], c['entity'], c['entity_id']) for c in self.changes.values())
+            start = 0 if after is None else bisect.bisect_right(keys, tuple(after))
+            changes = [dict(self.changes[(entity, entity_id)]) for _, entity, entity_id in keys[start:start + limit]]
+
+            route_ids = [c['entity_id'] for c in changes
+                         if c['entity'] == 'route' and not c['deleted'] and c['entity_id'] in self.routes]
+            stop_ids = [c['entity_id'] for c in changes
+                        if c['entity'] == 'stop' and not c['deleted'] and c['entity_id'] in self.stops]
+            return {
+                'changes': changes,
+                'routes': [dict(self.routes[route_id]) for route_id in route_ids],
+                'stops': [dict(self.stops[stop_id]) for stop_id in stop_ids],
+                'route_stops': [
+                    {'route_id': route_id, 'stop_id': stop_id, 'stop_order': order}
+                    for route_id in route_ids for order, stop_id in self.route_stops.get(route_id, ())
+                ]
+            }
+
+    # Route reads are assembled from the tables on every call, so callers may modify what they get
+    def _route(self, route_id, stops=True, shapes=True):
+        route = dict(self.routes[route_id])
+        if stops:
+            route['stops'] = [
+                dict(self.stops[stop_id], order=order) for order, stop_id in self.route_stops.get(route_id, ())
+            ]
+        if shapes:
+            route['coordinates'] = list(self.coordinates.get(route_id, ()))
+            route['shapes'] = dict(self.shapes.get(route_id, {}))
+        return route
+
+    def get_catalog(self):
+        """Every route with its stops and coordinates, or None before connect()"""
+        if not self.pool:
+            return None
+        with self._lock:
+            return [self._route(route_id) for route_id in sorted(self.routes)]
+
+    def get_catalog_version(self):
+        """Latest catalog change version, or None before connect()"""
+        if not self.pool:
+            return None
+        return {'version': self.catalog_version}
+
+    def get_routes(self, origin=None, destination=None):
+        """Get routes with optional filtering by stop name"""
+        if not self.pool:
+            return []
+        with self._lock:
+            if origin and destination:
+                return self._routes_between_stops(self._match_stop_ids(origin), self._match_stop_ids(destination))
+            return [self._route(route_id) for route_id in sorted(self.routes)]
+
+    def get_routes_between_stops(self, origin_stop_ids, destination_stop_ids):
+        """Get routes that call at one of the origin stops before one of the destination stops"""
+        if not self.pool:
+            return []
+        with self._lock:
+            return self._routes_between_stops(set(origin_stop_ids), set(destination_stop_ids))
+
+    def _match_stop_ids(self, name):
+        # Prefix match like the SQL backends
+        prefix = name.strip().lower()
+        return {stop_id for _, stop_id in self._names_starting(prefix)} if prefix else set()
+
+    def _names_starting(self, prefix):
+        """(lowercased name, stop id) pairs whose name starts with prefix, in name order; call under the lock"""
+        if self._names is None:
+            self._names = sorted((stop['name'].lower(), stop_id) for stop_id, stop in self.stops.items())
+        for name, stop_id in itertools.islice(self._names, bisect.bisect_left(self._names, (prefix,)), None):
+            if not name.startswith(prefix):
+                break
+            yield name, stop_id
+
+    def _routes_between_stops(self, origin_ids, destination_ids):
+        candidates = set()
+        for stop_id in origin_ids:
+            candidates.update(self.stop_routes.get(stop_id, ()))
+
+        found = []
+        for route_id in sorted(candidates):
+            orders = self.stop_orders[route_id]
+            first = min(orders[stop_id] for stop_id in origin_ids if stop_id in orders)
+            if any(orders[stop_id] > first for stop_id in destination_ids if stop_id in orders):
+                found.append(self._route(route_id))
+        return found
+
+    def get_route(self, route_id):
+        """Get a single route with its stops and coordinates, or None if it does not exist"""
+        if not self.pool:
+            return None
+        with self._lock:
+            return self._route(route_id) if route_id in self.routes else None
+
+    def get_routes_by_ids(self, route_ids):
+        """Get routes by id with their stops and coordinates, in the order requested"""
+        if not self.pool:
+            return []
+        with self._lock:
+            return [self._route(route_id) for route_id in dict.fromkeys(route_ids) if route_id in self.routes]
+
+    def get_routes_page(self, after_id=None, limit=None, stops=True, shapes=True):
+        """Routes with id greater than after_id in id order, at most limit, with only the child rows asked for"""
+        if not self.pool:
+            return []
+        with self._lock:
+            if self._route_ids is None:
+                self._route_ids = sorted(self.routes)
+            start = 0 if after_id is None else bisect.bisect_right(self._route_ids, after_id)
+            end = None if limit is None else start + limit
+            return [self._route(route_id, stops, shapes) for route_id in self._route_ids[start:end]]
+
+    @staticmethod
+    def _stop_row(stop):
+        return {'id': stop['id'], 'name': stop['name'], 'latitude': stop['latitude'], 'longitude': stop['longitude']}
+
+    def get_stops(self):
+        """Every stop, or None before connect()"""
+        if not self.pool:
+            return None
+        with self._lock:
+            return [self._stop_row(self.stops[stop_id]) for stop_id in sorted(self.stops)]
+
+    def get_stops_near(self, lat, lng, radius_km, limit=10):
+        """Stops within radius_km of a point, nearest first, with the routes serving each"""
+        if not self.pool:
+            return []
+        with self._lock:
+            if self._spatial is None:
+                self._spatial = StopSpatialIndex(self.stops.values())
+            return [{
+                'id': stop['id'],
+                'name': stop['name'],
+                'lat': float(stop['latitude']),
+                'lng': float(stop['longitude']),
+                'distance': round(distance, 3),
+                'routes': [
+                    {'id': route_id, 'name': self.routes[route_id]['name'], 'type': self.routes[route_id]['type']}
+                    for route_id in sorted(self.stop_routes.get(stop['id'], ()))
+                ]
+            } for distance, stop in self._spatial.nearby(lat, lng, radius_km, limit)]
+
+    def get_stop_aliases(self):
+        """Get alternative stop names in Sinhala, Tamil and English"""
+        if not self.pool:
+            return []
+        with self._lock:
+            return [dict(row) for row in self.aliases.values()]
+
+    def upsert_stop_aliases(self, aliases):
+        """Insert or update stop aliases given as {stop_id, alias, language} rows"""
+        if not self._writable():
+            return False
+        with self._lock:
+            if any(row['stop_id'] not in self.stops for row in aliases):
+                print("Error writing stop aliases: unknown stop")
+                return False
+            for row in aliases:
+                self.aliases[(row['stop_id'], row['alias'])] = {
+                    'stop_id': row['stop_id'], 'alias': row['alias'], 'language': row['language']
+                }
+            # Aliases are part of the served catalog, so they move its version too
+            self._record_catalog_changes((), list(dict.fromkeys(row['stop_id'] for row in aliases)))
+        return True
+
+    def search_stops(self, prefix, limit=10):
+        """Stops whose name starts with prefix, by bisecting a sorted name list"""
+        if not self.pool:
+            return []
+        with self._lock:
+            return [self._stop_row(self.stops[stop_id])
+                    for _, stop_id in itertools.islice(self._names_starting(prefix.lower()), limit)]
+
+    # Fleet and live tracking
+    BUS_COLUMNS = ('id', 'route_id', 'bus_number', 'vehicle_type', 'total_seats', 'status')
+
+    def get_buses(self):
+        """Every registered bus"""
+        if not self.pool:
+            return []
+        with self._lock:
+            return [dict(self.buses[bus_id]) for bus_id in sorted(self.buses)]
+
+    def upsert_buses(self, buses):
+        """Insert or update buses given as rows with BUS_COLUMNS"""
+        if not self._writable():
+            return False
+        with self._lock:
+            if any(bus['route_id'] not in self.routes for bus in buses):
+                print("Error writing buses: unknown route")
+                return False
+            for bus in buses:
+                previous = self.buses.get(bus['id'])
+                if previous:
+                    self.route_buses[previous['route_id']].discard(bus['id'])
+                self.buses[bus['id']] = {
+                    'id': bus['id'], 'route_id': bus['route_id'], 'bus_number': bus['bus_number'],
+                    'vehicle_type': bus.get('vehicle_type') or 'regular',
+                    'total_seats': bus.get('total_seats') or 50, 'status': bus.get('status') or 'active'
+                }
+                self.route_buses.setdefault(bus['route_id'], set()).add(bus['id'])
+        return True
+
+    def _known(self, location):
+        return location['bus_id'] in self.buses and all(
+            location.get(c) is None or location.get(c) in self.stops for c in ('current_stop_id', 'next_stop_id')
+        )
+
+    def _write_location(self, location):
+        current = self.current.get(location['bus_id'])
+        # Out-of-order pings must not overwrite a newer position
+        if current is None or location['timestamp'] >= current['timestamp']:
+            self.current[location['bus_id']] = {
+                'bus_id': location['bus_id'], 'latitude': location['latitude'], 'longitude': location['longitude'],
+                'current_stop_id': location.get('current_stop_id'), 'next_stop_id': location.get('next_stop_id'),
+                'occupied_seats': location.get('occupied_seats', 0), 'delay_minutes': location.get('delay_minutes', 0),
+                'delay_reason': location.get('delay_reason'), 'timestamp': location['timestamp']
+            }
+            self.location_sequence += 1
+            self.current_sequence[location['bus_id']] = self.location_sequence
+
+    def update_bus_location(self, bus_id, latitude, longitude, current_stop_id=None,
+                            next_stop_id=None, occupied_seats=0, delay_minutes=0, delay_reason=None):
+        """Update bus location and status"""
+        if not self._writable():
+            return False
+
+        location = {
+            'bus_id': bus_id, 'latitude': latitude, 'longitude': longitude,
+            'current_stop_id': current_stop_id, 'next_stop_id': next_stop_id,
+            'occupied_seats': occupied_seats, 'delay_minutes': delay_minutes,
+            'delay_reason': delay_reason, 'timestamp': datetime.now()
+        }
+        with self._lock:
+            if not self._known(location):
+                print(f"Error updating bus location: unknown bus or stop for {bus_id}")
+                return False
+            self._write_location(location)
+        return True
+
+    def insert_bus_locations(self, locations):
+        """Apply many location pings; pings for unknown buses or stops are skipped"""
+        if not self._writable():
+            return False
+        with self._lock:
+            for location in locations:
+                if self._known(location):
+                    self._write_location(location)
+        return True
+
+    def _live_row(self, location):
+        bus = self.buses[location['bus_id']]
+        current_stop = self.stops.get(location['current_stop_id'])
+        next_stop = self.stops.get(location['next_stop_id'])
+        return dict(
+            location,
+            route_id=bus['route_id'], bus_number=bus['bus_number'],
+            vehicle_type=bus['vehicle_type'], total_seats=bus['total_seats'],
+            current_stop_name=current_stop['name'] if current_stop else None,
+            next_stop_name=next_stop['name'] if next_stop else None
+        )
+
+    def get_live_buses(self, route_id=None):
+        """Get the latest position of every bus that reported in the last 5 minutes"""
+        if not self.pool:
+            return []
+
+        cutoff = datetime.now() - timedelta(minutes=5)
+        with self._lock:
+            bus_ids = self.route_buses.get(route_id, ()) if route_id else self.current
+            rows = [
+                self._live_row(self.current[bus_id]) for bus_id in bus_ids
+                if bus_id in self.current and self.current[bus_id]['timestamp'] >= cutoff
+            ]
+        rows.sort(key=lambda row: row['timestamp'], reverse=True)
+        return rows
+
+    def get_locations_after(self, sequence, limit=1000):
+        """(last sequence, positions) for up to limit positions written after sequence, oldest
+        first, with each bus's route. A sequence of None returns the newest sequence and no rows.
+        Only the latest position per bus is kept, so superseded pings are not returned."""
+        if not self.pool:
+            return sequence, []
+        with self._lock:
+            if sequence is None:
+                return self.location_sequence, []
+            written = sorted(
+                (number, bus_id) for bus_id, number in self.current_sequence.items() if number > sequence
+            )[:limit]
+            rows = [dict(self.current[bus_id], route_id=self.buses[bus_id]['route_id']) for _, bus_id in written]
+        return (written[-1][0] if written else sequence), rows
+
+    def get_bus_routes(self):
+        """Map of bus id to route id"""
+        if not self.pool:
+            return {}
+        with self._lock:
+            return {bus_id: bus['route_id'] for bus_id, bus in self.buses.items()}
+
+    def get_active_bus_positions(self, since):
+        """Latest position of every active bus that reported at or after since, with its route and seats"""
+        if not self.pool:
+            return []
+        with self._lock:
+            rows = []
+            for bus_id, location in self.current.items():
+                bus = self.buses[bus_id]
+                if bus['status'] == 'active' and (since is None or location['timestamp'] >= since):
+                    rows.append({
+                        'bus_id': bus_id, 'latitude': location['latitude'], 'longitude': location['longitude'],
+                        'occupied_seats': location['occupied_seats'], 'delay_minutes': location['delay_minutes'],
+                        'timestamp': location['timestamp'], 'route_id': bus['route_id'],
+                        'total_seats': bus['total_seats']
+                    })
+            return rows
+
+    def upsert_bus_arrivals(self, arrivals):
+        """Insert or update predictions given as (bus_id, stop_id, estimated, actual, delay, capacity) tuples"""
+        if not self._writable():
+            return False
+
+        with self._lock:
+            if any(bus_id not in self.buses or stop_id not in self.stops for bus_id, stop_id, *_ in arrivals):
+                print("Error writing bus arrivals: unknown bus or stop")
+                return False
+
+            for bus_id, stop_id, estimated, actual, delay, capacity in arrivals:
+                by_bus = self.arrivals.setdefault(stop_id, {})
+                existing = by_bus.get(bus_id)
+                if existing is None:
+                    by_bus[bus_id] = {
+                        'id': next(self._ids), 'bus_id': bus_id, 'stop_id': stop_id,
+                        'estimated_arrival': estimated, 'actual_arrival': actual,
+                        'delay_minutes': delay, 'capacity_status': capacity, 'created_at': datetime.now()
+                    }
+                    continue
+                # A recorded actual arrival is kept until a new trip predicts the stop again
+                if actual is None or existing['actual_arrival'] is None:
+                    existing['estimated_arrival'] = estimated
+                existing['delay_minutes'] = delay
+                existing['capacity_status'] = capacity
+                existing['actual_arrival'] = None if actual is None else existing['actual_arrival'] or actual
+        return True
+
+    def get_bus_arrivals(self, stop_id, limit=10):
+        """Get upcoming bus arrivals for a stop"""
+        if not self.pool:
+            return []
+
+        now = datetime.now()
+        with self._lock:
+            rows = []
+            for arrival in self.arrivals.get(stop_id, {}).values():
+                if arrival['actual_arrival'] is None and arrival['estimated_arrival'] >= now:
+                    bus = self.buses[arrival['bus_id']]
+                    rows.append(dict(
+                        arrival, bus_number=bus['bus_number'], vehicle_type=bus['vehicle_type'],
+                        total_seats=bus['total_seats'], route_name=self.routes[bus['route_id']]['name']
+                    ))
+        rows.sort(key=lambda row: row['estimated_arrival'])
+        return rows[:limit]
+
+    # User features
+    def add_user_favorite(self, user_id, route_id, origin_stop_id=None, destination_stop_id=None):
+        """Add a route to user favorites"""
+        if not self._writable():
+            return False
+
+        with self._lock:
+            if route_id not in self.routes or any(
+                stop_id is not None and stop_id not in self.stops for stop_id in (origin_stop_id, destination_stop_id)
+            ):
+                print(f"Error adding user favorite: unknown route or stop for {route_id}")
+                return False
+            favorites = self.favorites.setdefault(user_id, {})
+            key = (route_id, origin_stop_id, destination_stop_id)
+            if key in favorites:
+                favorites[key]['created_at'] = datetime.now()
+            else:
+                favorites[key] = {
+                    'id': next(self._ids), 'user_id': user_id, 'route_id': route_id,
+                    'origin_stop_id': origin_stop_id, 'destination_stop_id': destination_stop_id,
+                    'created_at': datetime.now()
+                }
+        return True
+
+    def get_user_favorites(self, user_id):
+        """Get user's favorite routes"""
+        if not self.pool:
+            return []
+
+        with self._lock:
+            rows = []
+            for favorite in self.favorites.get(user_id, {}).values():
+                route = self.routes.get(favorite['route_id'])
+                if route is None:
+                    continue
+                origin = self.stops.get(favorite['origin_stop_id'])
+                destination = self.stops.get(favorite['destination_stop_id'])
+                rows.append(dict(
+                    favorite, route_name=route['name'], origin=route['origin'], destination=route['destination'],
+                    origin_stop_name=origin['name'] if origin else None,
+                    destination_stop_name=destination['name'] if destination else None
+                ))
+        rows.sort(key=lambda row: row['created_at'], reverse=True)
+        return rows
@@ -0,0 +1,317 @@
+import bisect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-query and per-storage-call instrumentation; request timing and gauges are always on
+ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Upper bounds in seconds shared by every latency histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements slower than this many milliseconds are printed; 0 turns the log off
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 0))
+
+# Characters of SQL kept in a slow-query log line
+SLOW_QUERY_SQL_CHARS = 300
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f'{self.name}{_labels(self.label_names, labels)} {_number(value)}' for labels, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total!r}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+
+class Sampled:
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, labels, read, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        # Returns {label values tuple: number}
+        self.read = read
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        try:
+            samples = self.read()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return lines
+        lines.extend(
+            f'{self.name}{_labels(self.label_names, labels)} {_number(value)}'
+            for labels, value in sorted(samples.items()) if value is not None
+        )
+        return lines
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def sampled(self, name, help_text, labels, read, kind='gauge'):
+        """Register (or replace) a gauge or counter read from read() at scrape time"""
+        with self._lock:
+            self._metrics[name] = Sampled(name, help_text, labels, read, kind)
+            return self._metrics[name]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route pattern',
+    ('method', 'endpoint', 'status'))
+STORAGE_OPERATION_SECONDS = REGISTRY.histogram(
+    'storage_operation_duration_seconds', 'Time spent in each storage method, including its queries',
+    ('backend', 'operation'))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'db_query_duration_seconds', 'Time to execute a statement and fetch its rows',
+    ('backend', 'operation', 'statement'))
+DB_QUERY_ROWS = REGISTRY.counter(
+    'db_query_rows_total', 'Rows returned by or written by statements',
+    ('backend', 'operation', 'statement'))
+DB_QUERY_ERRORS = REGISTRY.counter(
+    'db_query_errors_total', 'Statements that raised an error',
+    ('backend', 'operation', 'statement'))
+DB_SLOW_QUERIES = REGISTRY.counter(
+    'db_slow_queries_total', 'Statements slower than DB_SLOW_QUERY_MS',
+    ('backend', 'operation'))
+
+# Storage method running on each thread, so queries can be attributed to it
+_operation = threading.local()
+
+
+def current_operation():
+    return getattr(_operation, 'name', None) or 'other'
+
+
+@contextmanager
+def operation(name):
+    """Attribute the queries run inside the block to the storage method name"""
+    previous = getattr(_operation, 'name', None)
+    _operation.name = name
+    try:
+        yield
+    finally:
+        _operation.name = previous
+
+
+def _statement(query):
+    match = re.match(r'\s*(\w+)', query)
+    return match.group(1).upper() if match else 'OTHER'
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that times each statement, from execute until the next one or close, with its rows"""
+
+    def __init__(self, cursor, backend):
+        self._cursor = cursor
+        self._backend = backend
+        self._pending = None
+
+    def _start(self, query):
+        self._finish()
+        # [query, seconds spent so far, rows fetched (None until a fetch)]
+        self._pending = [query, 0.0, None]
+
+    def _finish(self):
+        if self._pending is None:
+            return
+        query, elapsed, rows = self._pending
+        self._pending = None
+        if rows is None:
+            rows = max(self._cursor.rowcount or 0, 0)
+
+        operation_name = current_operation()
+        statement = _statement(query)
+        DB_QUERY_SECONDS.observe(elapsed, self._backend, operation_name, statement)
+        if rows:
+            DB_QUERY_ROWS.inc(self._backend, operation_name, statement, amount=rows)
+        if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+            DB_SLOW_QUERIES.inc(self._backend, operation_name)
+            sql = ' '.join(query.split())[:SLOW_QUERY_SQL_CHARS]
+            print(f"Slow query ({elapsed * 1000:.1f} ms, {operation_name}, {rows} rows): {sql}")
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        except Exception:
+            if self._pending is not None:
+                DB_QUERY_ERRORS.inc(self._backend, current_operation(), _statement(self._pending[0]))
+                self._pending = None
+            raise
+        finally:
+            if self._pending is not None:
+                self._pending[1] += time.perf_counter() - started
+
+    def execute(self, query, *args):
+        self._start(query)
+        return self._timed(self._cursor.execute, query, *args)
+
+    def executemany(self, query, *args):
+        self._start(query)
+        return self._timed(self._cursor.executemany, query, *args)
+
+    def _fetched(self, count):
+        if self._pending is not None:
+            self._pending[2] = (self._pending[2] or 0) + count
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchmany(self, *args):
+        rows = self._timed(self._cursor.fetchmany, *args)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        self._fetched(0 if row is None else 1)
+        return row
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def wrap_cursor(cursor, backend):
+    """cursor, instrumented when metrics are enabled"""
+    return InstrumentedCursor(cursor, backend) if ENABLED else cursor
+
+
+def instrument_storage(db, operations):
+    """Time the named storage methods of db and attribute their queries to them"""
+    if not ENABLED:
+        return db
+    for name in operations:
+        method = getattr(db, name)
+
+        def timed(*args, _name=name, _method=method, **kwargs):
+            started = time.perf_counter()
+            with operation(_name):
+                try:
+                    return _method(*args, **kwargs)
+                finally:
+                    STORAGE_OPERATION_SECONDS.observe(time.perf_counter() - started, db.backend, _name)
+
+        setattr(db, name, timed)
+    return db
+
+
+def register_metrics(app):
+    """Record the duration of every Flask request by method, route pattern and status"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, endpoint,
+                                         str(response.status_code))
+        return response
+
+    return record_request
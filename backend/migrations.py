@@ -0,0 +1,357 @@
+import time
+
+from mysql.connector import Error
+
+
+class Index:
+    """CREATE INDEX statement that is skipped when the index already exists.
+
+    MySQL has no CREATE INDEX IF NOT EXISTS, and DDL commits on its own, so a
+    migration that failed after creating an index must be able to run again.
+    """
+
+    def __init__(self, table, name, columns, unique=False):
+        self.table = table
+        self.name = name
+        self.columns = columns
+        self.unique = unique
+
+    def apply(self, cursor):
+        cursor.execute("""
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (self.table, self.name))
+        if cursor.fetchone()[0] == 0:
+            unique = 'UNIQUE ' if self.unique else ''
+            cursor.execute(f"CREATE {unique}INDEX {self.name} ON {self.table} ({self.columns})")
+
+# Ordered schema migrations. Each entry is (version, description, statements);
+# versions must increase and a migration must never be edited once released,
+# add a new one instead. Statements are SQL strings or Index entries, and must
+# be safe to run again after a partly applied migration.
+MIGRATIONS = [
+    (1, 'Initial schema', [
+        # Routes table
+        """
+            CREATE TABLE IF NOT EXISTS routes (
+                id VARCHAR(20) PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                origin VARCHAR(100) NOT NULL,
+                destination VARCHAR(100) NOT NULL,
+                fare DECIMAL(10,2) NOT NULL,
+                duration INT NOT NULL,
+                frequency INT NOT NULL,
+                type ENUM('regular', 'express', 'ac') DEFAULT 'regular',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """,
+
+        # Stops table
+        """
+            CREATE TABLE IF NOT EXISTS stops (
+                id VARCHAR(50) PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                latitude DECIMAL(10, 8) NOT NULL,
+                longitude DECIMAL(11, 8) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+
+        # Route stops junction table
+        """
+            CREATE TABLE IF NOT EXISTS route_stops (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                route_id VARCHAR(20) NOT NULL,
+                stop_id VARCHAR(50) NOT NULL,
+                stop_order INT NOT NULL,
+                FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
+                FOREIGN KEY (stop_id) REFERENCES stops(id) ON DELETE CASCADE,
+                UNIQUE KEY unique_route_stop (route_id, stop_id),
+                INDEX idx_route_order (route_id, stop_order)
+            )
+        """,
+
+        # Route coordinates table
+        """
+            CREATE TABLE IF NOT EXISTS route_coordinates (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                route_id VARCHAR(20) NOT NULL,
+                latitude DECIMAL(10, 8) NOT NULL,
+                longitude DECIMAL(11, 8) NOT NULL,
+                sequence_order INT NOT NULL,
+                FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
+                INDEX idx_route_sequence (route_id, sequence_order)
+            )
+        """,
+
+        # Buses table
+        """
+            CREATE TABLE IF NOT EXISTS buses (
+                id VARCHAR(50) PRIMARY KEY,
+                route_id VARCHAR(20) NOT NULL,
+                bus_number VARCHAR(20) NOT NULL,
+                vehicle_type ENUM('regular', 'ac') DEFAULT 'regular',
+                total_seats INT DEFAULT 50,
+                status ENUM('active', 'inactive', 'maintenance') DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE
+            )
+        """,
+
+        # Bus locations table (for live tracking)
+        """
+            CREATE TABLE IF NOT EXISTS bus_locations (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                bus_id VARCHAR(50) NOT NULL,
+                latitude DECIMAL(10, 8) NOT NULL,
+                longitude DECIMAL(11, 8) NOT NULL,
+                current_stop_id VARCHAR(50),
+                next_stop_id VARCHAR(50),
+                occupied_seats INT DEFAULT 0,
+                delay_minutes INT DEFAULT 0,
+                delay_reason VARCHAR(255),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
+                FOREIGN KEY (current_stop_id) REFERENCES stops(id),
+                FOREIGN KEY (next_stop_id) REFERENCES stops(id),
+                INDEX idx_bus_timestamp (bus_id, timestamp)
+            )
+        """,
+
+        # User favorites table (for future login functionality)
+        """
+            CREATE TABLE IF NOT EXISTS user_favorites (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id VARCHAR(100) NOT NULL,
+                route_id VARCHAR(20) NOT NULL,
+                origin_stop_id VARCHAR(50),
+                destination_stop_id VARCHAR(50),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE,
+                FOREIGN KEY (origin_stop_id) REFERENCES stops(id),
+                FOREIGN KEY (destination_stop_id) REFERENCES stops(id),
+                UNIQUE KEY unique_user_favorite (user_id, route_id, origin_stop_id, destination_stop_id)
+            )
+        """,
+
+        # Bus arrival predictions table
+        """
+            CREATE TABLE IF NOT EXISTS bus_arrivals (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                bus_id VARCHAR(50) NOT NULL,
+                stop_id VARCHAR(50) NOT NULL,
+                estimated_arrival TIMESTAMP NOT NULL,
+                actual_arrival TIMESTAMP NULL,
+                delay_minutes INT DEFAULT 0,
+                capacity_status ENUM('available', 'moderate', 'full') DEFAULT 'available',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
+                FOREIGN KEY (stop_id) REFERENCES stops(id) ON DELETE CASCADE,
+                INDEX idx_stop_arrival (stop_id, estimated_arrival)
+            )
+        """
+    ]),
+
+    (2, 'Stop aliases and stop lookup indexes', [
+        # Sinhala/Tamil/English alternative names for stops
+        """
+            CREATE TABLE IF NOT EXISTS stop_aliases (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                stop_id VARCHAR(50) NOT NULL,
+                alias VARCHAR(255) NOT NULL,
+                language CHAR(2) NOT NULL DEFAULT 'en',
+                FOREIGN KEY (stop_id) REFERENCES stops(id) ON DELETE CASCADE,
+                UNIQUE KEY unique_stop_alias (stop_id, alias)
+            )
+        """,
+
+        # Find the routes serving a stop without scanning route_stops
+        Index('route_stops', 'idx_stop_route', 'stop_id, route_id, stop_order'),
+
+        # Prefix lookups on stop names
+        Index('stops', 'idx_stop_name', 'name')
+    ]),
+
+    (3, 'Latest position per bus', [
+        # One row per bus, upserted on every ping, so live reads don't scan bus_locations
+        """
+            CREATE TABLE IF NOT EXISTS bus_current_location (
+                bus_id VARCHAR(50) PRIMARY KEY,
+                latitude DECIMAL(10, 8) NOT NULL,
+                longitude DECIMAL(11, 8) NOT NULL,
+                current_stop_id VARCHAR(50),
+                next_stop_id VARCHAR(50),
+                occupied_seats INT DEFAULT 0,
+                delay_minutes INT DEFAULT 0,
+                delay_reason VARCHAR(255),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
+                INDEX idx_current_timestamp (timestamp)
+            )
+        """,
+
+        # Seed it from the newest ping of every bus
+        """
+            INSERT IGNORE INTO bus_current_location
+                (bus_id, latitude, longitude, current_stop_id, next_stop_id,
+                 occupied_seats, delay_minutes, delay_reason, timestamp)
+            SELECT bl.bus_id, bl.latitude, bl.longitude, bl.current_stop_id, bl.next_stop_id,
+                   bl.occupied_seats, bl.delay_minutes, bl.delay_reason, bl.timestamp
+            FROM bus_locations bl
+            JOIN (SELECT bus_id, MAX(id) AS id FROM bus_locations GROUP BY bus_id) latest ON latest.id = bl.id
+        """
+    ]),
+
+    (4, 'Downsampled location history', [
+        # Lets retention find old pings without scanning the whole table
+        Index('bus_locations', 'idx_location_timestamp', 'timestamp'),
+
+        # One averaged point per bus per minute for pings older than the raw retention window
+        """
+            CREATE TABLE IF NOT EXISTS bus_location_history (
+                bus_id VARCHAR(50) NOT NULL,
+                minute DATETIME NOT NULL,
+                latitude DECIMAL(10, 8) NOT NULL,
+                longitude DECIMAL(11, 8) NOT NULL,
+                occupied_seats INT DEFAULT 0,
+                delay_minutes INT DEFAULT 0,
+                samples INT NOT NULL DEFAULT 1,
+                PRIMARY KEY (bus_id, minute),
+                INDEX idx_history_minute (minute)
+            )
+        """
+    ]),
+
+    (5, 'Stop position index', [
+        # Bounding-box lookups for nearby stops when the catalog is not cached in memory
+        Index('stops', 'idx_stop_position', 'latitude, longitude')
+    ]),
+
+    (6, 'One arrival prediction per bus and stop', [
+        # Keep only the newest prediction before making (bus_id, stop_id) unique for upserts
+        """
+            DELETE older FROM bus_arrivals older
+            JOIN bus_arrivals newer
+                ON newer.bus_id = older.bus_id AND newer.stop_id = older.stop_id AND newer.id > older.id
+        """,
+        Index('bus_arrivals', 'uniq_bus_stop', 'bus_id, stop_id', unique=True)
+    ]),
+
+    (7, 'Encoded route shapes', [
+        # Google encoded polylines of route_coordinates at several Douglas-Peucker tolerances;
+        # tolerance_m = 0 is the full shape
+        """
+            CREATE TABLE IF NOT EXISTS route_shapes (
+                route_id VARCHAR(20) NOT NULL,
+                tolerance_m INT NOT NULL,
+                polyline MEDIUMTEXT NOT NULL,
+                point_count INT NOT NULL,
+                PRIMARY KEY (route_id, tolerance_m),
+                FOREIGN KEY (route_id) REFERENCES routes(id) ON DELETE CASCADE
+            )
+        """
+    ]),
+
+    (8, 'Luxury route types', [
+        # The sample catalog and frontend use luxury and semi-luxury services
+        """
+            ALTER TABLE routes
+            MODIFY type ENUM('regular', 'express', 'ac', 'luxury', 'semi-luxury') DEFAULT 'regular'
+        """
+    ]),
+
+    (9, 'Catalog change log', [
+        # Single-row counter; catalog writes bump it inside their transaction, so versions
+        # become visible in increasing order
+        """
+            CREATE TABLE IF NOT EXISTS catalog_sequence (
+                id TINYINT PRIMARY KEY,
+                value BIGINT NOT NULL
+            )
+        """,
+        """
+            INSERT IGNORE INTO catalog_sequence (id, value) VALUES (1, 1)
+        """,
+        # Version of the last change to each route (with its stop list) and stop; deleted
+        # entities keep their row as a tombstone
+        """
+            CREATE TABLE IF NOT EXISTS catalog_changes (
+                entity VARCHAR(10) NOT NULL,
+                entity_id VARCHAR(50) NOT NULL,
+                version BIGINT NOT NULL,
+                deleted BOOLEAN NOT NULL DEFAULT FALSE,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                PRIMARY KEY (entity, entity_id),
+                INDEX idx_catalog_changes_version (version, entity, entity_id)
+            )
+        """,
+        # Existing catalog rows are the first version
+        """
+            INSERT IGNORE INTO catalog_changes (entity, entity_id, version)
+            SELECT 'route', id, 1 FROM routes
+        """,
+        """
+            INSERT IGNORE INTO catalog_changes (entity, entity_id, version)
+            SELECT 'stop', id, 1 FROM stops
+        """
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Named MySQL lock so concurrently starting workers don't migrate twice
+LOCK_NAME = 'sri_lanka_bus_schema_migration'
+LOCK_TIMEOUT = 60
+
+
+def ensure_version_table(cursor):
+    """Create the schema_version bookkeeping table if it is missing"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(cursor):
+    """Highest migration version applied to the database"""
+    ensure_version_table(cursor)
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    row = cursor.fetchone()
+    return int(row[0])
+
+
+def pending_migrations(version, target=None):
+    """Migrations newer than version, up to and including target"""
+    target = LATEST_VERSION if target is None else target
+    return [m for m in MIGRATIONS if version < m[0] <= target]
+
+
+def migrate(cursor, target=None):
+    """Apply pending migrations in order and return the resulting schema version"""
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        raise Error(msg=f"Could not acquire schema migration lock '{LOCK_NAME}'")
+
+    try:
+        version = current_version(cursor)
+        for number, description, statements in pending_migrations(version, target):
+            started = time.monotonic()
+            for statement in statements:
+                if isinstance(statement, Index):
+                    statement.apply(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (number, description)
+            )
+            version = number
+            print(f"Applied migration {number}: {description} ({time.monotonic() - started:.2f}s)")
+        return version
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
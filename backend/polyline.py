@@ -0,0 +1,109 @@
+import math
+
+from geo import EARTH_RADIUS_KM
+
+# Simplification levels stored per route, in metres; 0 is the full shape
+SHAPE_TOLERANCES_M = (0, 10, 50, 200)
+
+# Level served for ?geometry=simplified when no zoom is given
+DEFAULT_SIMPLIFIED_M = 50
+
+METRES_PER_DEGREE = EARTH_RADIUS_KM * 1000 * math.pi / 180
+
+
+def encode(points, precision=5):
+    """Google encoded polyline string for a sequence of (lat, lng) pairs"""
+    factor = 10 ** precision
+    chunks = []
+    last_lat = last_lng = 0
+    for lat, lng in points:
+        lat, lng = int(round(float(lat) * factor)), int(round(float(lng) * factor))
+        for delta in (lat - last_lat, lng - last_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        last_lat, last_lng = lat, lng
+    return ''.join(chunks)
+
+
+def decode(encoded, precision=5):
+    """[lat, lng] pairs from a Google encoded polyline string"""
+    factor = 10 ** precision
+    points = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        points.append([lat / factor, lng / factor])
+    return points
+
+
+def simplify(points, tolerance_m):
+    """Douglas-Peucker simplification keeping every point further than tolerance_m from the simplified line"""
+    if tolerance_m <= 0 or len(points) < 3:
+        return list(points)
+
+    cos_lat = math.cos(math.radians(sum(p[0] for p in points) / len(points)))
+    # Local flat projection in metres; routes are short enough for this to hold
+    xy = [(float(lng) * cos_lat * METRES_PER_DEGREE, float(lat) * METRES_PER_DEGREE) for lat, lng in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (ax, ay), (bx, by) = xy[first], xy[last]
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+
+        furthest, worst = None, tolerance_m * tolerance_m
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            t = ((px - ax) * dx + (py - ay) * dy) / length2 if length2 else 0.0
+            t = min(max(t, 0.0), 1.0)
+            ex, ey = px - (ax + t * dx), py - (ay + t * dy)
+            offset2 = ex * ex + ey * ey
+            if offset2 > worst:
+                furthest, worst = i, offset2
+
+        if furthest is not None:
+            keep[furthest] = True
+            stack.append((first, furthest))
+            stack.append((furthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def route_shapes(coordinates):
+    """tolerance -> (encoded polyline, point count) for every stored simplification level"""
+    shapes = {}
+    for tolerance in SHAPE_TOLERANCES_M:
+        points = simplify(coordinates, tolerance)
+        shapes[tolerance] = (encode(points), len(points))
+    return shapes
+
+
+def tolerance_for(geometry, zoom=None):
+    """Stored simplification level for a ?geometry= value and optional map zoom, or None for no geometry"""
+    if geometry == 'none':
+        return None
+    if geometry == 'full':
+        return 0
+    if zoom is None:
+        return DEFAULT_SIMPLIFIED_M
+    # About two screen pixels at the requested Web Mercator zoom level
+    metres = 2 * 156543.03 / (2 ** max(0, min(zoom, 22)))
+    return max(t for t in SHAPE_TOLERANCES_M if t <= metres)
@@ -0,0 +1,177 @@
+import itertools
+import os
+import threading
+import time
+
+from mysql.connector import Error
+
+from connection_pool import ConnectionPool
+
+# Values accepted by DB_REPLICA_SELECTION
+SELECTION_POLICIES = ('round_robin', 'least_latency')
+
+
+def replica_configs(primary_config):
+    """Connection configs for the hosts in AIVEN_MYSQL_REPLICA_HOSTS (host[:port], comma separated)"""
+    configs = []
+    for address in os.getenv('AIVEN_MYSQL_REPLICA_HOSTS', '').split(','):
+        address = address.strip()
+        if not address:
+            continue
+        host, _, port = address.partition(':')
+        config = dict(primary_config, host=host, port=int(port or primary_config['port']))
+        # Replicas share the primary's credentials unless given their own
+        config['user'] = os.getenv('AIVEN_MYSQL_REPLICA_USER', config['user'])
+        config['password'] = os.getenv('AIVEN_MYSQL_REPLICA_PASSWORD', config['password'])
+        configs.append(config)
+    return configs
+
+
+class Replica:
+    def __init__(self, config, pool):
+        self.name = f"{config['host']}:{config['port']}"
+        self.pool = pool
+        # Seconds behind the primary at the last check (None if unknown)
+        self.lag = None
+        # Smoothed round trip of the lag check in milliseconds
+        self.latency_ms = None
+        self.in_rotation = False
+        self.reads = 0
+        self.last_error = None
+
+    def stats(self):
+        return {
+            'name': self.name,
+            'in_rotation': self.in_rotation,
+            'lag_seconds': self.lag,
+            'latency_ms': round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            'reads': self.reads,
+            'last_error': self.last_error,
+            'pool': self.pool.stats()
+        }
+
+
+class ReplicaRouter:
+    """Picks the read replica for each read and keeps stale or unreachable replicas out of rotation.
+
+    A background thread measures every replica's replication lag and round
+    trip each check_interval seconds. Replicas more than max_lag seconds
+    behind, with replication stopped, or unreachable are skipped until a
+    later check finds them caught up. choose() returns None when no replica
+    is usable, and the caller reads from the primary.
+    """
+
+    # Weight of the newest round trip in the smoothed latency
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(self, configs, selection=None, max_lag=None, check_interval=None,
+                 pool_size=5, pool_timeout=10, pool_ping_interval=30):
+        self.selection = selection or os.getenv('DB_REPLICA_SELECTION', 'round_robin')
+        if self.selection not in SELECTION_POLICIES:
+            raise ValueError(f"Unknown DB_REPLICA_SELECTION {self.selection!r}, "
+                             f"expected one of {', '.join(SELECTION_POLICIES)}")
+        self.max_lag = max_lag if max_lag is not None else float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', 5))
+        self.check_interval = check_interval or float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+        self.replicas = [
+            Replica(config, ConnectionPool(config, size=pool_size, timeout=pool_timeout,
+                                           ping_interval=pool_ping_interval))
+            for config in configs
+        ]
+        self._turn = itertools.count()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Check every replica once, then keep checking them in the background"""
+        self.check()
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='replica-check', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.check_interval):
+            self.check()
+
+    def check(self):
+        """Measure lag and round trip of every replica and update the rotation"""
+        for replica in self.replicas:
+            was_in_rotation = replica.in_rotation
+            started = time.perf_counter()
+            try:
+                lag = self._replication_lag(replica)
+            except Error as e:
+                replica.in_rotation = False
+                replica.last_error = str(e)
+                if was_in_rotation:
+                    print(f"Replica {replica.name} taken out of rotation: {e}")
+                continue
+
+            elapsed = (time.perf_counter() - started) * 1000
+            if replica.latency_ms is None:
+                replica.latency_ms = elapsed
+            else:
+                replica.latency_ms += self.LATENCY_SMOOTHING * (elapsed - replica.latency_ms)
+            replica.lag = lag
+            replica.last_error = None
+            replica.in_rotation = lag is not None and lag <= self.max_lag
+
+            if was_in_rotation and not replica.in_rotation:
+                reason = 'replication stopped' if lag is None else f'{lag}s behind the primary'
+                print(f"Replica {replica.name} taken out of rotation: {reason}")
+            elif replica.in_rotation and not was_in_rotation:
+                print(f"Replica {replica.name} in rotation ({lag}s behind the primary)")
+
+    def _replication_lag(self, replica):
+        """Seconds the replica is behind its source, or None if it is not replicating or replication stopped"""
+        with replica.pool.connection() as connection:
+            cursor = connection.cursor(dictionary=True)
+            try:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                except Error:
+                    # MySQL before 8.0.22
+                    cursor.execute("SHOW SLAVE STATUS")
+                status = cursor.fetchone()
+                cursor.fetchall()
+            finally:
+                cursor.close()
+        # No status means the host is not a replica at all, e.g. a misconfigured primary
+        if status is None:
+            return None
+        io_running = status.get('Replica_IO_Running', status.get('Slave_IO_Running'))
+        sql_running = status.get('Replica_SQL_Running', status.get('Slave_SQL_Running'))
+        if io_running != 'Yes' or sql_running != 'Yes':
+            return None
+        lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+        return None if lag is None else int(lag)
+
+    def choose(self):
+        """Replica to send the next read to, or None to read from the primary"""
+        candidates = [replica for replica in self.replicas if replica.in_rotation]
+        if not candidates:
+            return None
+        if self.selection == 'least_latency':
+            return min(candidates, key=lambda replica: replica.latency_ms)
+        return candidates[next(self._turn) % len(candidates)]
+
+    def remove(self, replica, error):
+        """Take a replica that failed to hand out a connection out of rotation until its next check"""
+        replica.in_rotation = False
+        replica.last_error = str(error)
+        print(f"Replica {replica.name} taken out of rotation: {error}")
+
+    def stats(self):
+        return {
+            'selection': self.selection,
+            'max_lag_seconds': self.max_lag,
+            'replicas': [replica.stats() for replica in self.replicas]
+        }
+
+    def close(self):
+        """Stop checking and close every replica pool"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval + 5)
+        for replica in self.replicas:
+            replica.pool.close()
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from storage import STORAGE_ERRORS
+
+# Named MySQL lock so only one retention run is active across all processes
+LOCK_NAME = 'sri_lanka_bus_location_retention'
+
+
+class LocationRetentionJob:
+    """Rolls old GPS pings up into per-minute history and purges them in small batches.
+
+    bus_locations has foreign keys, which InnoDB does not allow on partitioned
+    tables, so old rows are removed by primary-key range instead of dropping
+    partitions. Each batch is its own short transaction touching only old rows,
+    so concurrent ingest inserts at the end of the table are never blocked.
+    """
+
+    def __init__(self, db, raw_days=None, history_days=None, batch_size=None, pause=None):
+        self.db = db
+        self.raw_days = raw_days or float(os.getenv('LOCATION_RAW_RETENTION_DAYS', 7))
+        self.history_days = history_days or float(os.getenv('LOCATION_HISTORY_RETENTION_DAYS', 365))
+        self.batch_size = batch_size or int(os.getenv('LOCATION_RETENTION_BATCH_SIZE', 5000))
+        # Seconds to sleep between batches to leave room for other queries
+        self.pause = pause if pause is not None else float(os.getenv('LOCATION_RETENTION_PAUSE', 0.2))
+
+    def _rollup_batch(self, cutoff):
+        """Fold the oldest batch of raw pings into history and delete them; returns rows removed"""
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                SELECT MAX(id) FROM (
+                    SELECT id FROM bus_locations WHERE timestamp < %s ORDER BY id LIMIT %s
+                ) oldest
+            """, (cutoff, self.batch_size))
+            last_id = cursor.fetchone()[0]
+            if last_id is None:
+                return 0
+
+            # Merge with minutes already rolled up by an earlier batch, weighting by sample count;
+            # samples is assigned last because MySQL evaluates the assignments left to right
+            cursor.execute("""
+                INSERT INTO bus_location_history
+                    (bus_id, minute, latitude, longitude, occupied_seats, delay_minutes, samples)
+                SELECT bus_id, DATE_FORMAT(timestamp, '%Y-%m-%d %H:%i:00') AS minute,
+                       AVG(latitude), AVG(longitude), MAX(occupied_seats), MAX(delay_minutes), COUNT(*)
+                FROM bus_locations
+                WHERE id <= %s AND timestamp < %s
+                GROUP BY bus_id, minute
+                ON DUPLICATE KEY UPDATE
+                    latitude = (latitude * samples + VALUES(latitude) * VALUES(samples)) / (samples + VALUES(samples)),
+                    longitude = (longitude * samples + VALUES(longitude) * VALUES(samples)) / (samples + VALUES(samples)),
+                    occupied_seats = GREATEST(occupied_seats, VALUES(occupied_seats)),
+                    delay_minutes = GREATEST(delay_minutes, VALUES(delay_minutes)),
+                    samples = samples + VALUES(samples)
+            """, (last_id, cutoff))
+
+            cursor.execute("DELETE FROM bus_locations WHERE id <= %s AND timestamp < %s", (last_id, cutoff))
+            return cursor.rowcount
+
+    def _purge_history_batch(self, cutoff):
+        with self.db.transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM bus_location_history WHERE minute < %s ORDER BY minute LIMIT %s",
+                (cutoff, self.batch_size)
+            )
+            return cursor.rowcount
+
+    def _drain(self, step, cutoff):
+        total = 0
+        while True:
+            removed = step(cutoff)
+            total += removed
+            if removed < self.batch_size:
+                return total
+            time.sleep(self.pause)
+
+    def run_once(self):
+        """Run one retention pass; returns row counts, or None if another run holds the lock"""
+        with self.db.named_lock(LOCK_NAME) as acquired:
+            if not acquired:
+                return None
+            started = time.monotonic()
+            now = datetime.now()
+            raw_removed = self._drain(self._rollup_batch, now - timedelta(days=self.raw_days))
+            history_removed = self._drain(self._purge_history_batch, now - timedelta(days=self.history_days))
+            return {
+                'raw_rows_rolled_up': raw_removed,
+                'history_rows_purged': history_removed,
+                'seconds': round(time.monotonic() - started, 2)
+            }
+
+if __name__ == '__main__':
+    import argparse
+
+    from storage import create_database
+
+    parser = argparse.ArgumentParser(description="Downsample and purge old bus location pings")
+    parser.add_argument('--loop', action='store_true', help='keep running every --interval minutes')
+    parser.add_argument('--interval', type=float, default=float(os.getenv('LOCATION_RETENTION_INTERVAL_MINUTES', 60)))
+    args = parser.parse_args()
+
+    db = create_database()
+    if db.backend != 'mysql':
+        # bus_location_history only exists in the MySQL schema; the other backends keep no ping history to trim
+        print(f"Location retention only runs on MySQL, nothing to do for the {db.backend} backend")
+        sys.exit(0)
+    if not db.connect():
+        print("Failed to connect to database")
+        sys.exit(1)
+
+    job = LocationRetentionJob(db)
+    while True:
+        try:
+            result = job.run_once()
+            print(result if result is not None else "Another retention run is in progress, skipping")
+        except STORAGE_ERRORS as e:
+            print(f"Error running location retention: {e}")
+            if not args.loop:
+                sys.exit(1)
+        if not args.loop:
+            break
+        time.sleep(args.interval * 60)
+
+    db.disconnect()
@@ -0,0 +1,62 @@
+import math
+from collections import defaultdict
+
+from geo import haversine_km, stop_position
+
+KM_PER_DEGREE_LAT = 111.32
+
+
+class StopSpatialIndex:
+    """Uniform lat/lng grid over stops for radius queries.
+
+    Cells are roughly cell_km on a side, so a radius query only measures the
+    stops in the handful of cells overlapping the search circle instead of
+    the whole national stop set.
+    """
+
+    def __init__(self, stops, cell_km=1.0):
+        self.cell_lat = cell_km / KM_PER_DEGREE_LAT
+        # Sri Lanka spans 6-10 degrees north, so one longitude cell width is close enough everywhere
+        self.cell_lng = cell_km / (KM_PER_DEGREE_LAT * math.cos(math.radians(8.0)))
+        self.cells = defaultdict(list)
+        self.size = 0
+
+        seen = set()
+        for stop in stops:
+            if stop['id'] in seen:
+                continue
+            seen.add(stop['id'])
+            lat, lng = stop_position(stop)
+            self.cells[self._cell(lat, lng)].append((lat, lng, stop))
+            self.size += 1
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_lat)), int(math.floor(lng / self.cell_lng))
+
+    def nearby(self, lat, lng, radius_km, limit=10):
+        """(distance_km, stop) pairs within radius_km, nearest first"""
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        lng_span = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = self._cell(lat - lat_span, lng - lng_span)
+        max_row, max_col = self._cell(lat + lat_span, lng + lng_span)
+
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self.cells):
+            # Very large radius: cheaper to walk the occupied cells than the empty grid
+            cells = [entries for (row, col), entries in self.cells.items()
+                     if min_row <= row <= max_row and min_col <= col <= max_col]
+        else:
+            cells = [self.cells.get((row, col), ())
+                     for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+
+        found = []
+        for entries in cells:
+            for stop_lat, stop_lng, stop in entries:
+                # Cheap bounding-box test before the trigonometry
+                if abs(stop_lat - lat) > lat_span or abs(stop_lng - lng) > lng_span:
+                    continue
+                distance = haversine_km(lat, lng, stop_lat, stop_lng)
+                if distance <= radius_km:
+                    found.append((distance, stop))
+
+        found.sort(key=lambda item: item[0])
+        return found[:limit]
@@ -0,0 +1,450 @@
+import math
+
+import catalog_changes
+from geo import haversine_km
+from spatial_index import KM_PER_DEGREE_LAT
+from storage import STORAGE_ERRORS, Storage, like_prefix
+
+
+class SQLStorage(Storage):
+    """Reads shared by the MySQL and SQLite backends.
+
+    Queries are written for mysql.connector: %s parameter markers, and
+    portable SQL otherwise. The SQLite backend's cursors take the same
+    markers, so a query differs between the two only where the dialects do;
+    those stay in the backends.
+    """
+
+    def read_cursor(self, dictionary=False):
+        """Cursor for reads that may be served by a replica; the primary unless a backend has replicas"""
+        return self.cursor(dictionary)
+
+    def get_catalog_changes(self, after=None, limit=catalog_changes.DEFAULT_PAGE_SIZE):
+        """Change rows after the (version, entity, entity_id) key with the current routes, stops and stop lists"""
+        if not self.pool:
+            return None
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                query = "SELECT entity, entity_id, version, deleted FROM catalog_changes"
+                params = ()
+                if after is not None:
+                    version, entity, entity_id = after
+                    query += """
+                        WHERE version > %s
+                           OR (version = %s AND (entity > %s OR (entity = %s AND entity_id > %s)))
+                    """
+                    params = (version, version, entity, entity, entity_id)
+                cursor.execute(query + " ORDER BY version, entity, entity_id LIMIT %s", params + (limit,))
+                changes = cursor.fetchall()
+
+                route_ids = tuple(c['entity_id'] for c in changes if c['entity'] == 'route' and not c['deleted'])
+                stop_ids = tuple(c['entity_id'] for c in changes if c['entity'] == 'stop' and not c['deleted'])
+                return {
+                    'changes': changes,
+                    'routes': self._select_in(cursor, "SELECT * FROM routes WHERE id IN ({})", route_ids),
+                    'stops': self._select_in(cursor, "SELECT * FROM stops WHERE id IN ({})", stop_ids),
+                    'route_stops': self._select_in(
+                        cursor, "SELECT route_id, stop_id, stop_order FROM route_stops WHERE route_id IN ({}) "
+                                "ORDER BY route_id, stop_order", route_ids)
+                }
+
+        except STORAGE_ERRORS as e:
+            print(f"Error reading catalog changes: {e}")
+            return None
+
+    def get_routes(self, origin=None, destination=None):
+        """Get routes from database with optional filtering"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                if origin and destination:
+                    # Resolve the names to stop ids on the small stops table first,
+                    # then find routes with an indexed join on route_stops
+                    origin_ids = self._match_stop_ids(cursor, origin)
+                    destination_ids = self._match_stop_ids(cursor, destination)
+                    routes = self._routes_between_stops(cursor, origin_ids, destination_ids)
+                    self._attach_route_children(cursor, routes)
+                    return routes
+
+                cursor.execute("SELECT * FROM routes ORDER BY id")
+                routes = cursor.fetchall()
+                self._attach_route_children(cursor, routes, all_routes=True)
+                return routes
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting routes: {e}")
+            return []
+
+    def get_routes_between_stops(self, origin_stop_ids, destination_stop_ids):
+        """Get routes that call at one of the origin stops before one of the destination stops"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                routes = self._routes_between_stops(cursor, list(origin_stop_ids), list(destination_stop_ids))
+                self._attach_route_children(cursor, routes)
+                return routes
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting routes between stops: {e}")
+            return []
+
+    def _match_stop_ids(self, cursor, name):
+        if not name.strip():
+            return []
+        # Prefix match so the stop name index is used; the case-insensitive collation folds case
+        cursor.execute("SELECT id FROM stops WHERE name LIKE %s ESCAPE '!'", (like_prefix(name.strip()),))
+        return [row['id'] for row in cursor.fetchall()]
+
+    def _routes_between_stops(self, cursor, origin_ids, destination_ids):
+        if not origin_ids or not destination_ids:
+            return []
+
+        query = f"""
+            SELECT DISTINCT r.* FROM route_stops rs1
+            JOIN route_stops rs2 ON rs2.route_id = rs1.route_id AND rs2.stop_order > rs1.stop_order
+            JOIN routes r ON r.id = rs1.route_id
+            WHERE rs1.stop_id IN ({', '.join(['%s'] * len(origin_ids))})
+            AND rs2.stop_id IN ({', '.join(['%s'] * len(destination_ids))})
+            ORDER BY r.id
+        """
+        cursor.execute(query, tuple(origin_ids) + tuple(destination_ids))
+        return cursor.fetchall()
+
+    def get_stops(self):
+        """Get every stop, or None if the database could not be read"""
+        if not self.pool:
+            return None
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT id, name, latitude, longitude FROM stops ORDER BY id")
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting stops: {e}")
+            return None
+
+    def get_stops_near(self, lat, lng, radius_km, limit=10):
+        """Stops within radius_km of a point, nearest first, with the routes serving each"""
+        if not self.pool:
+            return []
+
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        lng_span = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute("""
+                    SELECT id, name, latitude, longitude FROM stops
+                    WHERE latitude BETWEEN %s AND %s AND longitude BETWEEN %s AND %s
+                """, (lat - lat_span, lat + lat_span, lng - lng_span, lng + lng_span))
+                candidates = []
+                for stop in cursor.fetchall():
+                    distance = haversine_km(lat, lng, float(stop['latitude']), float(stop['longitude']))
+                    if distance <= radius_km:
+                        candidates.append((distance, stop))
+                candidates.sort(key=lambda item: item[0])
+                candidates = candidates[:limit]
+                if not candidates:
+                    return []
+
+                stop_ids = [stop['id'] for _, stop in candidates]
+                cursor.execute(f"""
+                    SELECT rs.stop_id, r.id, r.name, r.type
+                    FROM route_stops rs
+                    JOIN routes r ON r.id = rs.route_id
+                    WHERE rs.stop_id IN ({', '.join(['%s'] * len(stop_ids))})
+                    ORDER BY r.id
+                """, tuple(stop_ids))
+                routes = {}
+                for row in cursor.fetchall():
+                    routes.setdefault(row.pop('stop_id'), []).append(row)
+
+                return [{
+                    'id': stop['id'],
+                    'name': stop['name'],
+                    'lat': float(stop['latitude']),
+                    'lng': float(stop['longitude']),
+                    'distance': round(distance, 3),
+                    'routes': routes.get(stop['id'], [])
+                } for distance, stop in candidates]
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting nearby stops: {e}")
+            return []
+
+    def get_stop_aliases(self):
+        """Get alternative stop names in Sinhala, Tamil and English"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT stop_id, alias, language FROM stop_aliases")
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting stop aliases: {e}")
+            return []
+
+    def search_stops(self, prefix, limit=10):
+        """Stops whose name starts with prefix, using the stop name index"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute(
+                    "SELECT id, name, latitude, longitude FROM stops WHERE name LIKE %s ESCAPE '!' "
+                    "ORDER BY name LIMIT %s",
+                    (like_prefix(prefix), limit)
+                )
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error searching stops: {e}")
+            return []
+
+    def get_catalog(self):
+        """Load every route with its stops and coordinates, or None if the database could not be read"""
+        if not self.pool:
+            return None
+
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT * FROM routes ORDER BY id")
+                routes = cursor.fetchall()
+                self._attach_route_children(cursor, routes, all_routes=True)
+                return routes
+
+        except STORAGE_ERRORS as e:
+            print(f"Error loading route catalog: {e}")
+            return None
+
+    def get_routes_by_ids(self, route_ids):
+        """Get routes by primary key with their stops and coordinates, in the order requested"""
+        if not self.pool or not route_ids:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                ids = list(dict.fromkeys(route_ids))
+                routes = []
+                for i in range(0, len(ids), self.ROUTE_BATCH_SIZE):
+                    batch = ids[i:i + self.ROUTE_BATCH_SIZE]
+                    cursor.execute(
+                        f"SELECT * FROM routes WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                        tuple(batch)
+                    )
+                    routes.extend(cursor.fetchall())
+
+                self._attach_route_children(cursor, routes)
+                position = {route_id: i for i, route_id in enumerate(ids)}
+                routes.sort(key=lambda r: position.get(r['id'], len(ids)))
+                return routes
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting routes by id: {e}")
+            return []
+
+    def get_routes_page(self, after_id=None, limit=None, stops=True, shapes=True):
+        """Routes with id greater than after_id in id order, at most limit, with only the child rows asked for"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                # Keyset pagination on the primary key: every page is an index range scan
+                query = "SELECT * FROM routes"
+                params = []
+                if after_id is not None:
+                    query += " WHERE id > %s"
+                    params.append(after_id)
+                query += " ORDER BY id"
+                if limit is not None:
+                    query += " LIMIT %s"
+                    params.append(limit)
+                cursor.execute(query, tuple(params))
+                routes = cursor.fetchall()
+                self._attach_route_children(cursor, routes, all_routes=after_id is None and limit is None,
+                                            stops=stops, shapes=shapes)
+                return routes
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting routes page: {e}")
+            return []
+
+    # Maximum number of route ids per IN (...) list when loading child rows
+    ROUTE_BATCH_SIZE = 500
+
+    def _attach_route_children(self, cursor, routes, all_routes=False, stops=True, shapes=True):
+        """Load stops and/or coordinates with shapes for many routes with one query per table per batch"""
+        if not routes:
+            return
+
+        by_id = {}
+        for route in routes:
+            if stops:
+                route['stops'] = []
+            if shapes:
+                route['coordinates'] = []
+                route['shapes'] = {}
+            by_id[route['id']] = route
+
+        if all_routes:
+            batches = [None]
+        else:
+            ids = list(by_id)
+            batches = [ids[i:i + self.ROUTE_BATCH_SIZE] for i in range(0, len(ids), self.ROUTE_BATCH_SIZE)]
+
+        for batch in batches:
+            stops_where = coords_where = shapes_where = ''
+            params = ()
+            if batch is not None:
+                in_list = ', '.join(['%s'] * len(batch))
+                stops_where = f"WHERE rs.route_id IN ({in_list})"
+                coords_where = f"WHERE rc.route_id IN ({in_list})"
+                shapes_where = f"WHERE rsh.route_id IN ({in_list})"
+                params = tuple(batch)
+
+            if stops:
+                cursor.execute(f"""
+                    SELECT s.*, rs.stop_order as `order`, rs.route_id
+                    FROM route_stops rs
+                    JOIN stops s ON s.id = rs.stop_id
+                    {stops_where}
+                    ORDER BY rs.route_id, rs.stop_order
+                """, params)
+                for stop in cursor.fetchall():
+                    route = by_id.get(stop.pop('route_id'))
+                    if route is not None:
+                        route['stops'].append(stop)
+
+            if shapes:
+                cursor.execute(f"""
+                    SELECT rc.route_id, rc.latitude, rc.longitude
+                    FROM route_coordinates rc
+                    {coords_where}
+                    ORDER BY rc.route_id, rc.sequence_order
+                """, params)
+                for coord in cursor.fetchall():
+                    route = by_id.get(coord['route_id'])
+                    if route is not None:
+                        route['coordinates'].append([float(coord['latitude']), float(coord['longitude'])])
+
+                cursor.execute(f"""
+                    SELECT rsh.route_id, rsh.tolerance_m, rsh.polyline
+                    FROM route_shapes rsh
+                    {shapes_where}
+                """, params)
+                for shape in cursor.fetchall():
+                    route = by_id.get(shape['route_id'])
+                    if route is not None:
+                        route['shapes'][shape['tolerance_m']] = shape['polyline']
+
+    # Columns of the buses table copied between backends
+    BUS_COLUMNS = ('id', 'route_id', 'bus_number', 'vehicle_type', 'total_seats', 'status')
+
+    def get_buses(self):
+        """Every registered bus"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute(f"SELECT {', '.join(self.BUS_COLUMNS)} FROM buses ORDER BY id")
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting buses: {e}")
+            return []
+
+    def get_locations_after(self, sequence, limit=1000):
+        """(last id, pings) for up to limit pings stored after id sequence, oldest first, with
+        each bus's route. A sequence of None returns the newest id and no pings."""
+        if not self.pool:
+            return sequence, []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                if sequence is None:
+                    cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM bus_locations")
+                    return cursor.fetchone()['id'], []
+
+                cursor.execute("""
+                    SELECT bl.*, b.route_id
+                    FROM bus_locations bl
+                    JOIN buses b ON bl.bus_id = b.id
+                    WHERE bl.id > %s
+                    ORDER BY bl.id
+                    LIMIT %s
+                """, (sequence, limit))
+                rows = cursor.fetchall()
+                return (rows[-1]['id'] if rows else sequence), rows
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting new locations: {e}")
+            return sequence, []
+
+    def get_bus_routes(self):
+        """Map of bus id to route id"""
+        if not self.pool:
+            return {}
+
+        try:
+            with self.read_cursor() as cursor:
+                cursor.execute("SELECT id, route_id FROM buses")
+                return dict(cursor.fetchall())
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting bus routes: {e}")
+            return {}
+
+    def get_active_bus_positions(self, since):
+        """Latest position of every active bus that reported at or after since, with its route and seats"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                cursor.execute("""
+                    SELECT bcl.bus_id, bcl.latitude, bcl.longitude, bcl.occupied_seats,
+                           bcl.delay_minutes, bcl.timestamp, b.route_id, b.total_seats
+                    FROM bus_current_location bcl
+                    JOIN buses b ON bcl.bus_id = b.id
+                    WHERE bcl.timestamp >= %s AND b.status = 'active'
+                """, (since,))
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting active bus positions: {e}")
+            return []
+
+    def get_user_favorites(self, user_id):
+        """Get user's favorite routes"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.read_cursor(dictionary=True) as cursor:
+                query = """
+                    SELECT uf.*, r.name as route_name, r.origin, r.destination,
+                           s1.name as origin_stop_name, s2.name as destination_stop_name
+                    FROM user_favorites uf
+                    JOIN routes r ON uf.route_id = r.id
+                    LEFT JOIN stops s1 ON uf.origin_stop_id = s1.id
+                    LEFT JOIN stops s2 ON uf.destination_stop_id = s2.id
+                    WHERE uf.user_id = %s
+                    ORDER BY uf.created_at DESC
+                """
+
+                cursor.execute(query, (user_id,))
+                return cursor.fetchall()
+
+        except STORAGE_ERRORS as e:
+            print(f"Error getting user favorites: {e}")
+            return []
@@ -0,0 +1,761 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import catalog_changes
+import metrics
+from sql_storage import SQLStorage
+from storage import CATALOG_TABLES, StorageError
+
+# MySQL migration the schema below corresponds to; bump both together
+SCHEMA_VERSION = 9
+
+# The MySQL schema as of SCHEMA_VERSION, in SQLite types. ENUMs become CHECK
+# constraints and timestamps are local time like MySQL's NOW(). The location
+# history rollup table is left out because the retention job is MySQL only.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS routes (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        fare DECIMAL(10,2) NOT NULL,
+        duration INTEGER NOT NULL,
+        frequency INTEGER NOT NULL,
+        type TEXT DEFAULT 'regular' CHECK (type IN ('regular', 'express', 'ac', 'luxury', 'semi-luxury')),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        updated_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+
+    -- NOCASE matches MySQL's case-insensitive collation and lets LIKE 'prefix%' use the index
+    CREATE TABLE IF NOT EXISTS stops (
+        id TEXT PRIMARY KEY,
+        name TEXT NOT NULL COLLATE NOCASE,
+        latitude DECIMAL(10,8) NOT NULL,
+        longitude DECIMAL(11,8) NOT NULL,
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_stop_name ON stops (name);
+    CREATE INDEX IF NOT EXISTS idx_stop_position ON stops (latitude, longitude);
+
+    CREATE TABLE IF NOT EXISTS route_stops (
+        id INTEGER PRIMARY KEY,
+        route_id TEXT NOT NULL REFERENCES routes(id) ON DELETE CASCADE,
+        stop_id TEXT NOT NULL REFERENCES stops(id) ON DELETE CASCADE,
+        stop_order INTEGER NOT NULL,
+        UNIQUE (route_id, stop_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_route_order ON route_stops (route_id, stop_order);
+    CREATE INDEX IF NOT EXISTS idx_stop_route ON route_stops (stop_id, route_id, stop_order);
+
+    CREATE TABLE IF NOT EXISTS route_coordinates (
+        id INTEGER PRIMARY KEY,
+        route_id TEXT NOT NULL REFERENCES routes(id) ON DELETE CASCADE,
+        latitude DECIMAL(10,8) NOT NULL,
+        longitude DECIMAL(11,8) NOT NULL,
+        sequence_order INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_route_sequence ON route_coordinates (route_id, sequence_order);
+
+    CREATE TABLE IF NOT EXISTS route_shapes (
+        route_id TEXT NOT NULL REFERENCES routes(id) ON DELETE CASCADE,
+        tolerance_m INTEGER NOT NULL,
+        polyline TEXT NOT NULL,
+        point_count INTEGER NOT NULL,
+        PRIMARY KEY (route_id, tolerance_m)
+    );
+
+    CREATE TABLE IF NOT EXISTS stop_aliases (
+        id INTEGER PRIMARY KEY,
+        stop_id TEXT NOT NULL REFERENCES stops(id) ON DELETE CASCADE,
+        alias TEXT NOT NULL,
+        language TEXT NOT NULL DEFAULT 'en',
+        UNIQUE (stop_id, alias)
+    );
+
+    CREATE TABLE IF NOT EXISTS buses (
+        id TEXT PRIMARY KEY,
+        route_id TEXT NOT NULL REFERENCES routes(id) ON DELETE CASCADE,
+        bus_number TEXT NOT NULL,
+        vehicle_type TEXT DEFAULT 'regular' CHECK (vehicle_type IN ('regular', 'ac')),
+        total_seats INTEGER DEFAULT 50,
+        status TEXT DEFAULT 'active' CHECK (status IN ('active', 'inactive', 'maintenance')),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_bus_route ON buses (route_id);
+
+    CREATE TABLE IF NOT EXISTS bus_locations (
+        id INTEGER PRIMARY KEY,
+        bus_id TEXT NOT NULL REFERENCES buses(id) ON DELETE CASCADE,
+        latitude DECIMAL(10,8) NOT NULL,
+        longitude DECIMAL(11,8) NOT NULL,
+        current_stop_id TEXT REFERENCES stops(id),
+        next_stop_id TEXT REFERENCES stops(id),
+        occupied_seats INTEGER DEFAULT 0,
+        delay_minutes INTEGER DEFAULT 0,
+        delay_reason TEXT,
+        timestamp TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_bus_timestamp ON bus_locations (bus_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_location_timestamp ON bus_locations (timestamp);
+
+    CREATE TABLE IF NOT EXISTS bus_current_location (
+        bus_id TEXT PRIMARY KEY REFERENCES buses(id) ON DELETE CASCADE,
+        latitude DECIMAL(10,8) NOT NULL,
+        longitude DECIMAL(11,8) NOT NULL,
+        current_stop_id TEXT,
+        next_stop_id TEXT,
+        occupied_seats INTEGER DEFAULT 0,
+        delay_minutes INTEGER DEFAULT 0,
+        delay_reason TEXT,
+        timestamp TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_current_timestamp ON bus_current_location (timestamp);
+
+    CREATE TABLE IF NOT EXISTS bus_arrivals (
+        id INTEGER PRIMARY KEY,
+        bus_id TEXT NOT NULL REFERENCES buses(id) ON DELETE CASCADE,
+        stop_id TEXT NOT NULL REFERENCES stops(id) ON DELETE CASCADE,
+        estimated_arrival TIMESTAMP NOT NULL,
+        actual_arrival TIMESTAMP NULL,
+        delay_minutes INTEGER DEFAULT 0,
+        capacity_status TEXT DEFAULT 'available' CHECK (capacity_status IN ('available', 'moderate', 'full')),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        UNIQUE (bus_id, stop_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_stop_arrival ON bus_arrivals (stop_id, estimated_arrival);
+
+    CREATE TABLE IF NOT EXISTS user_favorites (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        route_id TEXT NOT NULL REFERENCES routes(id) ON DELETE CASCADE,
+        origin_stop_id TEXT REFERENCES stops(id),
+        destination_stop_id TEXT REFERENCES stops(id),
+        created_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        UNIQUE (user_id, route_id, origin_stop_id, destination_stop_id)
+    );
+
+    -- Writers are serialized by BEGIN IMMEDIATE, so versions need no separate counter
+    CREATE TABLE IF NOT EXISTS catalog_changes (
+        entity TEXT NOT NULL,
+        entity_id TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        deleted INTEGER NOT NULL DEFAULT 0,
+        changed_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        PRIMARY KEY (entity, entity_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_catalog_changes_version ON catalog_changes (version, entity, entity_id);
+    -- Catalog rows written before the change log existed are the first version
+    INSERT OR IGNORE INTO catalog_changes (entity, entity_id, version) SELECT 'route', id, 1 FROM routes;
+    INSERT OR IGNORE INTO catalog_changes (entity, entity_id, version) SELECT 'stop', id, 1 FROM stops;
+"""
+
+def _local_naive(value):
+    """Aware datetimes as naive local time, like a MySQL TIMESTAMP read back over the connection"""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+# Same Python types as mysql.connector returns for DECIMAL and TIMESTAMP columns
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: _local_naive(value).isoformat(' '))
+sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()))
+# Files written before timestamps were normalized may hold offsets
+sqlite3.register_converter('TIMESTAMP', lambda value: _local_naive(datetime.fromisoformat(value.decode())))
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class FormatCursor:
+    """sqlite3 cursor that also takes mysql.connector's %s parameter markers, for the queries in SQLStorage"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        return self._cursor.execute(query.replace('%s', '?'), params)
+
+    def executemany(self, query, rows):
+        return self._cursor.executemany(query.replace('%s', '?'), rows)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class SQLitePool:
+    """Thread-safe pool of connections to one SQLite database file"""
+
+    def __init__(self, path, read_only=False, size=5, timeout=10):
+        self.path = path
+        self.read_only = read_only
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.timeouts = 0
+
+    def _open(self):
+        uri = Path(self.path).resolve().as_uri() + ('?mode=ro' if self.read_only else '')
+        connection = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                                     detect_types=sqlite3.PARSE_DECLTYPES, isolation_level=None)
+        connection.execute("PRAGMA foreign_keys = ON")
+        if not self.read_only:
+            # WAL lets readers carry on while a writer holds the database
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def acquire(self):
+        """Borrow a connection, opening a new one if the pool is not yet full"""
+        if self._closed:
+            raise sqlite3.OperationalError("Connection pool is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            try:
+                return self._open()
+            except sqlite3.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self.timeouts += 1
+            raise sqlite3.OperationalError(
+                f"No SQLite connection became available within {self.timeout}s"
+            ) from None
+
+    def release(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """Pool size and how many connections are idle or in use"""
+        idle = self._idle.qsize()
+        return {
+            'size': self.size, 'open': self._created, 'idle': idle,
+            'in_use': self._created - idle, 'timeouts': self.timeouts
+        }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class SQLiteDatabaseManager(SQLStorage):
+    """Storage backend on a single SQLite file.
+
+    Suited to development without a MySQL host, and to edge nodes serving a
+    read-only copy of the catalog: fill the file with
+    'python storage.py --from mysql --to sqlite' and start the API with
+    STORAGE_BACKEND=sqlite and STORAGE_READ_ONLY=true.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, read_only=None, path=None):
+        super().__init__(read_only)
+        self.path = path or os.getenv('SQLITE_PATH', os.path.join(os.path.dirname(__file__), 'sri_lanka_bus.db'))
+        self.pool_size = int(os.getenv('SQLITE_POOL_SIZE', 5))
+        # Seconds to wait for a pooled connection, and for another writer to finish
+        self.pool_timeout = float(os.getenv('SQLITE_TIMEOUT', 10))
+
+    def connect(self):
+        """Open the database file and verify it can be read"""
+        if self.pool:
+            return True
+        pool = SQLitePool(self.path, self.read_only, size=self.pool_size, timeout=self.pool_timeout)
+        try:
+            with pool.connection() as connection:
+                connection.execute("SELECT 1").fetchone()
+            print(f"Successfully opened SQLite database {self.path}{' (read-only)' if self.read_only else ''}")
+            self.pool = pool
+            return True
+        except sqlite3.Error as e:
+            print(f"Error opening SQLite database {self.path}: {e}")
+            pool.close()
+            return False
+
+    def disconnect(self):
+        """Close all pooled database connections"""
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+            print("SQLite connection pool closed")
+
+    def is_connected(self):
+        if not self.pool:
+            return False
+        try:
+            with self.pool.connection() as connection:
+                connection.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    @contextmanager
+    def cursor(self, dictionary=False):
+        """Borrow a pooled connection and yield a cursor on it"""
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            if dictionary:
+                cursor.row_factory = _dict_row
+            cursor = metrics.wrap_cursor(FormatCursor(cursor), self.backend)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def transaction(self, dictionary=False):
+        """Yield a cursor inside a write transaction that commits on success and rolls back on error"""
+        with self.pool.connection() as connection:
+            # Take the write lock up front instead of failing on the first write
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.cursor()
+            if dictionary:
+                cursor.row_factory = _dict_row
+            cursor = metrics.wrap_cursor(FormatCursor(cursor), self.backend)
+            try:
+                yield cursor
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def named_lock(self, name):
+        """Yield whether an advisory file lock next to the database was taken, without waiting"""
+        if fcntl is None:
+            with super().named_lock(name) as acquired:
+                yield acquired
+            return
+
+        with open(f"{self.path}.{name}.lock", 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_schema_version(self):
+        """Return the schema version recorded in the database file, or None if unreadable"""
+        if not self.pool:
+            return None
+
+        try:
+            with self.cursor() as cursor:
+                cursor.execute("PRAGMA user_version")
+                return cursor.fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error reading schema version: {e}")
+            return None
+
+    def ensure_schema(self, auto_migrate=None):
+        """Create the tables if the file is older than SCHEMA_VERSION"""
+        if auto_migrate is None:
+            auto_migrate = os.getenv('AUTO_MIGRATE', 'true').lower() == 'true'
+
+        version = self.get_schema_version()
+        if version is None:
+            return False
+        if version >= SCHEMA_VERSION:
+            return True
+        if self.read_only or not auto_migrate:
+            print(f"SQLite schema is at version {version}, expected {SCHEMA_VERSION}")
+            return False
+
+        try:
+            with self.pool.connection() as connection:
+                connection.executescript(SCHEMA)
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            print(f"SQLite schema is at version {SCHEMA_VERSION}")
+            return True
+        except sqlite3.Error as e:
+            print(f"Error creating SQLite schema: {e}")
+            return False
+
+    def write_catalog_rows(self, routes, stops, route_stops, coordinates, shapes):
+        """Upsert routes and stops and replace the children of those routes in one transaction"""
+        if not self._writable():
+            raise StorageError(f"SQLite database {self.path} is not open for writing")
+
+        route_ids = tuple(row[0] for row in routes)
+        try:
+            with self.transaction() as cursor:
+                # Compare with the stored rows first so unchanged routes and stops stay out of the change log
+                changed_routes, changed_stops = catalog_changes.changed_ids(
+                    routes, stops, route_stops,
+                    self._select_in(cursor, "SELECT id, name, origin, destination, fare, duration, frequency, type "
+                                            "FROM routes WHERE id IN ({})", route_ids),
+                    self._select_in(cursor, "SELECT id, name, latitude, longitude FROM stops WHERE id IN ({})",
+                                    tuple(dict.fromkeys(row[0] for row in stops))),
+                    self._select_in(cursor, "SELECT route_id, stop_id, stop_order FROM route_stops "
+                                            "WHERE route_id IN ({})", route_ids)
+                )
+
+                cursor.executemany("""
+                    INSERT INTO routes (id, name, origin, destination, fare, duration, frequency, type)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                    name = excluded.name, origin = excluded.origin, destination = excluded.destination,
+                    fare = excluded.fare, duration = excluded.duration, frequency = excluded.frequency,
+                    type = excluded.type, updated_at = datetime('now', 'localtime')
+                """, routes)
+                cursor.executemany("""
+                    INSERT INTO stops (id, name, latitude, longitude)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                    name = excluded.name, latitude = excluded.latitude, longitude = excluded.longitude
+                """, stops)
+
+                # Children are replaced wholesale so re-importing a route never leaves stale rows
+                for i in range(0, len(route_ids), self.ROUTE_BATCH_SIZE):
+                    batch = route_ids[i:i + self.ROUTE_BATCH_SIZE]
+                    for table in ('route_stops', 'route_coordinates', 'route_shapes'):
+                        cursor.execute(f"DELETE FROM {table} WHERE route_id IN ({', '.join(['?'] * len(batch))})", batch)
+
+                cursor.executemany("""
+                    INSERT INTO route_stops (route_id, stop_id, stop_order)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (route_id, stop_id) DO UPDATE SET stop_order = excluded.stop_order
+                """, route_stops)
+                cursor.executemany("""
+                    INSERT INTO route_coordinates (route_id, latitude, longitude, sequence_order)
+                    VALUES (?, ?, ?, ?)
+                """, coordinates)
+                cursor.executemany("""
+                    INSERT INTO route_shapes (route_id, tolerance_m, polyline, point_count)
+                    VALUES (?, ?, ?, ?)
+                """, shapes)
+                self._record_catalog_changes(cursor, changed_routes, changed_stops)
+
+        except sqlite3.Error as e:
+            raise StorageError(e) from e
+
+    def _select_in(self, cursor, query, ids):
+        """Rows of query for ids, filling its IN ({}) list in chunks of ROUTE_BATCH_SIZE"""
+        rows = []
+        for i in range(0, len(ids), self.ROUTE_BATCH_SIZE):
+            batch = ids[i:i + self.ROUTE_BATCH_SIZE]
+            cursor.execute(query.format(', '.join(['?'] * len(batch))), batch)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def _record_catalog_changes(self, cursor, route_ids, stop_ids, deleted=False):
+        """Log routes and stops changed (or deleted) by the current transaction under a new catalog version"""
+        if not route_ids and not stop_ids:
+            return
+        cursor.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM catalog_changes")
+        version = cursor.fetchone()[0]
+        cursor.executemany("""
+            INSERT INTO catalog_changes (entity, entity_id, version, deleted)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (entity, entity_id) DO UPDATE SET
+            version = excluded.version, deleted = excluded.deleted, changed_at = datetime('now', 'localtime')
+        """, [('route', route_id, version, deleted) for route_id in route_ids]
+              + [('stop', stop_id, version, deleted) for stop_id in stop_ids])
+
+    def iter_catalog_rows(self, table, batch_size=1000):
+        """Stream a catalog table in key order; SQLite steps through the result as rows are fetched"""
+        columns, order = CATALOG_TABLES[table]
+        if not self.pool:
+            raise StorageError(f"SQLite database {self.path} is not open")
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order}")
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+        except sqlite3.Error as e:
+            raise StorageError(f"Error reading {table}: {e}") from e
+
+    def upsert_stop_aliases(self, aliases):
+        """Insert or update stop aliases given as {stop_id, alias, language} rows"""
+        if not self._writable():
+            return False
+
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany("""
+                    INSERT INTO stop_aliases (stop_id, alias, language)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (stop_id, alias) DO UPDATE SET language = excluded.language
+                """, [(row['stop_id'], row['alias'], row['language']) for row in aliases])
+                # Aliases are part of the served catalog, so they move its version too
+                self._record_catalog_changes(cursor, (), dict.fromkeys(row['stop_id'] for row in aliases))
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error writing stop aliases: {e}")
+            return False
+
+    def get_catalog_version(self):
+        """Latest catalog change version, or None if the database could not be read"""
+        if not self.pool:
+            return None
+
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM catalog_changes")
+                return cursor.fetchone()
+
+        except sqlite3.Error as e:
+            print(f"Error reading catalog version: {e}")
+            return None
+
+    def upsert_buses(self, buses):
+        """Insert or update buses given as rows with BUS_COLUMNS"""
+        if not self._writable():
+            return False
+
+        columns = ', '.join(self.BUS_COLUMNS)
+        placeholders = ', '.join(['?'] * len(self.BUS_COLUMNS))
+        updates = ', '.join(f"{c} = excluded.{c}" for c in self.BUS_COLUMNS if c != 'id')
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany(f"""
+                    INSERT INTO buses ({columns}) VALUES ({placeholders})
+                    ON CONFLICT (id) DO UPDATE SET {updates}
+                """, [tuple(bus.get(c) for c in self.BUS_COLUMNS) for bus in buses])
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error writing buses: {e}")
+            return False
+
+    def update_bus_location(self, bus_id, latitude, longitude, current_stop_id=None,
+                            next_stop_id=None, occupied_seats=0, delay_minutes=0, delay_reason=None):
+        """Update bus location and status"""
+        if not self._writable():
+            return False
+
+        location = {
+            'bus_id': bus_id, 'latitude': latitude, 'longitude': longitude,
+            'current_stop_id': current_stop_id, 'next_stop_id': next_stop_id,
+            'occupied_seats': occupied_seats, 'delay_minutes': delay_minutes,
+            'delay_reason': delay_reason, 'timestamp': datetime.now()
+        }
+        try:
+            with self.transaction() as cursor:
+                self._write_locations(cursor, [location])
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error updating bus location: {e}")
+            return False
+
+    LOCATION_COLUMNS = ('bus_id', 'latitude', 'longitude', 'current_stop_id', 'next_stop_id',
+                        'occupied_seats', 'delay_minutes', 'delay_reason', 'timestamp')
+
+    def insert_bus_locations(self, locations):
+        """Insert many location pings in one transaction"""
+        if not self._writable():
+            return False
+        if not locations:
+            return True
+
+        try:
+            with self.transaction() as cursor:
+                # SQLite's OR IGNORE does not cover foreign keys, so pings for unknown buses
+                # or stops are dropped here, as INSERT IGNORE does on MySQL
+                self._write_locations(cursor, self._known_locations(cursor, locations))
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error inserting bus locations: {e}")
+            return False
+
+    def _existing_ids(self, cursor, table, ids):
+        ids = list(ids)
+        found = set()
+        for i in range(0, len(ids), self.ROUTE_BATCH_SIZE):
+            batch = ids[i:i + self.ROUTE_BATCH_SIZE]
+            cursor.execute(f"SELECT id FROM {table} WHERE id IN ({', '.join(['?'] * len(batch))})", batch)
+            found.update(row[0] for row in cursor.fetchall())
+        return found
+
+    def _known_locations(self, cursor, locations):
+        buses = self._existing_ids(cursor, 'buses', {location['bus_id'] for location in locations})
+        stops = self._existing_ids(cursor, 'stops', {
+            location.get(c) for location in locations for c in ('current_stop_id', 'next_stop_id')
+        } - {None})
+        return [
+            location for location in locations
+            if location['bus_id'] in buses
+            and all(location.get(c) is None or location.get(c) in stops for c in ('current_stop_id', 'next_stop_id'))
+        ]
+
+    def _write_locations(self, cursor, locations):
+        """Append pings to the history and upsert each bus's latest position"""
+        columns = ', '.join(self.LOCATION_COLUMNS)
+        placeholders = ', '.join(['?'] * len(self.LOCATION_COLUMNS))
+
+        cursor.executemany(f"""
+            INSERT INTO bus_locations ({columns})
+            VALUES ({placeholders})
+        """, [tuple(location.get(c) for c in self.LOCATION_COLUMNS) for location in locations])
+
+        latest = {}
+        for location in locations:
+            current = latest.get(location['bus_id'])
+            if current is None or location['timestamp'] >= current['timestamp']:
+                latest[location['bus_id']] = location
+
+        # Out-of-order pings must not overwrite a newer position; unlike MySQL, SQLite
+        # evaluates every assignment against the row as it was before the update
+        updates = ', '.join(
+            f"{c} = CASE WHEN excluded.timestamp >= timestamp THEN excluded.{c} ELSE {c} END"
+            for c in self.LOCATION_COLUMNS if c not in ('bus_id', 'timestamp')
+        )
+        cursor.executemany(f"""
+            INSERT INTO bus_current_location ({columns})
+            VALUES ({placeholders})
+            ON CONFLICT (bus_id) DO UPDATE SET {updates}, timestamp = MAX(timestamp, excluded.timestamp)
+        """, [tuple(location.get(c) for c in self.LOCATION_COLUMNS) for location in latest.values()])
+
+    def get_live_buses(self, route_id=None):
+        """Get the latest position of every bus that reported in the last 5 minutes"""
+        if not self.pool:
+            return []
+
+        query = """
+            SELECT bcl.*, b.route_id, b.bus_number, b.vehicle_type, b.total_seats,
+                   s1.name as current_stop_name, s2.name as next_stop_name
+            FROM bus_current_location bcl
+            JOIN buses b ON bcl.bus_id = b.id
+            LEFT JOIN stops s1 ON bcl.current_stop_id = s1.id
+            LEFT JOIN stops s2 ON bcl.next_stop_id = s2.id
+            WHERE bcl.timestamp >= ?
+        """
+        params = [datetime.now() - timedelta(minutes=5)]
+        if route_id:
+            query += " AND b.route_id = ?"
+            params.append(route_id)
+        query += " ORDER BY bcl.timestamp DESC"
+
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute(query, params)
+                return cursor.fetchall()
+
+        except sqlite3.Error as e:
+            print(f"Error getting live buses: {e}")
+            return []
+
+    def upsert_bus_arrivals(self, arrivals):
+        """Insert or update predictions given as (bus_id, stop_id, estimated, actual, delay, capacity) tuples"""
+        if not self._writable():
+            return False
+
+        # A recorded actual arrival is kept until a new trip predicts the stop again
+        query = """
+            INSERT INTO bus_arrivals
+                (bus_id, stop_id, estimated_arrival, actual_arrival, delay_minutes, capacity_status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bus_id, stop_id) DO UPDATE SET
+                estimated_arrival = CASE WHEN excluded.actual_arrival IS NULL OR actual_arrival IS NULL
+                                         THEN excluded.estimated_arrival ELSE estimated_arrival END,
+                delay_minutes = excluded.delay_minutes,
+                capacity_status = excluded.capacity_status,
+                actual_arrival = CASE WHEN excluded.actual_arrival IS NULL THEN NULL
+                                      ELSE COALESCE(actual_arrival, excluded.actual_arrival) END
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany(query, arrivals)
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error writing bus arrivals: {e}")
+            return False
+
+    def get_bus_arrivals(self, stop_id, limit=10):
+        """Get upcoming bus arrivals for a stop"""
+        if not self.pool:
+            return []
+
+        try:
+            with self.cursor(dictionary=True) as cursor:
+                cursor.execute("""
+                    SELECT ba.*, b.bus_number, b.vehicle_type, b.total_seats, r.name as route_name
+                    FROM bus_arrivals ba
+                    JOIN buses b ON ba.bus_id = b.id
+                    JOIN routes r ON b.route_id = r.id
+                    WHERE ba.stop_id = ?
+                    AND ba.estimated_arrival >= ?
+                    AND ba.actual_arrival IS NULL
+                    ORDER BY ba.estimated_arrival
+                    LIMIT ?
+                """, (stop_id, datetime.now(), limit))
+                return cursor.fetchall()
+
+        except sqlite3.Error as e:
+            print(f"Error getting bus arrivals: {e}")
+            return []
+
+    def add_user_favorite(self, user_id, route_id, origin_stop_id=None, destination_stop_id=None):
+        """Add a route to user favorites"""
+        if not self._writable():
+            return False
+
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("""
+                    INSERT INTO user_favorites (user_id, route_id, origin_stop_id, destination_stop_id)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (user_id, route_id, origin_stop_id, destination_stop_id)
+                    DO UPDATE SET created_at = datetime('now', 'localtime')
+                """, (user_id, route_id, origin_stop_id, destination_stop_id))
+            return True
+
+        except sqlite3.Error as e:
+            print(f"Error adding user favorite: {e}")
+            return False
@@ -0,0 +1,185 @@
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+from geo import stop_position
+
+# Zero-width joiners are part of some Sinhala spellings but never typed consistently
+ZERO_WIDTH = dict.fromkeys(map(ord, '\u200b\u200c\u200d\ufeff'))
+
+# Ranking of match kinds, best first
+EXACT, PREFIX, TOKEN_PREFIX, SUBSTRING, FUZZY = range(5)
+
+# Minimum trigram similarity for a fuzzy (typo-tolerant) match
+FUZZY_THRESHOLD = 0.45
+
+
+def fold_name(name):
+    """Case- and diacritic-folded key for stop names and queries.
+
+    Accents are stripped from Latin letters only; Sinhala and Tamil vowel
+    signs are combining marks too, but removing them would change the word.
+    """
+    name = unicodedata.normalize('NFKD', (name or '').translate(ZERO_WIDTH))
+    folded = []
+    for char in name:
+        if unicodedata.combining(char) and folded and folded[-1] < '\u0250':
+            continue
+        folded.append(char)
+    name = unicodedata.normalize('NFC', ''.join(folded)).casefold()
+    return re.sub(r'[\s\-_/,.()]+', ' ', name).strip()
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StopNameIndex:
+    """In-memory index over stop names and their aliases.
+
+    Supports exact, prefix and per-word prefix lookups through sorted key
+    lists, substring lookups through a trigram posting index, and typo
+    tolerant lookups by trigram similarity.
+    """
+
+    def __init__(self, stops, aliases=(), place_aliases=None):
+        self.stops = {}
+        # Each entry is (folded key, stop id, label, language)
+        self.entries = []
+        self.exact = defaultdict(list)
+        self.keys = []
+        self.tokens = []
+        self.postings = defaultdict(set)
+
+        for stop in stops:
+            if stop['id'] in self.stops:
+                continue
+            self.stops[stop['id']] = stop
+            self._add(stop['id'], stop['name'], 'en')
+
+        for alias in aliases:
+            if alias['stop_id'] in self.stops:
+                self._add(alias['stop_id'], alias['alias'], alias.get('language') or 'en')
+
+        if place_aliases:
+            self._add_place_aliases(place_aliases)
+
+        self.keys.sort()
+        self.tokens.sort()
+
+    def _add(self, stop_id, label, language):
+        key = fold_name(label)
+        if not key:
+            return
+        entry = len(self.entries)
+        self.entries.append((key, stop_id, label, language))
+        self.exact[key].append(entry)
+        self.keys.append((key, entry))
+        for token in key.split(' ')[1:]:
+            self.tokens.append((token, entry))
+        for gram in trigrams(key):
+            self.postings[gram].add(entry)
+
+    def _add_place_aliases(self, place_aliases):
+        """Attach town-level aliases to every stop whose name contains the town as a word"""
+        by_token = defaultdict(list)
+        for stop_id, stop in self.stops.items():
+            for token in fold_name(stop['name']).split(' '):
+                by_token[token].append(stop_id)
+
+        for place, languages in place_aliases.items():
+            place_key = fold_name(place)
+            if ' ' in place_key:
+                stop_ids = [s for s, stop in self.stops.items() if place_key in fold_name(stop['name'])]
+            else:
+                stop_ids = by_token.get(place_key, [])
+            for language, names in languages.items():
+                for name in names:
+                    for stop_id in stop_ids:
+                        self._add(stop_id, name, language)
+
+    def _prefix_entries(self, sorted_keys, prefix):
+        start = bisect.bisect_left(sorted_keys, (prefix,))
+        for key, entry in sorted_keys[start:]:
+            if not key.startswith(prefix):
+                break
+            yield entry
+
+    def _candidates(self, key):
+        """Map entry -> (match kind, similarity) for a folded query"""
+        found = {}
+
+        def add(entries, kind, similarity=1.0):
+            for entry in entries:
+                if entry not in found or found[entry][0] > kind:
+                    found[entry] = (kind, similarity)
+
+        add(self.exact.get(key, ()), EXACT)
+        add(self._prefix_entries(self.keys, key), PREFIX)
+        add(self._prefix_entries(self.tokens, key), TOKEN_PREFIX)
+
+        grams = trigrams(key)
+        if len(key) >= 3:
+            # Every unpadded trigram of the query occurs in any key that contains it
+            inner = {key[i:i + 3] for i in range(len(key) - 2)}
+            postings = sorted((self.postings.get(g, set()) for g in inner), key=len)
+            if postings[0]:
+                matches = set.intersection(*postings)
+                add((e for e in matches if key in self.entries[e][0]), SUBSTRING)
+
+        if not found:
+            counts = defaultdict(int)
+            for gram in grams:
+                for entry in self.postings.get(gram, ()):
+                    counts[entry] += 1
+            for entry, shared in counts.items():
+                other = trigrams(self.entries[entry][0])
+                similarity = shared / (len(grams) + len(other) - shared)
+                if similarity >= FUZZY_THRESHOLD:
+                    add((entry,), FUZZY, similarity)
+
+        return found
+
+    def search(self, query, limit=10):
+        """Ranked autocomplete results, one per stop"""
+        key = fold_name(query)
+        if not key:
+            return []
+
+        best = {}
+        for entry, (kind, similarity) in self._candidates(key).items():
+            entry_key, stop_id, label, language = self.entries[entry]
+            rank = (kind, -similarity, len(entry_key), entry_key)
+            if stop_id not in best or rank < best[stop_id][0]:
+                best[stop_id] = (rank, label, language, kind, similarity)
+
+        results = []
+        for stop_id, (rank, label, language, kind, similarity) in sorted(best.items(), key=lambda item: item[1][0])[:limit]:
+            stop = self.stops[stop_id]
+            lat, lng = stop_position(stop)
+            results.append({
+                'id': stop_id,
+                'name': stop['name'],
+                'lat': lat,
+                'lng': lng,
+                'matched': label,
+                'language': language,
+                'match': ('exact', 'prefix', 'word_prefix', 'substring', 'fuzzy')[kind],
+                'score': round(similarity, 3)
+            })
+        return results
+
+    def resolve(self, query):
+        """Stop ids a free-text origin/destination refers to.
+
+        Exact, prefix and substring matches are all returned, like the old
+        LIKE '%query%' search; typo-tolerant matches are only used when
+        nothing else matches.
+        """
+        key = fold_name(query)
+        if not key:
+            return set()
+        found = self._candidates(key)
+        return {self.entries[entry][1] for entry in found}
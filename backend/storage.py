@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+from mysql.connector import Error as MySQLError
+
+# Values accepted by STORAGE_BACKEND
+STORAGE_BACKENDS = ('mysql', 'sqlite', 'memory')
+
+# Catalog tables iter_catalog_rows() streams: the columns it returns and the key order
+CATALOG_TABLES = {
+    'routes': (('id', 'name', 'origin', 'destination', 'fare', 'duration', 'frequency', 'type'), 'id'),
+    'stops': (('id', 'name', 'latitude', 'longitude'), 'id'),
+    'route_stops': (('route_id', 'stop_id', 'stop_order'), 'route_id, stop_order'),
+    'route_coordinates': (('route_id', 'latitude', 'longitude', 'sequence_order'), 'route_id, sequence_order'),
+}
+
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with text, for LIKE ... ESCAPE '!'.
+
+    '!' rather than MySQL's default backslash, which SQLite has no default for
+    and which would need escaping differently in each dialect's string literals.
+    """
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_') + '%'
+
+
+def capacity_status(occupied, total):
+    """bus_arrivals.capacity_status bucket of a bus's load, also shown for live buses"""
+    if not total or occupied is None:
+        return 'available'
+    load = occupied / total
+    if load < 0.7:
+        return 'available'
+    return 'moderate' if load < 0.9 else 'full'
+
+
+class StorageError(Exception):
+    """A backend failed to write; raised by write_catalog_rows so importers can count failed batches"""
+
+
+# What any backend may raise from the calls that do raise (named_lock, iter_catalog_rows,
+# write_catalog_rows), for background loops that must survive a database outage
+STORAGE_ERRORS = (StorageError, MySQLError, sqlite3.Error)
+
+
+class Storage:
+    """Interface shared by the MySQL, SQLite and in-memory storage backends.
+
+    Every method has the contract DatabaseManager established: reads return
+    mysql.connector-style dictionary rows (an empty list when the backend is
+    unavailable, None where noted), writes return True or False and never
+    raise. Backends opened read-only refuse writes the same way.
+    """
+
+    backend = None
+
+    def __init__(self, read_only=None):
+        if read_only is None:
+            read_only = os.getenv('STORAGE_READ_ONLY', 'false').lower() == 'true'
+        self.read_only = read_only
+        # Truthy once connect() succeeded; its stats() reports connection usage
+        self.pool = None
+        # Read replica router; only the MySQL backend reads from replicas
+        self.replicas = None
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _writable(self):
+        return bool(self.pool) and not self.read_only
+
+    # Connection management
+    def connect(self):
+        raise NotImplementedError
+
+    def disconnect(self):
+        raise NotImplementedError
+
+    def is_connected(self):
+        raise NotImplementedError
+
+    def get_schema_version(self):
+        raise NotImplementedError
+
+    def ensure_schema(self, auto_migrate=None):
+        raise NotImplementedError
+
+    def create_tables(self):
+        return self.ensure_schema(auto_migrate=True)
+
+    @contextmanager
+    def named_lock(self, name):
+        """Yield whether a lock shared by every process using this storage was taken, without waiting"""
+        # Single-process backends only need a lock per name within the process
+        with self._locks_guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+    def set_client(self, client_id):
+        """Tag the calls made by this thread with the client they serve; used by backends with read replicas"""
+
+    # Route catalog
+    def write_catalog_rows(self, routes, stops, route_stops, coordinates, shapes):
+        """Upsert routes and stops and replace the stop lists, coordinates and shapes of those routes.
+
+        Rows are tuples in the column order of the routes, stops, route_stops,
+        route_coordinates and route_shapes tables (without surrogate ids).
+        Written atomically; raises StorageError on failure.
+        """
+        raise NotImplementedError
+
+    def insert_route(self, route_data):
+        """Insert a new route into the database"""
+        return self.import_route(route_data)['routes'] == 1
+
+    def import_route(self, route_data):
+        """Insert or replace one route through CatalogImporter and return its counts.
+
+        A route that fails validation is counted as skipped, with the reason in
+        counts['errors']; a failed write is counted in failed_batches.
+        """
+        from catalog_import import CatalogImporter
+
+        return CatalogImporter(self).run([route_data])
+
+    def get_catalog(self):
+        raise NotImplementedError
+
+    def iter_catalog_rows(self, table, batch_size=1000):
+        """Stream every row of a CATALOG_TABLES table in key order, fetching batch_size rows at a time.
+
+        Only the rows of the current batch are held in memory, so whole tables
+        can be exported. Unlike the other reads this raises StorageError when
+        the table cannot be read, since a cut-off stream looks like a short table.
+        """
+        raise NotImplementedError
+
+    def get_catalog_changes(self, after=None, limit=1000):
+        """Change log rows after a (version, entity, entity_id) key, in that order, at most limit.
+
+        Returns {'changes', 'routes', 'stops', 'route_stops'}: the change rows
+        ({entity, entity_id, version, deleted}), then the current rows of the
+        routes and stops among them that still exist and those routes' stop
+        lists. None if the change log could not be read.
+        """
+        raise NotImplementedError
+
+    def get_catalog_version(self):
+        """{'version': latest catalog change version}, or None if unavailable.
+
+        The version grows with every write that changes a route, stop or stop alias.
+        """
+        raise NotImplementedError
+
+    def get_routes(self, origin=None, destination=None):
+        raise NotImplementedError
+
+    def get_routes_between_stops(self, origin_stop_ids, destination_stop_ids):
+        raise NotImplementedError
+
+    def get_route(self, route_id):
+        """Get a single route with its stops and coordinates, or None if it does not exist"""
+        routes = self.get_routes_by_ids([route_id])
+        return routes[0] if routes else None
+
+    def get_routes_by_ids(self, route_ids):
+        raise NotImplementedError
+
+    def get_routes_page(self, after_id=None, limit=None, stops=True, shapes=True):
+        """Routes with id greater than after_id in id order, at most limit (None for all).
+
+        stops=False leaves out the stops list and shapes=False the coordinates
+        and shapes, without reading them.
+        """
+        raise NotImplementedError
+
+    def get_stops(self):
+        raise NotImplementedError
+
+    def get_stops_near(self, lat, lng, radius_km, limit=10):
+        raise NotImplementedError
+
+    def get_stop_aliases(self):
+        raise NotImplementedError
+
+    def upsert_stop_aliases(self, aliases):
+        raise NotImplementedError
+
+    def search_stops(self, prefix, limit=10):
+        raise NotImplementedError
+
+    # Fleet and live tracking
+    def get_buses(self):
+        raise NotImplementedError
+
+    def upsert_buses(self, buses):
+        raise NotImplementedError
+
+    def update_bus_location(self, bus_id, latitude, longitude, current_stop_id=None,
+                            next_stop_id=None, occupied_seats=0, delay_minutes=0, delay_reason=None):
+        raise NotImplementedError
+
+    def insert_bus_locations(self, locations):
+        raise NotImplementedError
+
+    def get_live_buses(self, route_id=None):
+        raise NotImplementedError
+
+    def get_locations_after(self, sequence, limit=1000):
+        raise NotImplementedError
+
+    def get_bus_routes(self):
+        raise NotImplementedError
+
+    def get_active_bus_positions(self, since):
+        raise NotImplementedError
+
+    def upsert_bus_arrivals(self, arrivals):
+        raise NotImplementedError
+
+    def get_bus_arrivals(self, stop_id, limit=10):
+        raise NotImplementedError
+
+    # User features
+    def add_user_favorite(self, user_id, route_id, origin_stop_id=None, destination_stop_id=None):
+        raise NotImplementedError
+
+    def get_user_favorites(self, user_id):
+        raise NotImplementedError
+
+
+# Public Storage methods; metrics.instrument_storage() times each call. Generators
+# are left out because a wrapper would only time the call that creates them.
+OPERATIONS = tuple(
+    name for name, value in vars(Storage).items()
+    if callable(value) and not name.startswith('_')
+    and name not in ('named_lock', 'set_client', 'iter_catalog_rows')
+)
+
+
+def create_database(backend=None):
+    """Storage backend named by STORAGE_BACKEND (default mysql), not yet connected"""
+    backend = (backend or os.getenv('STORAGE_BACKEND', 'mysql')).lower()
+    if backend == 'mysql':
+        from database import DatabaseManager
+        return DatabaseManager()
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteDatabaseManager
+        return SQLiteDatabaseManager()
+    if backend == 'memory':
+        from memory_storage import MemoryDatabaseManager
+        return MemoryDatabaseManager()
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of {', '.join(STORAGE_BACKENDS)}")
+
+
+def copy_catalog(source, target, progress=None):
+    """Copy routes, stop aliases and buses from one connected backend into another; returns import counts"""
+    from catalog_import import CatalogImporter
+
+    routes = source.get_catalog()
+    if routes is None:
+        raise StorageError(f"Could not read the route catalog from {source.backend}")
+
+    # Stops keep their own position, not the lat/lng keys of the import format
+    for route in routes:
+        route['stops'] = [
+            dict(stop, lat=float(stop['latitude']), lng=float(stop['longitude'])) for stop in route['stops']
+        ]
+    counts = CatalogImporter(target, progress=progress).run(routes)
+
+    aliases = source.get_stop_aliases()
+    counts['stop_aliases'] = len(aliases)
+    if aliases and not target.upsert_stop_aliases(aliases):
+        raise StorageError(f"Could not write stop aliases to {target.backend}")
+    buses = source.get_buses()
+    counts['buses'] = len(buses)
+    if buses and not target.upsert_buses(buses):
+        raise StorageError(f"Could not write buses to {target.backend}")
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from database import print_import_progress
+
+    parser = argparse.ArgumentParser(description="Copy the route catalog between storage backends")
+    parser.add_argument('--from', dest='source', choices=STORAGE_BACKENDS, default='mysql')
+    # The memory backend is gone when this process exits, so it can only be a source
+    parser.add_argument('--to', dest='target', choices=('mysql', 'sqlite'), default='sqlite')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("--from and --to must name different backends")
+
+    source = create_database(args.source)
+    target = create_database(args.target)
+    # Filling a read-only edge database is exactly what this command is for
+    target.read_only = False
+    if not source.connect() or not target.connect():
+        print("Failed to connect to storage")
+        sys.exit(1)
+    target.ensure_schema(auto_migrate=True)
+
+    try:
+        counts = copy_catalog(source, target, progress=print_import_progress)
+    except StorageError as e:
+        print(f"Error copying catalog: {e}")
+        sys.exit(1)
+    finally:
+        source.disconnect()
+        target.disconnect()
+
+    print(f"Copied {counts['routes']} routes, {counts['stop_aliases']} stop aliases and "
+          f"{counts['buses']} buses from {args.source} to {args.target}")
+    sys.exit(0 if not counts['failed_batches'] else 1)
@@ -0,0 +1,189 @@
+import math
+
+from geo import haversine_km, stop_position
+from stop_index import fold_name
+
+INF = float('inf')
+
+
+class RoutePattern:
+    """One route's ordered stop sequence with cumulative in-vehicle minutes at each stop"""
+
+    def __init__(self, route, stops, stations):
+        self.route = route
+        self.stops = stops
+        self.stations = stations
+        self.headway = float(route.get('frequency') or 0)
+        self.offsets = self._offsets(route, stops)
+
+    @staticmethod
+    def _offsets(route, stops):
+        """Split the route duration over its stops in proportion to the distance between them"""
+        segments = [haversine_km(*stop_position(a), *stop_position(b)) for a, b in zip(stops, stops[1:])]
+        total = sum(segments)
+        if total <= 0:
+            segments = [1.0] * (len(stops) - 1)
+            total = float(len(segments))
+
+        duration = float(route.get('duration') or 0)
+        offsets = [0.0]
+        for segment in segments:
+            offsets.append(offsets[-1] + duration * segment / total)
+        return offsets
+
+
+class TransferPlanner:
+    """Round-based (RAPTOR-style) journey planner over the route catalog.
+
+    Routes only carry a frequency rather than a timetable, so times are
+    minutes since leaving the origin: in-vehicle time comes from each route's
+    duration split by stop distance, and every transfer costs a fixed walking
+    allowance plus half the headway of the route being boarded. Round k finds
+    the fastest journeys that use k buses, so the per-round results form the
+    duration/transfer trade-off the caller can rank.
+    """
+
+    def __init__(self, routes, transfer_minutes=10):
+        self.transfer_minutes = transfer_minutes
+        self.station_names = []
+        self.station_keys = {}
+        self.patterns = []
+        # station -> [(pattern index, position of the station in that pattern)]
+        self.station_patterns = []
+
+        for route in routes:
+            stops = sorted(route.get('stops') or [], key=lambda s: s['order'])
+            if len(stops) < 2:
+                continue
+            stations = [self._station(stop['name']) for stop in stops]
+            index = len(self.patterns)
+            self.patterns.append(RoutePattern(route, stops, stations))
+            for position, station in enumerate(stations[:-1]):
+                self.station_patterns[station].append((index, position))
+
+    def _station(self, name):
+        key = fold_name(name)
+        station = self.station_keys.get(key)
+        if station is None:
+            station = len(self.station_names)
+            self.station_keys[key] = station
+            self.station_names.append(name)
+            self.station_patterns.append([])
+        return station
+
+    def stations_for_names(self, names):
+        """Stations for a collection of stop names, e.g. resolved by the stop-name index"""
+        keys = {fold_name(name) for name in names}
+        return [self.station_keys[key] for key in keys if key in self.station_keys]
+
+    def plan_between(self, origins, destinations, max_transfers=2, limit=3):
+        """Fastest journeys between two sets of stations"""
+        destinations = set(destinations)
+        if not origins or not destinations:
+            return []
+        return self._raptor(list(origins), destinations, max_transfers, limit)
+
+    def _raptor(self, origins, destinations, max_transfers, limit):
+        count = len(self.station_names)
+        best = [INF] * count
+        tau_prev = [INF] * count
+        for station in origins:
+            best[station] = tau_prev[station] = 0.0
+
+        # parents[k][station] = (pattern, board position, alight position)
+        parents = [{}]
+        marked = set(origins)
+        target_best = INF
+        journeys = []
+
+        for k in range(1, max_transfers + 2):
+            if not marked:
+                break
+
+            # Earliest marked position on each pattern that serves a marked station
+            queue = {}
+            for station in marked:
+                for pattern_index, position in self.station_patterns[station]:
+                    if position < queue.get(pattern_index, INF):
+                        queue[pattern_index] = position
+
+            tau = tau_prev[:]
+            round_parents = {}
+            marked = set()
+            for pattern_index, start in queue.items():
+                pattern = self.patterns[pattern_index]
+                offsets = pattern.offsets
+                base = INF
+                board_position = None
+                wait = 0.0 if k == 1 else self.transfer_minutes + pattern.headway / 2
+
+                for position in range(start, len(pattern.stations)):
+                    station = pattern.stations[position]
+                    if board_position is not None:
+                        arrival = base + offsets[position]
+                        if arrival < best[station] and arrival < target_best:
+                            best[station] = tau[station] = arrival
+                            round_parents[station] = (pattern_index, board_position, position)
+                            marked.add(station)
+
+                    # Board here if that is earlier than the bus we are already on
+                    ready = tau_prev[station]
+                    if ready < INF and ready + wait - offsets[position] < base:
+                        base = ready + wait - offsets[position]
+                        board_position = position
+
+            parents.append(round_parents)
+            reached = [s for s in destinations if s in round_parents]
+            if reached:
+                station = min(reached, key=lambda s: tau[s])
+                target_best = min(target_best, tau[station])
+                journeys.append(self._journey(parents, k, station, tau[station]))
+            tau_prev = tau
+
+        journeys.sort(key=lambda j: (j['totalDuration'], j['totalFare'], j['transfers']))
+        return journeys[:limit]
+
+    def _journey(self, parents, k, station, arrival):
+        """Walk parent pointers back from the destination to build the legs"""
+        legs = []
+        while k > 0:
+            pattern_index, board_position, alight_position = parents[k][station]
+            pattern = self.patterns[pattern_index]
+            legs.append((pattern, board_position, alight_position))
+            station = pattern.stations[board_position]
+            k -= 1
+            # The boarding label may have been set in any earlier round
+            while k > 0 and station not in parents[k]:
+                k -= 1
+        legs.reverse()
+
+        formatted = [self._leg(number, *leg) for number, leg in enumerate(legs, start=1)]
+        return {
+            'type': 'transfer' if len(legs) > 1 else 'direct',
+            'routes': formatted,
+            'transferPoints': [leg['destination'] for leg in formatted[:-1]],
+            'totalFare': sum(leg['fare'] for leg in formatted),
+            'totalDuration': int(math.ceil(arrival)),
+            'transfers': len(legs) - 1
+        }
+
+    @staticmethod
+    def _leg(number, pattern, board_position, alight_position):
+        route = pattern.route
+        stops = pattern.stops[board_position:alight_position + 1]
+        total_stops = len(pattern.stops)
+        return {
+            'id': f"{route['id']}-leg{number}",
+            'routeId': route['id'],
+            'routeName': route['name'],
+            'name': f"{stops[0]['name']} - {stops[-1]['name']}",
+            'origin': stops[0]['name'],
+            'destination': stops[-1]['name'],
+            'type': route.get('type'),
+            'stops': [dict(stop, order=i + 1) for i, stop in enumerate(stops)],
+            # Proportional to the share of the route's stops, as the frontend does
+            'fare': int(math.ceil(float(route['fare']) * len(stops) / total_stops)),
+            'duration': int(math.ceil(pattern.offsets[alight_position] - pattern.offsets[board_position])),
+            'isTransferLeg': True,
+            'legNumber': number
+        }
@@ -1,6 +1,38 @@
 // API service for communicating with the backend
 const API_BASE_URL = process.env.REACT_APP_API_BASE_URL || 'http://10.41.168.210:5000/api';
 
+// Decode a Google encoded polyline (precision 5) into [lat, lng] pairs
+export const decodePolyline = (encoded) => {
+  const points = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+
+  while (index < encoded.length) {
+    const deltas = [];
+    for (let i = 0; i < 2; i++) {
+      let shift = 0;
+      let result = 0;
+      let byte;
+      do {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
+    }
+    lat += deltas[0];
+    lng += deltas[1];
+    points.push([lat / 1e5, lng / 1e5]);
+  }
+  return points;
+};
+
+// Routes carry their shape as an encoded polyline; expand it to coordinates for the map
+const withCoordinates = (route) => (
+  route.polyline !== undefined ? { ...route, coordinates: decodePolyline(route.polyline) } : route
+);
+
 class ApiService {
   constructor() {
     this.baseURL = API_BASE_URL;
@@ -37,17 +69,26 @@ class ApiService {
   }
 
   // Routes
-  async getRoutes(origin = null, destination = null) {
-    const params = new URLSearchParams();
+  // geometry: 'full', 'simplified' (optionally for a map zoom level) or 'none'
+  async getRoutes(origin = null, destination = null, geometry = 'simplified', zoom = null) {
+    const params = new URLSearchParams({ geometry });
     if (origin) params.append('origin', origin);
     if (destination) params.append('destination', destination);
+    if (zoom !== null) params.append('zoom', zoom.toString());
     
-    const queryString = params.toString();
-    return this.request(`/routes${queryString ? `?${queryString}` : ''}`);
+    const response = await this.request(`/routes?${params.toString()}`);
+    return { ...response, data: response.data.map(withCoordinates) };
+  }
+
+  async getRoute(routeId, geometry = 'full') {
+    const response = await this.request(`/routes/${routeId}?geometry=${geometry}`);
+    return { ...response, data: withCoordinates(response.data) };
   }
 
-  async getRoute(routeId) {
-    return this.request(`/routes/${routeId}`);
+  async getRoutesByIds(routeIds, geometry = 'simplified') {
+    const params = new URLSearchParams({ ids: routeIds.join(','), geometry });
+    const response = await this.request(`/routes?${params.toString()}`);
+    return { ...response, data: response.data.map(withCoordinates) };
   }
 
   async createRoute(routeData) {
@@ -66,6 +107,19 @@ class ApiService {
     return this.request(`/buses/live${queryString ? `?${queryString}` : ''}`);
   }
 
+  // Subscribe to live bus updates over Server-Sent Events instead of polling.
+  // Returns a function that closes the stream.
+  streamLiveBuses(routeId = null, { onSnapshot, onPositions } = {}) {
+    const params = new URLSearchParams();
+    if (routeId) params.append('route_id', routeId);
+
+    const queryString = params.toString();
+    const source = new EventSource(`${this.baseURL}/buses/stream${queryString ? `?${queryString}` : ''}`);
+    if (onSnapshot) source.addEventListener('snapshot', (event) => onSnapshot(JSON.parse(event.data)));
+    if (onPositions) source.addEventListener('positions', (event) => onPositions(JSON.parse(event.data)));
+    return () => source.close();
+  }
+
   async updateBusLocation(busId, locationData) {
     return this.request(`/buses/${busId}/location`, {
       method: 'POST',
@@ -74,6 +128,17 @@ class ApiService {
   }
 
   // Stop arrivals
+  async getNearbyStops(lat, lng, radiusKm = 1, limit = 10) {
+    const params = new URLSearchParams({
+      lat: lat.toString(),
+      lng: lng.toString(),
+      radius: radiusKm.toString(),
+      limit: limit.toString(),
+    });
+
+    return this.request(`/stops/nearby?${params.toString()}`);
+  }
+
   async getStopArrivals(stopId, limit = 10) {
     return this.request(`/stops/${stopId}/arrivals?limit=${limit}`);
   }
@@ -118,9 +183,12 @@ export const {
   healthCheck,
   getRoutes,
   getRoute,
+  getRoutesByIds,
   createRoute,
   getLiveBuses,
+  streamLiveBuses,
   updateBusLocation,
+  getNearbyStops,
   getStopArrivals,
   getUserFavorites,
   addUserFavorite,